@@ -0,0 +1,90 @@
+import asyncio
+import math
+from collections import deque
+
+from starlette.responses import JSONResponse
+
+class Limiter:
+    """Admission control for one class of routes: at most concurrency requests are served at once,
+    at most queue_size more wait for a slot, each for at most timeout seconds.
+
+    Anything beyond that is rejected at once with 503 and Retry-After, so a burst of one class
+    cannot make the others queue behind it for the DB threads. A concurrency of 0 admits everything.
+    Only used from the event loop thread."""
+
+    def __init__(self, name: str, concurrency: int, queue_size: int, timeout: float, retry_after: float):
+        self.name: str = name
+        self.concurrency: int = concurrency
+        self.queue_size: int = queue_size
+        self.timeout: float = timeout
+        self.retry_after: float = retry_after
+        self.active: int = 0
+        self.waiters: deque[asyncio.Future] = deque()
+        self.rejected: int = 0
+
+    async def acquire(self) -> bool:
+        if self.concurrency <= 0 or (self.active < self.concurrency and not self.waiters):
+            self.active += 1
+            return True
+        if len(self.waiters) >= self.queue_size:
+            self.rejected += 1
+            return False
+
+        #First come first served, release() hands its slot to the oldest waiter
+        waiter: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, self.timeout)
+        except asyncio.TimeoutError:
+            pass
+        except asyncio.CancelledError:
+            #The client went away, a slot handed over in the meantime goes to the next waiter
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            raise
+        finally:
+            if waiter in self.waiters:
+                self.waiters.remove(waiter)
+
+        if waiter.done() and not waiter.cancelled():
+            return True
+        self.rejected += 1
+        return False
+
+    def release(self) -> None:
+        while self.waiters:
+            waiter: asyncio.Future = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    def stats(self) -> dict:
+        return dict(
+            name            = self.name,
+            concurrency     = self.concurrency,
+            queue_size      = self.queue_size,
+            active          = self.active,
+            waiting         = len(self.waiters),
+            rejected        = self.rejected
+        )
+
+def limit(app, limiter: Limiter):
+    """Wraps the ASGI app of a route, the slot is held until the last body byte was sent, so streamed exports count too"""
+
+    async def limited_app(scope, receive, send):
+        if not await limiter.acquire():
+            response: JSONResponse = JSONResponse(
+                {"detail": f"Too many {limiter.name} requests, try again later."},
+                status_code = 503,
+                headers = {"Retry-After": str(math.ceil(limiter.retry_after))}
+            )
+            await response(scope, receive, send)
+            return
+
+        try:
+            await app(scope, receive, send)
+        finally:
+            limiter.release()
+
+    return limited_app
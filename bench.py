@@ -0,0 +1,341 @@
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import platform
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from collections import Counter
+from collections.abc import Callable
+
+#Drives the ASGI app in-process, so the numbers cover routing, validation, serialization and SQLite but no network.
+#The database path has to be set before db and main are imported
+DEFAULT_CONCURRENCY: str = "1,8,32"
+DEFAULT_REQUESTS: int = 500
+DEFAULT_WARMUP: int = 50
+
+class State:
+    """Ids the generated dataset holds, plus rows the write endpoints created and later ones may consume"""
+
+    def __init__(self, users: int, groups: int, seed: int):
+        self.users: int = users
+        self.groups: int = groups
+        self.rng: random.Random = random.Random(seed)
+        self.serial: itertools.count = itertools.count()
+        self.created_users: list[int] = []
+        self.created_groups: list[int] = []
+        self.created_relations: list[tuple[int, int]] = []
+        self.created_group_relations: list[tuple[int, int]] = []
+        self.created_jobs: list[int] = []
+        self.changes_since: int = 0
+
+    def user_id(self) -> int:
+        return self.rng.randint(1, self.users)
+
+    def group_id(self) -> int:
+        #Low group ids are the big groups of the skewed dataset
+        return min(int(self.rng.paretovariate(1.0)), self.groups)
+
+    def username_prefix(self) -> str:
+        #Matches a run of 1000 usernames
+        return f"user{self.user_id():07d}"[:-3]
+
+    def name(self, prefix: str) -> str:
+        return f"bench{prefix}{os.getpid()}x{next(self.serial)}"
+
+#Endpoint name -> function building (method, url, json body) for one request. Runs in this order, so deletes find
+#the rows the creates before them left behind, and the deletes that take out many relations come last
+Request = tuple[str, str, dict | list | None]
+
+def new_user(state: State) -> Request:
+    name: str = state.name("u")
+    return "POST", "/users/", dict(username = name, first_name = "Bench", last_name = "User", email = f"{name}@bench.test")
+
+def delete_user(state: State) -> Request:
+    user_id: int = state.created_users.pop() if state.created_users else state.users + 1
+    return "DELETE", f"/users/{user_id}", None
+
+def delete_group(state: State) -> Request:
+    group_id: int = state.created_groups.pop() if state.created_groups else state.groups + 1
+    return "DELETE", f"/groups/{group_id}", None
+
+def new_relation(state: State) -> Request:
+    user_id: int = state.user_id()
+    group_id: int = state.rng.randint(1, state.groups)
+    state.created_relations.append((user_id, group_id))
+    return "POST", "/relations/", dict(user_id = user_id, group_id = group_id)
+
+def created_relation(state: State) -> tuple[int, int]:
+    return state.created_relations.pop() if state.created_relations else (state.users + 1, state.groups + 1)
+
+def delete_relation(state: State) -> Request:
+    user_id, group_id = created_relation(state)
+    return "DELETE", "/relations/", dict(user_id = user_id, group_id = group_id)
+
+def new_group_relation(state: State) -> Request:
+    #Edges only point from a lower to a higher group id, so none of them closes a cycle
+    parent_id, child_id = sorted(state.rng.sample(range(1, state.groups + 1), 2))
+    state.created_group_relations.append((parent_id, child_id))
+    return "POST", "/relations/groups/", dict(parent_id = parent_id, child_id = child_id)
+
+def delete_group_relation(state: State) -> Request:
+    parent_id, child_id = state.created_group_relations.pop() if state.created_group_relations else (state.groups + 1, state.groups + 2)
+    return "DELETE", "/relations/groups/", dict(parent_id = parent_id, child_id = child_id)
+
+#Prefixes of the username, first name, last name and email of every generated user
+SHORT_PREFIXES: tuple[str, ...] = ("us", "fi", "la", "ex")
+
+ENDPOINTS: dict[str, Callable[[State], Request]] = {
+    "GET /users/":                  lambda state: ("GET", f"/users/?after_id={state.user_id()}&limit=100", None),
+    "GET /users/ prefix":           lambda state: ("GET", f"/users/?username_prefix={state.username_prefix()}&limit=100", None),
+    "GET /users/ ids":              lambda state: ("GET", "/users/?limit=100&" + "&".join(f"ids={state.user_id()}" for _ in range(100)), None),
+    "GET /users/ usernames":        lambda state: ("GET", "/users/?limit=100&" + "&".join(f"usernames=user{state.user_id():07d}" for _ in range(100)), None),
+    "GET /users/search":            lambda state: ("GET", f"/users/search?q={state.username_prefix()}", None),
+    #Two letters match nearly every user of the generated data, the worst case for ranking at a million users
+    "GET /users/search short":      lambda state: ("GET", f"/users/search?q={state.rng.choice(SHORT_PREFIXES)}", None),
+    "GET /users/export":            lambda state: ("GET", f"/users/export?username_prefix={state.username_prefix()}", None),
+    "GET /users/{id}":              lambda state: ("GET", f"/users/{state.user_id()}", None),
+    "POST /users/":                 new_user,
+    "POST /users/bulk":             lambda state: ("POST", "/users/bulk", [new_user(state)[2] for _ in range(100)]),
+    "PATCH /users/{id}":            lambda state: ("PATCH", f"/users/{state.user_id()}", dict(user_id = state.user_id(), first_name = state.name("f"))),
+    "DELETE /users/{id}":           delete_user,
+    "GET /groups/":                 lambda state: ("GET", f"/groups/?after_id={state.rng.randint(1, state.groups)}&limit=100", None),
+    "GET /groups/ ids":             lambda state: ("GET", "/groups/?limit=100&" + "&".join(f"ids={state.group_id()}" for _ in range(100)), None),
+    "GET /groups/search":           lambda state: ("GET", f"/groups/search?q=group{state.rng.randint(1, state.groups):06d}"[:-1], None),
+    "GET /groups/export":           lambda state: ("GET", f"/groups/export?name_prefix=group00{state.rng.randint(0, 9)}", None),
+    "GET /groups/{id}":             lambda state: ("GET", f"/groups/{state.group_id()}", None),
+    "GET /groups/stats":            lambda state: ("GET", "/groups/stats?limit=100", None),
+    "POST /groups/":                lambda state: ("POST", "/groups/", dict(name = state.name("g"), description = "Bench group")),
+    "POST /groups/bulk":            lambda state: ("POST", "/groups/bulk", [dict(name = state.name("g"), description = "Bench group") for _ in range(100)]),
+    "PATCH /groups/{id}":           lambda state: ("PATCH", f"/groups/{state.group_id()}", dict(group_id = state.group_id(), description = state.name("d"))),
+    "DELETE /groups/{id}":          delete_group,
+    "GET /relations/":              lambda state: ("GET", f"/relations/?after_user_id={state.user_id()}&after_group_id=1&limit=100", None),
+    "GET /relations/export":        lambda state: ("GET", f"/relations/export?user_id={state.user_id()}", None),
+    "GET /relations/user/{id}":     lambda state: ("GET", f"/relations/user/{state.user_id()}", None),
+    "GET /relations/group/{id}":    lambda state: ("GET", f"/relations/group/{state.rng.randint(1, state.groups)}", None),
+    "GET /relations/group/{id}/users": lambda state: ("GET", f"/relations/group/{state.group_id()}/users?limit=100", None),
+    "GET /relations/group/{id}/users effective": lambda state: ("GET", f"/relations/group/{state.group_id()}/users?limit=100&effective=true", None),
+    "GET /relations/user/{id}/groups effective": lambda state: ("GET", f"/relations/user/{state.user_id()}/groups?effective=true", None),
+    "POST /relations/groups/":      new_group_relation,
+    "GET /relations/group/{id}/subgroups": lambda state: ("GET", f"/relations/group/{state.rng.randint(1, state.groups)}/subgroups?nested=true", None),
+    "GET /relations/group/{id}/supergroups": lambda state: ("GET", f"/relations/group/{state.rng.randint(1, state.groups)}/supergroups?nested=true", None),
+    "POST /relations/":             new_relation,
+    "POST /batch":                  lambda state: ("POST", "/batch", [
+        dict(op = "add_user", data = dict(username = state.name("u"), email = f"{state.name('e')}@bench.example")),
+        dict(op = "add_group", data = dict(name = state.name("g"), description = "Bench group")),
+        dict(op = "add_relation", data = dict(user_id = "$0", group_id = "$1")),
+        dict(op = "add_relation", data = dict(user_id = "$0", group_id = state.group_id()))
+    ]),
+    "POST /relations/bulk":         lambda state: ("POST", "/relations/bulk", [new_relation(state)[2] for _ in range(100)]),
+    "DELETE /relations/":           delete_relation,
+    "DELETE /relations/groups/":    delete_group_relation,
+    "GET /membership/{uid}/{gid}":  lambda state: ("GET", f"/membership/{state.user_id()}/{state.group_id()}", None),
+    "GET /membership/users":        lambda state: ("GET", f"/membership/users?all_of={state.group_id()}&any_of={state.group_id()}&any_of={state.group_id()}", None),
+    "GET /changes/":                lambda state: ("GET", f"/changes/?since={state.changes_since}&limit=100", None),
+    "GET /admin/cache":             lambda state: ("GET", "/admin/cache", None),
+    "GET /admin/admission":         lambda state: ("GET", "/admin/admission", None),
+    "GET /admin/snapshot":          lambda state: ("GET", "/admin/snapshot", None),
+    "GET /metrics":                 lambda state: ("GET", "/metrics", None),
+    "DELETE /relations/user/{id}":  lambda state: ("DELETE", f"/relations/user/{created_relation(state)[0]}", None),
+    "DELETE /relations/group/{id}": lambda state: ("DELETE", f"/relations/group/{created_relation(state)[1]}", None),
+    #The jobs the deletes above started, if any of them was large enough to get one
+    "GET /jobs/{id}":               lambda state: ("GET", f"/jobs/{state.rng.choice(state.created_jobs) if state.created_jobs else 1}", None),
+}
+
+#Responses compressed at every level by --compression, for the CPU time against the bytes saved
+COMPRESSION_SAMPLES: dict[str, str] = {
+    "GET /relations/":          "/relations/?limit=1000",
+    "GET /users/":              "/users/?limit=1000",
+    "GET /groups/":             "/groups/?limit=1000",
+    "GET /relations/export":    "/relations/export?group_id=1"
+}
+COMPRESSION_LEVELS: dict[str, tuple[int, ...]] = {
+    "gzip": (1, 2, 3, 4, 5, 6, 7, 8, 9),
+    "zstd": (1, 2, 3, 4, 6, 9, 12, 15, 19)
+}
+COMPRESSION_REPEAT: int = 20
+
+def percentile(ordered: list[float], fraction: float) -> float:
+    #Nearest rank on an already sorted list
+    return ordered[min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))]
+
+async def run_level(client, state: State, build: Callable[[State], Request], concurrency: int, requests: int) -> dict:
+    latencies: list[float] = []
+    statuses: Counter = Counter()
+    remaining: itertools.count = itertools.count()
+
+    async def worker():
+        while next(remaining) < requests:
+            method, url, body = build(state)
+            started: float = time.perf_counter()
+            response = await client.request(method, url, json = body)
+            latencies.append(time.perf_counter() - started)
+            statuses[response.status_code] += 1
+            if method == "POST" and response.status_code == 200:
+                if url == "/users/":
+                    state.created_users.append(response.json()["user_id"])
+                elif url == "/groups/":
+                    state.created_groups.append(response.json()["group_id"])
+            elif response.status_code == 202:
+                state.created_jobs.append(response.json()["job_id"])
+
+    started: float = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed: float = time.perf_counter() - started
+
+    latencies.sort()
+    return dict(
+        concurrency = concurrency,
+        requests    = len(latencies),
+        throughput  = round(len(latencies) / elapsed, 1),
+        mean_ms     = round(1000 * sum(latencies) / len(latencies), 3),
+        p50_ms      = round(1000 * percentile(latencies, 0.50), 3),
+        p95_ms      = round(1000 * percentile(latencies, 0.95), 3),
+        p99_ms      = round(1000 * percentile(latencies, 0.99), 3),
+        statuses    = {str(status): count for status, count in sorted(statuses.items())}
+    )
+
+async def run(args, counts: dict) -> list[dict]:
+    import httpx
+    import db
+    import main
+
+    state: State = State(counts["users"], counts["groups"], args.seed)
+    selected: list[str] = [name for name in ENDPOINTS if not args.endpoint or any(part in name for part in args.endpoint)]
+    results: list[dict] = []
+    async with main.app.router.lifespan_context(main.app):
+        #A client catching up on the last hundred changes, well inside the kept change log
+        state.changes_since = max(db.cursor().execute("SELECT COALESCE(MAX(Seq), 0) FROM Changes").fetchone()[0] - 100, 0)
+        transport = httpx.ASGITransport(app = main.app)
+        async with httpx.AsyncClient(transport = transport, base_url = "http://bench") as client:
+            for name in selected:
+                await run_level(client, state, ENDPOINTS[name], 1, args.warmup)
+                for concurrency in args.concurrency:
+                    result: dict = dict(endpoint = name, **await run_level(client, state, ENDPOINTS[name], concurrency, args.requests))
+                    print(f"{name:32} c={concurrency:<4} {result['throughput']:>9.1f} req/s  "
+                          f"p50 {result['p50_ms']:>8.2f}ms  p95 {result['p95_ms']:>8.2f}ms  p99 {result['p99_ms']:>8.2f}ms  {result['statuses']}",
+                          file = sys.stderr)
+                    results.append(result)
+    return results
+
+async def run_compression(args) -> list[dict]:
+    import httpx
+    import compression
+    import main
+
+    results: list[dict] = []
+    async with main.app.router.lifespan_context(main.app):
+        transport = httpx.ASGITransport(app = main.app)
+        async with httpx.AsyncClient(transport = transport, base_url = "http://bench") as client:
+            for encoding in COMPRESSION_LEVELS.keys() - compression.COMPRESSORS.keys():
+                print(f"{encoding} is not available, skipped", file = sys.stderr)
+            for name, url in COMPRESSION_SAMPLES.items():
+                body: bytes = (await client.get(url, headers = {"Accept-Encoding": "identity"})).content
+                for encoding, levels in COMPRESSION_LEVELS.items():
+                    if encoding not in compression.COMPRESSORS:
+                        continue
+                    for level in levels:
+                        started: float = time.perf_counter()
+                        for _ in range(COMPRESSION_REPEAT):
+                            compressor = compression.COMPRESSORS[encoding](level)
+                            compressed: bytes = compressor.compress(body) + compressor.flush()
+                        seconds: float = (time.perf_counter() - started) / COMPRESSION_REPEAT
+                        result: dict = dict(
+                            sample      = name,
+                            encoding    = encoding,
+                            level       = level,
+                            bytes       = len(body),
+                            compressed  = len(compressed),
+                            ratio       = round(len(body) / len(compressed), 2),
+                            ms          = round(1000 * seconds, 3),
+                            mb_per_s    = round(len(body) / seconds / 1e6, 1)
+                        )
+                        print(f"{name:24} {encoding:4} {level:>2}  {result['bytes']:>9} -> {result['compressed']:>8} bytes  "
+                              f"x{result['ratio']:<6} {result['ms']:>8.3f}ms  {result['mb_per_s']:>7.1f} MB/s", file = sys.stderr)
+                        results.append(result)
+    return results
+
+def compare(baseline: dict, current: dict) -> None:
+    #Relative change of p50 and p99 per endpoint and concurrency, positive means slower than the baseline
+    previous: dict = {(result["endpoint"], result["concurrency"]): result for result in baseline["results"]}
+    for result in current["results"]:
+        old: dict | None = previous.get((result["endpoint"], result["concurrency"]))
+        if old is None:
+            continue
+        changes: list[str] = [
+            f"{key.removesuffix('_ms')} {100 * (result[key] / old[key] - 1):+6.1f}%"
+            for key in ("p50_ms", "p99_ms") if old[key] > 0
+        ]
+        print(f"{result['endpoint']:32} c={result['concurrency']:<4} {'  '.join(changes)}", file = sys.stderr)
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description = "Latency and throughput of every route against a synthetic dataset")
+    parser.add_argument("--users", type = int, default = 10000)
+    parser.add_argument("--groups", type = int, default = 1000)
+    parser.add_argument("--memberships", type = int, default = 4, help = "Average groups per user")
+    parser.add_argument("--skew", type = float, default = 1.1, help = "Zipf exponent of group sizes")
+    parser.add_argument("--seed", type = int, default = 1)
+    parser.add_argument("--db", help = "Database file to use, generated if missing. Defaults to a temporary file")
+    parser.add_argument("--concurrency", type = lambda value: [int(level) for level in value.split(",")], default = DEFAULT_CONCURRENCY,
+                        help = "Comma separated concurrency levels")
+    parser.add_argument("--requests", type = int, default = DEFAULT_REQUESTS, help = "Requests per endpoint and concurrency level")
+    parser.add_argument("--warmup", type = int, default = DEFAULT_WARMUP, help = "Unrecorded requests per endpoint before measuring")
+    parser.add_argument("--endpoint", action = "append", help = "Only run endpoints whose name contains this, can be repeated")
+    parser.add_argument("--output", help = "Write the JSON report here instead of stdout")
+    parser.add_argument("--baseline", help = "JSON report of an earlier run to compare against")
+    parser.add_argument("--compression", action = "store_true",
+                        help = "Instead of the endpoints, measure compressing sample responses at every gzip and zstd level")
+    args = parser.parse_args()
+
+    workdir: str = tempfile.mkdtemp(prefix = "userdb-bench-")
+    db_path: str = args.db or os.path.join(workdir, "bench.sqlite3")
+    os.environ["USERDB_PATH"] = db_path
+    os.environ.setdefault("USERDB_SNAPSHOT_DIR", os.path.join(workdir, "snapshots"))
+
+    import datagen
+    import db
+
+    started: float = time.perf_counter()
+    if os.path.exists(db_path) and os.path.getsize(db_path) > 0:
+        db.init_db()
+        cur: sqlite3.Cursor = db.cursor()
+        counts: dict = {
+            table: cur.execute(f"SELECT COALESCE(MAX({column}), 0) FROM {name}").fetchone()[0]
+            for table, name, column in (("users", "Users", "UserID"), ("groups", "UserGroups", "GroupID"))
+        }
+        counts["relations"] = cur.execute("SELECT COUNT(*) FROM Relations").fetchone()[0]
+    else:
+        counts = datagen.generate(args.users, args.groups, args.memberships, args.skew, args.seed)
+    print(f"Dataset {counts} ready in {time.perf_counter() - started:.1f}s", file = sys.stderr)
+
+    report: dict = dict(
+        environment = dict(
+            python  = platform.python_version(),
+            sqlite  = sqlite3.sqlite_version,
+            machine = platform.machine(),
+            system  = platform.system()
+        ),
+        dataset     = dict(counts, memberships = args.memberships, skew = args.skew, seed = args.seed),
+        settings    = dict(concurrency = args.concurrency, requests = args.requests, warmup = args.warmup),
+        results     = asyncio.run(run(args, counts)) if not args.compression else []
+    )
+    if args.compression:
+        report["compression"] = asyncio.run(run_compression(args))
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            compare(json.load(file), report)
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent = 2)
+    else:
+        json.dump(report, sys.stdout, indent = 2)
+        print()
+
+if __name__ == "__main__":
+    main()
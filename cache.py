@@ -0,0 +1,96 @@
+import time
+from collections import OrderedDict
+from collections.abc import Hashable, Iterable
+from typing import Any
+
+class LRUCache:
+    """Bounded read-through cache with LRU eviction and a time to live per entry.
+
+    Entries can carry tags, so one write can drop every entry that depends on the same row.
+    Readers take a token before querying and pass it to set(), a result read before an
+    invalidation is then discarded instead of caching stale data.
+    Only used from the event loop thread, so it needs no locking."""
+
+    def __init__(self, name: str, maxsize: int, ttl: float):
+        self.name: str = name
+        self.maxsize: int = maxsize
+        self.ttl: float = ttl
+        self.entries: OrderedDict = OrderedDict()
+        self.tags: dict[Hashable, set] = {}
+        self.generation: int = 0
+
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+        self.expirations: int = 0
+
+    def get(self, key: Hashable) -> Any | None:
+        entry: tuple | None = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        value, expires, _ = entry
+        if expires < time.monotonic():
+            self.expirations += 1
+            self.misses += 1
+            self.remove(key)
+            return None
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def token(self) -> int:
+        return self.generation
+
+    def set(self, key: Hashable, value: Any, token: int, tags: Iterable[Hashable] = ()) -> None:
+        if token != self.generation or self.maxsize <= 0:
+            return
+
+        self.remove(key)
+        entry_tags: tuple = tuple(tags)
+        self.entries[key] = (value, time.monotonic() + self.ttl, entry_tags)
+        for tag in entry_tags:
+            self.tags.setdefault(tag, set()).add(key)
+
+        while len(self.entries) > self.maxsize:
+            self.remove(next(iter(self.entries)))
+            self.evictions += 1
+
+    def remove(self, key: Hashable) -> None:
+        entry: tuple | None = self.entries.pop(key, None)
+        if entry is None:
+            return
+
+        for tag in entry[2]:
+            keys: set = self.tags[tag]
+            keys.discard(key)
+            if not keys:
+                del self.tags[tag]
+
+    def invalidate(self, key: Hashable) -> None:
+        self.generation += 1
+        self.remove(key)
+
+    def invalidate_tag(self, tag: Hashable) -> None:
+        self.generation += 1
+        for key in list(self.tags.get(tag, ())):
+            self.remove(key)
+
+    def clear(self) -> None:
+        self.generation += 1
+        self.entries.clear()
+        self.tags.clear()
+
+    def stats(self) -> dict:
+        return dict(
+            name        = self.name,
+            size        = len(self.entries),
+            maxsize     = self.maxsize,
+            ttl         = self.ttl,
+            hits        = self.hits,
+            misses      = self.misses,
+            evictions   = self.evictions,
+            expirations = self.expirations
+        )
@@ -0,0 +1,34 @@
+import asyncio
+import json
+
+class ChangeNotifier:
+    """Lets change feed subscribers sleep until this worker commits a write.
+
+    Writes of other workers are not signalled here, so subscribers also wake up after a timeout
+    and poll the change log for them. Only used from the event loop thread."""
+
+    def __init__(self):
+        self.waiter: asyncio.Future | None = None
+
+    def notify(self) -> None:
+        if self.waiter is not None and not self.waiter.done():
+            self.waiter.set_result(None)
+        self.waiter = None
+
+    async def wait(self, timeout: float) -> None:
+        if self.waiter is None:
+            self.waiter = asyncio.get_running_loop().create_future()
+        try:
+            #Shielded, a subscriber timing out must not cancel the future the others wait on
+            await asyncio.wait_for(asyncio.shield(self.waiter), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+def sse_event(event: str, data: dict, event_id: int | None = None) -> str:
+    #One Server-Sent Events message, the id lets a reconnecting client resume through Last-Event-ID
+    lines: list[str] = [f"id: {event_id}"] if event_id is not None else []
+    lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data, ensure_ascii = False, separators = (',', ':'))}")
+    return "\n".join(lines) + "\n\n"
+
+SSE_KEEPALIVE: str = ": keepalive\n\n"
@@ -0,0 +1,151 @@
+import zlib
+from collections.abc import Callable
+from typing import Any
+
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+#Response compression negotiated through Accept-Encoding. zstd needs the optional zstandard package,
+#without it only gzip is offered
+def gzip_compressor(level: int) -> Any:
+    return zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+def zstd_compressor(level: int) -> Any:
+    return zstandard.ZstdCompressor(level = level).compressobj()
+
+#Encoding -> factory of a compressor with compress() and flush(), in order of preference when a client accepts several
+COMPRESSORS: dict[str, Callable[[int], Any]] = {"zstd": zstd_compressor, "gzip": gzip_compressor} if zstandard is not None else {"gzip": gzip_compressor}
+
+#Streams that must reach the client event by event, and bodies that are compressed already
+UNCOMPRESSED_TYPES: tuple[str, ...] = ("text/event-stream", "image/", "application/zip", "application/gzip")
+
+def negotiate(accept_encoding: str, encodings: list[str]) -> str | None:
+    #The encoding of ours the client weighs highest, ties go to our preference. q=0 refuses an encoding
+    weights: dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        name, _, parameters = part.partition(";")
+        weight: float = 1.0
+        for parameter in parameters.split(";"):
+            key, _, value = parameter.strip().partition("=")
+            if key == "q":
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        weights[name.strip().lower()] = weight
+
+    best: str | None = None
+    best_weight: float = 0.0
+    for encoding in encodings:
+        weight: float = weights.get(encoding, weights.get("*", 0.0))
+        if weight > best_weight:
+            best, best_weight = encoding, weight
+    return best
+
+class CompressionMiddleware:
+    """Plain ASGI middleware compressing response bodies of at least minimum_size bytes.
+
+    Bodies sent in one message are compressed whole and keep a Content-Length. Streamed bodies are
+    buffered until they reach minimum_size and then compressed chunk by chunk as they are sent,
+    so exports are never held in memory. Every response that could be compressed gets Vary: Accept-Encoding.
+    levels maps an encoding to its compression level, an encoding with level 0 is not offered"""
+
+    def __init__(self, app, minimum_size: int, levels: dict[str, int]):
+        self.app = app
+        self.minimum_size: int = minimum_size
+        self.levels: dict[str, int] = {encoding: level for encoding, level in levels.items() if encoding in COMPRESSORS and level > 0}
+        self.encodings: list[str] = [encoding for encoding in COMPRESSORS if encoding in self.levels]
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        encoding: str | None = negotiate(Headers(scope = scope).get("accept-encoding", ""), self.encodings)
+        responder: CompressedResponder = CompressedResponder(send, encoding, self.levels.get(encoding, 0), self.minimum_size)
+        await self.app(scope, receive, responder.send)
+
+class CompressedResponder:
+    def __init__(self, send, encoding: str | None, level: int, minimum_size: int):
+        self.downstream = send
+        self.encoding: str | None = encoding
+        self.level: int = level
+        self.minimum_size: int = minimum_size
+        self.start: dict | None = None
+        self.buffer: list[bytes] = []
+        self.buffered: int = 0
+        self.compressor: Any = None
+        self.passthrough: bool = False
+
+    async def send(self, message: dict):
+        if self.passthrough:
+            await self.downstream(message)
+            return
+
+        if message["type"] == "http.response.start":
+            headers: MutableHeaders = MutableHeaders(scope = message)
+            content_type: str = headers.get("content-type", "")
+            if (message["status"] < 200 or message["status"] in (204, 304) or "content-encoding" in headers
+                    or content_type.startswith(UNCOMPRESSED_TYPES)):
+                self.passthrough = True
+                await self.downstream(message)
+                return
+
+            headers.add_vary_header("Accept-Encoding")
+            if self.encoding is None:
+                self.passthrough = True
+                await self.downstream(message)
+                return
+
+            #Held back until the body shows whether it is worth compressing
+            self.start = message
+            return
+
+        if message["type"] != "http.response.body":
+            await self.downstream(message)
+            return
+
+        body: bytes = message.get("body", b"")
+        more_body: bool = message.get("more_body", False)
+        if self.compressor is not None:
+            await self.send_compressed(body, more_body)
+            return
+
+        self.buffer.append(body)
+        self.buffered += len(body)
+        if self.buffered < self.minimum_size:
+            if more_body:
+                return
+            #Too small to gain anything, sent as it is
+            self.passthrough = True
+            await self.downstream(self.start)
+            await self.downstream(dict(type = "http.response.body", body = b"".join(self.buffer)))
+            return
+
+        headers: MutableHeaders = MutableHeaders(scope = self.start)
+        headers["Content-Encoding"] = self.encoding
+        self.compressor = COMPRESSORS[self.encoding](self.level)
+        body = b"".join(self.buffer)
+        self.buffer = []
+        if more_body:
+            del headers["Content-Length"]
+            await self.downstream(self.start)
+            await self.send_compressed(body, True)
+        else:
+            compressed: bytes = self.compressor.compress(body) + self.compressor.flush()
+            headers["Content-Length"] = str(len(compressed))
+            await self.downstream(self.start)
+            await self.downstream(dict(type = "http.response.body", body = compressed))
+
+    async def send_compressed(self, body: bytes, more_body: bool):
+        compressed: bytes = self.compressor.compress(body)
+        if not more_body:
+            compressed += self.compressor.flush()
+        elif not compressed:
+            #The compressor keeps small chunks until it has a block worth emitting
+            return
+        await self.downstream(dict(type = "http.response.body", body = compressed, more_body = more_body))
@@ -0,0 +1,80 @@
+import argparse
+import itertools
+import random
+import time
+from collections.abc import Iterator
+from sqlite3 import Cursor
+
+import db
+
+#Group popularity follows a Zipf-like curve, a few groups hold most of the memberships like real directories
+DEFAULT_USERS: int = 10000
+DEFAULT_GROUPS: int = 1000
+DEFAULT_MEMBERSHIPS: int = 4
+DEFAULT_SKEW: float = 1.1
+DEFAULT_SEED: int = 1
+
+INSERT_CHUNK_SIZE: int = 10000
+
+def user_rows(users: int) -> Iterator[tuple[str, str, str, str]]:
+    for user_id in range(1, users + 1):
+        yield (f"user{user_id:07d}", f"First{user_id % 997}", f"Last{user_id % 9973}", f"user{user_id:07d}@example{user_id % 10}.com")
+
+def group_rows(groups: int) -> Iterator[tuple[str, str]]:
+    for group_id in range(1, groups + 1):
+        yield (f"group{group_id:06d}", f"Synthetic group {group_id}")
+
+def relation_rows(users: int, groups: int, memberships: int, skew: float, rng: random.Random) -> Iterator[tuple[int, int]]:
+    #Each user joins between 1 and 2 * memberships - 1 groups, drawn by rank weight 1 / rank ** skew
+    cum_weights: list[float] = list(itertools.accumulate(1 / rank ** skew for rank in range(1, groups + 1)))
+    group_ids: range = range(1, groups + 1)
+    for user_id in range(1, users + 1):
+        count: int = rng.randint(1, max(1, 2 * memberships - 1))
+        for group_id in sorted(set(rng.choices(group_ids, cum_weights = cum_weights, k = count))):
+            yield (user_id, group_id)
+
+def insert_chunked(query: str, rows: Iterator[tuple]) -> int:
+    cur: Cursor = db.cursor()
+    inserted: int = 0
+    while chunk := list(itertools.islice(rows, INSERT_CHUNK_SIZE)):
+        cur.executemany(query, chunk)
+        inserted += len(chunk)
+    return inserted
+
+def generate(users: int = DEFAULT_USERS, groups: int = DEFAULT_GROUPS, memberships: int = DEFAULT_MEMBERSHIPS,
+             skew: float = DEFAULT_SKEW, seed: int = DEFAULT_SEED) -> dict:
+    """Fills an empty database at USERDB_PATH with synthetic users, groups and relations in one transaction.
+    The same arguments always produce the same data"""
+
+    db.init_db()
+    cur: Cursor = db.cursor()
+    cur.execute("SELECT EXISTS (SELECT 1 FROM Users) OR EXISTS (SELECT 1 FROM UserGroups)")
+    if cur.fetchone()[0]:
+        raise ValueError(f"Database {db.DB_PATH} is not empty")
+
+    rng: random.Random = random.Random(seed)
+    with cur.connection:
+        counts: dict = dict(
+            users       = insert_chunked("INSERT INTO Users (Username, FirstName, LastName, Email) VALUES (?, ?, ?, ?)", user_rows(users)),
+            groups      = insert_chunked("INSERT INTO UserGroups (Name, Description) VALUES (?, ?)", group_rows(groups)),
+            relations   = insert_chunked("INSERT INTO Relations (UserID, GroupID) VALUES (?, ?)", relation_rows(users, groups, memberships, skew, rng))
+        )
+    cur.execute("ANALYZE")
+    return counts
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description = "Fills the database at USERDB_PATH with synthetic data")
+    parser.add_argument("--users", type = int, default = DEFAULT_USERS)
+    parser.add_argument("--groups", type = int, default = DEFAULT_GROUPS)
+    parser.add_argument("--memberships", type = int, default = DEFAULT_MEMBERSHIPS, help = "Average groups per user")
+    parser.add_argument("--skew", type = float, default = DEFAULT_SKEW, help = "Zipf exponent of group sizes, 0 makes them uniform")
+    parser.add_argument("--seed", type = int, default = DEFAULT_SEED)
+    args = parser.parse_args()
+
+    started: float = time.perf_counter()
+    counts: dict = generate(args.users, args.groups, args.memberships, args.skew, args.seed)
+    print(f"Generated {counts['users']} users, {counts['groups']} groups and {counts['relations']} relations "
+          f"in {db.DB_PATH} in {time.perf_counter() - started:.1f}s")
+
+if __name__ == "__main__":
+    main()
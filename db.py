@@ -1,40 +1,584 @@
+import asyncio
+import functools
+import json
+import operator
+import os
+import queue
+import re
 import sqlite3
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
 from sqlite3 import Connection, Cursor
+from typing import Any, Callable, TypeVar
 
-con: Connection = sqlite3.connect(':memory:')
-cur: Cursor = con.cursor()
+import metrics
 
-def init_db() -> None:
-    #Init in-memory DB
-    con.execute("PRAGMA foreign_keys = ON")
+#Storage settings, every worker process opens the same database file
+DB_PATH: str = os.environ.get("USERDB_PATH", "userdb.sqlite3")
+DB_BUSY_TIMEOUT: float = float(os.environ.get("USERDB_BUSY_TIMEOUT", "5.0"))
+DB_SYNCHRONOUS: str = os.environ.get("USERDB_SYNCHRONOUS", "NORMAL")
+DB_CACHE_SIZE_KIB: int = int(os.environ.get("USERDB_CACHE_SIZE_KIB", "65536"))
+DB_MMAP_SIZE: int = int(os.environ.get("USERDB_MMAP_SIZE", str(256 * 1024 * 1024)))
+DB_THREADS: int = int(os.environ.get("USERDB_THREADS", "4"))
+
+#Write scheduler settings, a batch takes whatever is queued up to the size and may wait up to the window for more
+WRITE_BATCH_SIZE: int = int(os.environ.get("USERDB_WRITE_BATCH_SIZE", "256"))
+WRITE_BATCH_WINDOW: float = float(os.environ.get("USERDB_WRITE_BATCH_WINDOW", "0"))
+
+#Change log settings, the newest entries are kept and older ones pruned as new ones come in
+CHANGE_LOG_SIZE: int = int(os.environ.get("USERDB_CHANGE_LOG_SIZE", "100000"))
+
+#Delete job settings, a user or group with more relations than a chunk is hidden at once and its relations
+#are deleted one chunk per write in the background, so no single write holds the writer for long
+DELETE_CHUNK_SIZE: int = int(os.environ.get("USERDB_DELETE_CHUNK_SIZE", "1000"))
+
+#Snapshot settings, an interval of 0 turns periodic snapshots off
+SNAPSHOT_DIR: str = os.environ.get("USERDB_SNAPSHOT_DIR", "snapshots")
+SNAPSHOT_INTERVAL: float = float(os.environ.get("USERDB_SNAPSHOT_INTERVAL", "0"))
+SNAPSHOT_KEEP: int = int(os.environ.get("USERDB_SNAPSHOT_KEEP", "3"))
+SNAPSHOT_PREFIX: str = "userdb-"
+SNAPSHOT_SUFFIX: str = ".sqlite3"
+
+T = TypeVar("T")
+
+def connect(path: str = DB_PATH) -> Connection:
+    #WAL lets readers in all workers run alongside the single writer, NORMAL sync is durable in WAL mode except on power loss
+    connection: Connection = sqlite3.connect(path, timeout = DB_BUSY_TIMEOUT)
+    connection.execute("PRAGMA journal_mode = WAL")
+    connection.execute(f"PRAGMA synchronous = {DB_SYNCHRONOUS}")
+    connection.execute(f"PRAGMA cache_size = -{DB_CACHE_SIZE_KIB}")
+    connection.execute(f"PRAGMA mmap_size = {DB_MMAP_SIZE}")
+    connection.execute("PRAGMA foreign_keys = ON")
+    return connection
+
+#Query functions below are blocking, each thread running them has a connection of its own
+_local: threading.local = threading.local()
+
+def cursor() -> Cursor:
+    if not hasattr(_local, "con"):
+        _local.con = connect()
+    return _local.con.cursor()
+
+#Reads run on a pool of DB threads with read-only connections. Each read function runs in one read transaction,
+#so all of its queries see the same snapshot while the writer keeps committing, and a reader never waits for the writer
+_readers: ThreadPoolExecutor = ThreadPoolExecutor(max_workers = DB_THREADS, thread_name_prefix = "userdb-reader")
+
+def reader() -> Connection:
+    #Transactions are managed by hand, query_only refuses any write that would slip into a read function
+    if not hasattr(_local, "con"):
+        _local.con = connect()
+        _local.con.execute("PRAGMA query_only = ON")
+        _local.con.isolation_level = None
+    return _local.con
+
+def read_snapshot(func: Callable[..., T], *args: Any) -> T:
+    #The snapshot is taken by the first query, rolling back ends it so the WAL can be checkpointed past it
+    con: Connection = reader()
+    con.execute("BEGIN")
+    try:
+        return metrics.timed(func, *args)
+    finally:
+        con.execute("ROLLBACK")
+
+async def read(func: Callable[..., T], *args: Any) -> T:
+    #Await a read function without blocking the event loop
+    loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+    started: float = time.perf_counter()
+    try:
+        return await loop.run_in_executor(_readers, functools.partial(read_snapshot, func, *args))
+    finally:
+        metrics.add_request_db_seconds(time.perf_counter() - started)
 
+#Schema setup, snapshots and restores need a connection that may write outside the writer's batches, they take turns on one thread
+_executor: ThreadPoolExecutor = ThreadPoolExecutor(max_workers = 1, thread_name_prefix = "userdb")
+
+async def run(func: Callable[..., T], *args: Any) -> T:
+    #Await a maintenance function without blocking the event loop
+    loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+    started: float = time.perf_counter()
+    try:
+        return await loop.run_in_executor(_executor, functools.partial(metrics.timed, func, *args))
+    finally:
+        metrics.add_request_db_seconds(time.perf_counter() - started)
+
+#Mutating functions never commit themselves, they are queued to one writer thread that commits them in batches
+_write_queue: queue.Queue = queue.Queue()
+_writer_lock: threading.Lock = threading.Lock()
+_writer: threading.Thread | None = None
+
+#Called on the event loop after each committed write, e.g. to wake change feed subscribers
+commit_listeners: list[Callable[[], None]] = []
+
+async def write(func: Callable[..., T], *args: Any) -> T:
+    #Await a mutating function, returns once the batch it ran in has been committed
+    start_writer()
+    future: Future = Future()
+    _write_queue.put((func, args, future))
+    started: float = time.perf_counter()
+    try:
+        result: T = await asyncio.wrap_future(future)
+    finally:
+        metrics.add_request_db_seconds(time.perf_counter() - started)
+
+    for listener in commit_listeners:
+        listener()
+    return result
+
+def write_queue_length() -> int:
+    return _write_queue.qsize()
+
+def start_writer() -> None:
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = threading.Thread(target = writer_loop, name = "userdb-writer", daemon = True)
+            _writer.start()
+
+def writer_loop() -> None:
+    #Transactions are managed by hand on the writer connection
+    _local.con = connect()
+    _local.con.isolation_level = None
+    while True:
+        batch: list[tuple[Callable, tuple, Future]] = [_write_queue.get()]
+        deadline: float = time.monotonic() + WRITE_BATCH_WINDOW
+        while len(batch) < WRITE_BATCH_SIZE:
+            remaining: float = deadline - time.monotonic()
+            try:
+                batch.append(_write_queue.get(timeout = remaining) if remaining > 0 else _write_queue.get_nowait())
+            except queue.Empty:
+                break
+        commit_batch(_local.con, batch)
+
+def commit_batch(con: Connection, batch: list[tuple[Callable, tuple, Future]]) -> None:
+    #One transaction per batch, each write runs in its own savepoint so a failing write only undoes itself
+    outcomes: list[tuple[Future, Any, BaseException | None]] = []
+    try:
+        con.execute("BEGIN IMMEDIATE")
+        for func, args, future in batch:
+            if not future.set_running_or_notify_cancel():
+                continue
+            con.execute("SAVEPOINT write")
+            try:
+                outcomes.append((future, metrics.timed(func, *args), None))
+            except Exception as error:
+                con.execute("ROLLBACK TO write")
+                outcomes.append((future, None, error))
+            con.execute("RELEASE write")
+        con.execute("COMMIT")
+    except Exception as error:
+        if con.in_transaction:
+            con.execute("ROLLBACK")
+        for _, _, future in batch:
+            if not future.done():
+                future.set_exception(error)
+        return
+
+    #Results are only handed out after the commit, so a request never sees a write that could still be lost
+    for future, result, error in outcomes:
+        if error is None:
+            future.set_result(result)
+        else:
+            future.set_exception(error)
+
+def add_column(cur: Cursor, table: str, column: str, definition: str) -> bool:
+    #Schema migration for databases created before the column existed, returns whether it was added
+    cur.execute(f"PRAGMA table_info({table})")
+    if column in [row[1] for row in cur.fetchall()]:
+        return False
+    cur.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+    return True
+
+#Deleting a user or group deletes its relations in the same statement
+RELATIONS_TABLE: str = """
+        CREATE TABLE IF NOT EXISTS {} (
+            UserID INTEGER,
+            GroupID INTEGER,
+            PRIMARY KEY (UserID, GroupID),
+            FOREIGN KEY (UserID) REFERENCES Users(UserID) ON DELETE CASCADE,
+            FOREIGN KEY (GroupID) REFERENCES UserGroups(GroupID) ON DELETE CASCADE
+            )
+    """
+
+def migrate_relations_cascade(cur: Cursor) -> None:
+    #SQLite cannot alter a foreign key, databases created without ON DELETE CASCADE get the table rebuilt
+    cur.execute("PRAGMA foreign_key_list(Relations)")
+    if all(row[6] == "CASCADE" for row in cur.fetchall()):
+        return
+
+    cur.execute(RELATIONS_TABLE.format("RelationsCascade"))
+    cur.execute("INSERT INTO RelationsCascade (UserID, GroupID) SELECT UserID, GroupID FROM Relations")
+    cur.execute("DROP TABLE Relations")
+    cur.execute("ALTER TABLE RelationsCascade RENAME TO Relations")
+
+#Full-text search, an external content FTS5 table per searchable table, kept in sync by triggers so every
+#writer, including bulk inserts and other workers, updates it in the same transaction as the row itself
+#The bm25 weights per column are stored as the table's rank function. Ranking costs a bm25 score per match, so only the
+#first SEARCH_CANDIDATES matches in rowid order are ranked. A search matching fewer rows, as most do past a couple
+#of letters, is ranked in full. A short prefix matching most rows stays a few milliseconds at a million rows,
+#at the price of ranking the best of the oldest matches rather than of all of them
+SEARCH_TABLES: tuple[tuple[str, str, tuple[str, ...], tuple[float, ...]], ...] = (
+    ("Users", "UserID", ("Username", "FirstName", "LastName", "Email"), (4.0, 2.0, 2.0, 1.0)),
+    ("UserGroups", "GroupID", ("Name", "Description"), (4.0, 1.0))
+)
+#Prefix indexes make type-ahead terms of 2 to 4 characters a direct lookup instead of a scan of the term list
+SEARCH_PREFIXES: str = "2 3 4"
+SEARCH_CANDIDATES: int = 1000
+
+def create_search_index(cur: Cursor, table: str, key: str, columns: tuple[str, ...], weights: tuple[float, ...]) -> None:
+    search: str = f"{table}Search"
+    cur.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (search,))
+    created: bool = cur.fetchone() is None
+
+    column_list: str = ", ".join(columns)
+    new_values: str = ", ".join(f"new.{column}" for column in columns)
+    old_values: str = ", ".join(f"old.{column}" for column in columns)
+    cur.execute(f"""
+        CREATE VIRTUAL TABLE IF NOT EXISTS {search} USING fts5(
+            {column_list}, content = '{table}', content_rowid = '{key}', prefix = '{SEARCH_PREFIXES}',
+            tokenize = 'unicode61 remove_diacritics 2'
+            )
+    """)
+    cur.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {table}InsertSearch AFTER INSERT ON {table}
+        BEGIN
+            INSERT INTO {search} (rowid, {column_list}) VALUES (new.{key}, {new_values});
+        END
+    """)
+    cur.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {table}DeleteSearch AFTER DELETE ON {table}
+        BEGIN
+            INSERT INTO {search} ({search}, rowid, {column_list}) VALUES ('delete', old.{key}, {old_values});
+        END
+    """)
+    #Only fires when a searchable column changes, not for the Version bump of every update
+    cur.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {table}UpdateSearch AFTER UPDATE OF {column_list} ON {table}
+        BEGIN
+            INSERT INTO {search} ({search}, rowid, {column_list}) VALUES ('delete', old.{key}, {old_values});
+            INSERT INTO {search} (rowid, {column_list}) VALUES (new.{key}, {new_values});
+        END
+    """)
+
+    #Stored in the index's config table, rewritten on every startup so changed weights take effect
+    cur.execute(f"INSERT INTO {search} ({search}, rank) VALUES ('rank', ?)", (f"bm25({', '.join(map(str, weights))})",))
+
+    #Databases from before the search index get it filled from the existing rows once
+    if created:
+        cur.execute(f"INSERT INTO {search} ({search}) VALUES ('rebuild')")
+
+#Change log, every insert, update and delete of a user, group or relation appends a row with the next sequence number.
+#Written by triggers, so bulk writes, cascaded deletes and other workers are logged in the same transaction as the change.
+#Table -> (entity name, UserID column, GroupID column, JSON of the row as the API returns it, columns whose update is logged).
+#Updates of other columns, such as the Version bump or the membership counts, are not changes of the row as the API sees it
+CHANGE_SOURCES: dict[str, tuple[str, str, str, str, str]] = {
+    "Users": (
+        "user", "{row}.UserID", "NULL",
+        "json_object('username', {row}.Username, 'first_name', {row}.FirstName, 'last_name', {row}.LastName, 'email', {row}.Email, 'user_id', {row}.UserID)",
+        "Username, FirstName, LastName, Email"
+    ),
+    "UserGroups": (
+        "group", "NULL", "{row}.GroupID",
+        "json_object('name', {row}.Name, 'description', {row}.Description, 'group_id', {row}.GroupID)",
+        "Name, Description"
+    ),
+    "Relations": (
+        "relation", "{row}.UserID", "{row}.GroupID",
+        "NULL",
+        "UserID, GroupID"
+    ),
+    "GroupRelations": (
+        "group_relation", "NULL", "{row}.ParentID",
+        "json_object('parent_id', {row}.ParentID, 'child_id', {row}.ChildID)",
+        "ParentID, ChildID"
+    )
+}
+#Edges whose data is their key, logged on delete as well
+CHANGE_KEY_DATA: set[str] = {"GroupRelations"}
+
+def create_change_log(cur: Cursor) -> None:
+    #AUTOINCREMENT keeps sequence numbers from being reused once the newest entries have been pruned
     cur.execute("""
-        CREATE TABLE Users (
+        CREATE TABLE IF NOT EXISTS Changes (
+            Seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            Entity TEXT NOT NULL,
+            Operation TEXT NOT NULL,
+            UserID INTEGER,
+            GroupID INTEGER,
+            Data TEXT,
+            Created INTEGER NOT NULL
+            )
+    """)
+    hidden_tables: set[str] = {table for table, _ in DELETE_TARGETS.values()}
+    for table, (entity, user_id, group_id, data, columns) in CHANGE_SOURCES.items():
+        for event, row in (("INSERT", "new"), ("UPDATE", "new"), ("DELETE", "old")):
+            #A user or group removed by a delete job was logged as deleted when it was hidden, not again when the job ends
+            when: str = "WHEN old.DeletedAt IS NULL" if event == "DELETE" and table in hidden_tables else ""
+            #Recreated on every start, so databases with triggers from before the logged columns were narrowed get the new ones
+            cur.execute(f"DROP TRIGGER IF EXISTS {table}{event.title()}Change")
+            cur.execute(f"""
+                CREATE TRIGGER {table}{event.title()}Change AFTER {event if event != "UPDATE" else f"UPDATE OF {columns}"} ON {table} {when}
+                BEGIN
+                    INSERT INTO Changes (Entity, Operation, UserID, GroupID, Data, Created)
+                    VALUES ('{entity}', '{event.lower()}', {user_id.format(row = row)}, {group_id.format(row = row)},
+                            {data.format(row = row) if event != "DELETE" or table in CHANGE_KEY_DATA else "NULL"}, strftime('%s', 'now'));
+                END
+            """)
+
+    for entity, (table, _) in DELETE_TARGETS.items():
+        cur.execute(f"DROP TRIGGER IF EXISTS {table}HideChange")
+        cur.execute(f"""
+            CREATE TRIGGER {table}HideChange AFTER UPDATE OF DeletedAt ON {table}
+            WHEN old.DeletedAt IS NULL AND new.DeletedAt IS NOT NULL
+            BEGIN
+                INSERT INTO Changes (Entity, Operation, UserID, GroupID, Data, Created)
+                VALUES ('{entity}', 'delete', {CHANGE_SOURCES[table][1].format(row = "old")}, {CHANGE_SOURCES[table][2].format(row = "old")},
+                        NULL, strftime('%s', 'now'));
+            END
+        """)
+
+    #Recreated on every start, so a changed USERDB_CHANGE_LOG_SIZE takes effect
+    cur.execute("DROP TRIGGER IF EXISTS ChangesPrune")
+    cur.execute(f"""
+        CREATE TRIGGER ChangesPrune AFTER INSERT ON Changes
+        BEGIN
+            DELETE FROM Changes WHERE Seq <= new.Seq - {max(1, CHANGE_LOG_SIZE)};
+        END
+    """)
+
+def create_membership_counts(cur: Cursor) -> None:
+    #Groups per user and members per group, kept by triggers so bulk inserts, cascaded deletes and other workers
+    #update them in the same transaction as the relation. The row Version is bumped too, the count is part of its ETag
+    users_added: bool = add_column(cur, "Users", "GroupCount", "INTEGER NOT NULL DEFAULT 0")
+    groups_added: bool = add_column(cur, "UserGroups", "MemberCount", "INTEGER NOT NULL DEFAULT 0")
+    #Hiding a user or group for a delete job takes its relations out of the counts of the other side at once,
+    #so the job deleting them later must not take them out again
+    for event, row, change in (("INSERT", "new", "+ 1"), ("DELETE", "old", "- 1")):
+        cur.execute(f"DROP TRIGGER IF EXISTS Relations{event.title()}Count")
+        cur.execute(f"""
+            CREATE TRIGGER Relations{event.title()}Count AFTER {event} ON Relations
+            BEGIN
+                UPDATE Users SET GroupCount = GroupCount {change}, Version = Version + 1
+                WHERE UserID = {row}.UserID
+                  AND NOT EXISTS (SELECT 1 FROM UserGroups WHERE GroupID = {row}.GroupID AND DeletedAt IS NOT NULL);
+                UPDATE UserGroups SET MemberCount = MemberCount {change}, Version = Version + 1
+                WHERE GroupID = {row}.GroupID
+                  AND NOT EXISTS (SELECT 1 FROM Users WHERE UserID = {row}.UserID AND DeletedAt IS NOT NULL);
+            END
+        """)
+    #Serves the groups ordered by size, ties in GroupID order through the rowid at the end of every index entry.
+    #Partial, so groups hidden for a delete job are left out without reading their rows
+    cur.execute("DROP INDEX IF EXISTS UserGroupsMemberCount")
+    cur.execute("CREATE INDEX IF NOT EXISTS UserGroupsLiveMemberCount ON UserGroups (MemberCount) WHERE DeletedAt IS NULL")
+
+    #Databases from before the counts get them computed from the existing relations once
+    if users_added:
+        cur.execute("UPDATE Users SET GroupCount = (SELECT COUNT(*) FROM Relations WHERE Relations.UserID = Users.UserID)")
+    if groups_added:
+        cur.execute("UPDATE UserGroups SET MemberCount = (SELECT COUNT(*) FROM Relations WHERE Relations.GroupID = UserGroups.GroupID)")
+
+def create_group_closure(cur: Cursor) -> None:
+    #Groups can be members of groups. GroupClosure holds a row per group and each group below it, itself included,
+    #with the number of distinct paths between the two. Counting paths lets removing one edge of a diamond keep
+    #the pairs that are still connected through another. Kept by triggers like the membership counts
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS GroupRelations (
+            ParentID INTEGER,
+            ChildID INTEGER,
+            PRIMARY KEY (ParentID, ChildID),
+            FOREIGN KEY (ParentID) REFERENCES UserGroups(GroupID) ON DELETE CASCADE,
+            FOREIGN KEY (ChildID) REFERENCES UserGroups(GroupID) ON DELETE CASCADE
+            )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS GroupRelationsChildParent ON GroupRelations (ChildID, ParentID)")
+
+    cur.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'GroupClosure'")
+    created: bool = cur.fetchone() is None
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS GroupClosure (
+            AncestorID INTEGER NOT NULL,
+            DescendantID INTEGER NOT NULL,
+            Paths INTEGER NOT NULL,
+            PRIMARY KEY (AncestorID, DescendantID)
+            ) WITHOUT ROWID
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS GroupClosureDescendantAncestor ON GroupClosure (DescendantID, AncestorID)")
+
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS UserGroupsInsertClosure AFTER INSERT ON UserGroups
+        BEGIN
+            INSERT INTO GroupClosure (AncestorID, DescendantID, Paths) VALUES (new.GroupID, new.GroupID, 1);
+        END
+    """)
+    #Edges go first while the closure still describes them, the cascade then finds none left
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS UserGroupsDeleteClosure BEFORE DELETE ON UserGroups
+        BEGIN
+            DELETE FROM GroupRelations WHERE ParentID = old.GroupID;
+            DELETE FROM GroupRelations WHERE ChildID = old.GroupID;
+            DELETE FROM GroupClosure WHERE AncestorID = old.GroupID AND DescendantID = old.GroupID;
+        END
+    """)
+    #An edge closes a cycle if the parent is already below the child, a group is below itself through its own row
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS GroupRelationsCycle BEFORE INSERT ON GroupRelations
+        BEGIN
+            SELECT RAISE(ABORT, 'Group relation would create a cycle')
+            WHERE EXISTS (SELECT 1 FROM GroupClosure WHERE AncestorID = new.ChildID AND DescendantID = new.ParentID);
+        END
+    """)
+    #Every ancestor of the parent gains every descendant of the child, by as many paths as run through the new edge
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS GroupRelationsInsertClosure AFTER INSERT ON GroupRelations
+        BEGIN
+            INSERT INTO GroupClosure (AncestorID, DescendantID, Paths)
+            SELECT Above.AncestorID, Below.DescendantID, Above.Paths * Below.Paths
+            FROM GroupClosure AS Above, GroupClosure AS Below
+            WHERE Above.DescendantID = new.ParentID AND Below.AncestorID = new.ChildID
+            ON CONFLICT (AncestorID, DescendantID) DO UPDATE SET Paths = Paths + excluded.Paths;
+        END
+    """)
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS GroupRelationsDeleteClosure AFTER DELETE ON GroupRelations
+        BEGIN
+            UPDATE GroupClosure SET Paths = Paths - (
+                SELECT Above.Paths * Below.Paths
+                FROM GroupClosure AS Above, GroupClosure AS Below
+                WHERE Above.AncestorID = GroupClosure.AncestorID AND Above.DescendantID = old.ParentID
+                  AND Below.AncestorID = old.ChildID AND Below.DescendantID = GroupClosure.DescendantID
+                )
+            WHERE AncestorID IN (SELECT AncestorID FROM GroupClosure WHERE DescendantID = old.ParentID)
+              AND DescendantID IN (SELECT DescendantID FROM GroupClosure WHERE AncestorID = old.ChildID);
+            DELETE FROM GroupClosure
+            WHERE AncestorID IN (SELECT AncestorID FROM GroupClosure WHERE DescendantID = old.ParentID)
+              AND DescendantID IN (SELECT DescendantID FROM GroupClosure WHERE AncestorID = old.ChildID)
+              AND Paths = 0;
+        END
+    """)
+
+    #Databases from before nested groups get the row of each group to itself once
+    if created:
+        cur.execute("INSERT INTO GroupClosure (AncestorID, DescendantID, Paths) SELECT GroupID, GroupID, 1 FROM UserGroups")
+
+#Entity -> (table, key column) of what delete jobs remove, the key column is also the one pointing to it from Relations
+DELETE_TARGETS: dict[str, tuple[str, str]] = {"user": ("Users", "UserID"), "group": ("UserGroups", "GroupID")}
+#Entity of a job deleting only the relations of a user or group -> the entity whose row it leaves in place
+RELATION_DELETE_TARGETS: dict[str, str] = {"user_relations": "user", "group_relations": "group"}
+#Subqueries of the hidden users and groups, read from the partial DeletedAt indexes
+HIDDEN_USERS: str = "SELECT UserID FROM Users WHERE DeletedAt IS NOT NULL"
+HIDDEN_GROUPS: str = "SELECT GroupID FROM UserGroups WHERE DeletedAt IS NOT NULL"
+
+def create_delete_jobs(cur: Cursor) -> None:
+    #A user or group with more relations than DELETE_CHUNK_SIZE is hidden by setting DeletedAt, every read leaves it out from then on.
+    #A delete job then deletes its relations a chunk per write and finally the row itself
+    for table, _ in DELETE_TARGETS.values():
+        add_column(cur, table, "DeletedAt", "INTEGER")
+        cur.execute(f"CREATE INDEX IF NOT EXISTS {table}Deleted ON {table} (DeletedAt) WHERE DeletedAt IS NOT NULL")
+
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS DeleteJobs (
+            JobID INTEGER PRIMARY KEY AUTOINCREMENT,
+            Entity TEXT NOT NULL,
+            EntityID INTEGER NOT NULL,
+            Status TEXT NOT NULL DEFAULT 'running',
+            Total INTEGER NOT NULL,
+            Deleted INTEGER NOT NULL DEFAULT 0,
+            Created INTEGER NOT NULL,
+            Finished INTEGER
+            )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS DeleteJobsRunning ON DeleteJobs (JobID) WHERE Status = 'running'")
+
+    #A hidden user or group takes no new relations, refused with the error of a missing one so callers map it to a 404
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS RelationsHidden BEFORE INSERT ON Relations
+        BEGIN
+            SELECT RAISE(ABORT, 'FOREIGN KEY constraint failed')
+            WHERE EXISTS (SELECT 1 FROM Users WHERE UserID = new.UserID AND DeletedAt IS NOT NULL)
+               OR EXISTS (SELECT 1 FROM UserGroups WHERE GroupID = new.GroupID AND DeletedAt IS NOT NULL);
+        END
+    """)
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS GroupRelationsHidden BEFORE INSERT ON GroupRelations
+        BEGIN
+            SELECT RAISE(ABORT, 'FOREIGN KEY constraint failed')
+            WHERE EXISTS (SELECT 1 FROM UserGroups WHERE GroupID IN (new.ParentID, new.ChildID) AND DeletedAt IS NOT NULL);
+        END
+    """)
+
+def match_expression(text: str) -> str | None:
+    #Every word of the input must start a word of the row, for type-ahead, e.g. 'jo smi' -> "jo"* "smi"*.
+    #Words are quoted so FTS5 operators in user input are searched for literally
+    words: list[str] = re.findall(r"\w+", text)
+    if not words:
+        return None
+    return " ".join(f'"{word}"*' for word in words)
+
+def init_db() -> None:
+    #Create the schema unless it already exists, the write lock makes workers starting together take turns
+    cur: Cursor = cursor()
+    cur.execute("BEGIN IMMEDIATE")
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS Users (
             UserID INTEGER PRIMARY KEY AUTOINCREMENT,
             Username TEXT NOT NULL,
             FirstName TEXT,
             LastName TEXT,
-            Email TEXT NOT NULL
+            Email TEXT NOT NULL,
+            Version INTEGER NOT NULL DEFAULT 1,
+            GroupCount INTEGER NOT NULL DEFAULT 0
             )
         """)
 
     cur.execute("""
-        CREATE TABLE UserGroups (
+        CREATE TABLE IF NOT EXISTS UserGroups (
             GroupID INTEGER PRIMARY KEY AUTOINCREMENT,
             Name TEXT NOT NULL,
-            Description TEXT
+            Description TEXT,
+            Version INTEGER NOT NULL DEFAULT 1,
+            MemberCount INTEGER NOT NULL DEFAULT 0
             )
     """)
 
+    cur.execute(RELATIONS_TABLE.format("Relations"))
+    migrate_relations_cascade(cur)
+
+    #Uniqueness is enforced by the indexes, the GroupID-first index serves group lookups and joins
+    cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS UsersUsername ON Users (Username)")
+    cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS UsersEmail ON Users (Email)")
+    cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS UserGroupsName ON UserGroups (Name)")
+    cur.execute("CREATE INDEX IF NOT EXISTS RelationsGroupUser ON Relations (GroupID, UserID)")
+    cur.execute(f"CREATE INDEX IF NOT EXISTS UsersEmailDomain ON Users ({EMAIL_DOMAIN})")
+
+    create_group_closure(cur)
+
+    #Row versions are bumped by update_user/update_group, table versions by triggers on every write from any worker
+    add_column(cur, "Users", "Version", "INTEGER NOT NULL DEFAULT 1")
+    add_column(cur, "UserGroups", "Version", "INTEGER NOT NULL DEFAULT 1")
     cur.execute("""
-        CREATE TABLE Relations (
-            UserID INTEGER,
-            GroupID INTEGER,
-            PRIMARY KEY (UserID, GroupID),
-            FOREIGN KEY (UserID) REFERENCES Users(UserID),
-            FOREIGN KEY (GroupID) REFERENCES UserGroups(GroupID)
+        CREATE TABLE IF NOT EXISTS TableVersions (
+            Name TEXT PRIMARY KEY,
+            Version INTEGER NOT NULL,
+            Modified INTEGER NOT NULL
             )
     """)
+    for table in ("Users", "UserGroups", "Relations", "GroupRelations"):
+        cur.execute("INSERT OR IGNORE INTO TableVersions (Name, Version, Modified) VALUES (?, 1, strftime('%s', 'now'))", (table,))
+        for event in ("INSERT", "UPDATE", "DELETE"):
+            cur.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS {table}{event.title()}Version AFTER {event} ON {table}
+                BEGIN
+                    UPDATE TableVersions SET Version = Version + 1, Modified = strftime('%s', 'now') WHERE Name = '{table}';
+                END
+            """)
+
+    for table, key, columns, weights in SEARCH_TABLES:
+        create_search_index(cur, table, key, columns, weights)
+
+    create_delete_jobs(cur)
+    create_change_log(cur)
+    create_membership_counts(cur)
 
     #Fake data for quick testing
     #Users
@@ -97,149 +641,821 @@ def init_db() -> None:
     #     VALUES (4, 3)
     # """)
 
+    cur.connection.commit()
+
+#Paging helpers
+def prefix_range(prefix: str) -> tuple[str, str]:
+    #Bounds for an index range scan over all strings starting with prefix, LIKE cannot use the BINARY indexes
+    last: int = ord(prefix[-1])
+    if last == 0x10FFFF:
+        return prefix, prefix + chr(0x10FFFF)
+    return prefix, prefix[:-1] + chr(last + 1)
+
+#The part of an email after the first @, lowercased like the ASCII case folding of LIKE. Indexed as UsersEmailDomain
+EMAIL_DOMAIN: str = "lower(substr(Email, instr(Email, '@') + 1))"
+
+def where_clause(conditions: list) -> str:
+    return f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+#Bulk helpers
+BULK_CHUNK_SIZE: int = 500
+
+def chunked(items: list, size: int = BULK_CHUNK_SIZE) -> list[list]:
+    #Keeps IN (...) lists below SQLite's bound parameter limit
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+def placeholders(count: int) -> str:
+    return ", ".join("?" * count)
+
+def select_in(cur: Cursor, query: str, values: list) -> list[tuple]:
+    #Runs query once per chunk of values, query has a single {} where the placeholders go
+    rows: list[tuple] = []
+    for chunk in chunked(values):
+        cur.execute(query.format(placeholders(len(chunk))), chunk)
+        rows.extend(cur.fetchall())
+    return rows
+
+#Named rows
+def named_row_factory(fields: dict[str, int]) -> Callable[[Cursor, tuple], dict]:
+    #Rows come out as dicts of field name to the column at the given position, in the order of fields,
+    #so list endpoints can encode them to JSON as they are
+    names: tuple[str, ...] = tuple(fields)
+    columns: Callable[[tuple], tuple] = operator.itemgetter(*fields.values())
+
+    def factory(_: Cursor, row: tuple) -> dict:
+        return dict(zip(names, columns(row)))
+    return factory
+
+#Keyed and ordered like the UserDB, GroupDB and RelationDetailedDB response models
+USER_ROW: Callable[[Cursor, tuple], dict] = named_row_factory(dict(username = 1, first_name = 2, last_name = 3, email = 4, user_id = 0, group_count = 5))
+GROUP_ROW: Callable[[Cursor, tuple], dict] = named_row_factory(dict(name = 1, description = 2, group_id = 0, member_count = 3))
+RELATION_ROW: Callable[[Cursor, tuple], dict] = named_row_factory(dict(username = 0, group_name = 1, user_id = 2, group_id = 3))
+
 #User functions
-def get_all_users() -> list[tuple[int, str, str, str, str]]:
-    cur.execute("SELECT UserID, Username, FirstName, LastName, Email FROM Users")
+def get_users(after_id: int | None, after_username: str | None, limit: int, descending: bool = False,
+              username_prefix: str | None = None, email_domain: str | None = None,
+              ids: list[int] | None = None, usernames: list[str] | None = None, emails: list[str] | None = None,
+              named: bool = False) -> list[tuple[int, str, str, str, str, int]] | list[dict]:
+    #Keyset page ordered by UserID, pass the last UserID of a page as after_id to get the next one.
+    #With username_prefix the page is ordered by Username instead and continues after after_username, so the range
+    #is read in order from the unique Username index rather than collected and sorted by UserID.
+    #ids, usernames and emails look up many users in one query, a user matching any of them is returned.
+    #Callers keep the lists within the bound parameter limit
+    cur: Cursor = cursor()
+    if named:
+        cur.row_factory = USER_ROW
+    order_column, after = ("Username", after_username) if username_prefix else ("UserID", after_id)
+    conditions: list = ["DeletedAt IS NULL"]
+    values: list = []
+    if after is not None:
+        conditions.append(f"{order_column} < ?" if descending else f"{order_column} > ?")
+        values.append(after)
+    lookups: list = []
+    for column, wanted in (("UserID", ids), ("Username", usernames), ("Email", emails)):
+        if wanted is not None:
+            lookups.append(f"{column} IN ({placeholders(len(wanted))})")
+            values.extend(wanted)
+    if lookups:
+        conditions.append(f"({' OR '.join(lookups)})")
+    if username_prefix:
+        conditions.append("Username >= ? AND Username < ?")
+        values.extend(prefix_range(username_prefix))
+    if email_domain:
+        #Matches the expression of the UsersEmailDomain index exactly, so it is an index lookup in UserID order
+        conditions.append(f"{EMAIL_DOMAIN} = lower(?)")
+        values.append(email_domain)
+
+    values.append(limit)
+    cur.execute(f"""
+                SELECT UserID, Username, FirstName, LastName, Email, GroupCount
+                FROM Users
+                {where_clause(conditions)}
+                ORDER BY {order_column} {"DESC" if descending else "ASC"}
+                LIMIT ?
+                """, values)
     return cur.fetchall()
 
-def get_user(user_id: int) -> tuple[int, str, str, str, str]:
-    cur.execute("SELECT UserID, Username, FirstName, LastName, Email FROM Users WHERE UserID = ?", (user_id,))
-    return cur.fetchone()
+def search_users(text: str, limit: int, named: bool = False) -> list[tuple[int, str, str, str, str, int]] | list[dict]:
+    #Best matches first, a hit in the username weighs more than one in a name and those more than one in the email
+    expression: str | None = match_expression(text)
+    if expression is None:
+        return []
+
+    cur: Cursor = cursor()
+    if named:
+        cur.row_factory = USER_ROW
+    cur.execute("""
+                SELECT Users.UserID, Users.Username, Users.FirstName, Users.LastName, Users.Email, Users.GroupCount
+                FROM (
+                    SELECT rowid, rank
+                    FROM UsersSearch
+                    WHERE UsersSearch MATCH ?
+                    LIMIT ?
+                    ) AS Hits
+                JOIN Users ON Users.UserID = Hits.rowid
+                WHERE Users.DeletedAt IS NULL
+                ORDER BY Hits.rank
+                LIMIT ?
+                """, (expression, SEARCH_CANDIDATES, limit))
+    return cur.fetchall()
 
-def get_user_via_name(username: str) -> tuple[int, str, str, str, str]:
-    cur.execute("SELECT UserID, Username, FirstName, LastName, Email FROM Users WHERE Username = ?", (username,))
+def get_user(user_id: int) -> tuple[int, str, str, str, str, int, int]:
+    cur: Cursor = cursor()
+    cur.execute("SELECT UserID, Username, FirstName, LastName, Email, GroupCount, Version FROM Users WHERE UserID = ? AND DeletedAt IS NULL", (user_id,))
     return cur.fetchone()
 
 def has_user_id(user_id: int) -> bool:
-    cur.execute("SELECT UserID FROM Users WHERE UserID = ?", (user_id,))
-    return cur.fetchone() != None
-
-def has_username(username: str) -> bool:
-    cur.execute("SELECT UserID FROM Users WHERE Username = ?", (username,))
+    cur: Cursor = cursor()
+    cur.execute("SELECT UserID FROM Users WHERE UserID = ? AND DeletedAt IS NULL", (user_id,))
     return cur.fetchone() != None
 
-def has_email(email: str) -> bool:
-    cur.execute("SELECT UserID FROM Users WHERE Email = ?", (email,))
-    return cur.fetchone() != None
-
-def add_user(username: str, first_name: str, last_name: str, email: str) -> None:
+def add_user(username: str, first_name: str, last_name: str, email: str) -> tuple[int, str, str, str, str, int, int]:
+    #Returns the new row, raises sqlite3.IntegrityError if the username or email is taken
+    cur: Cursor = cursor()
     cur.execute("""
     INSERT INTO Users (Username, FirstName, LastName, Email)
     VALUES (?, ?, ?, ?)
+    RETURNING UserID, Username, FirstName, LastName, Email, GroupCount, Version
     """, (username, first_name, last_name, email))
-    con.commit()
+    return cur.fetchall()[0]
+
+def add_users(users: list[tuple[str, str, str, str]]) -> tuple[list[tuple[int, str, str, str, str, int]], list[tuple[int, str]]]:
+    #Inserts all users without a conflict in one transaction, returns the created rows and (index, reason) per skipped user
+    cur: Cursor = cursor()
+    taken_usernames: set = {row[0] for row in select_in(cur, "SELECT Username FROM Users WHERE Username IN ({})", [user[0] for user in users])}
+    taken_emails: set = {row[0] for row in select_in(cur, "SELECT Email FROM Users WHERE Email IN ({})", [user[3] for user in users if user[3] is not None])}
+
+    new_users: list[tuple[str, str, str, str]] = []
+    conflicts: list[tuple[int, str]] = []
+    for index, (username, first_name, last_name, email) in enumerate(users):
+        if username in taken_usernames:
+            conflicts.append((index, f"User with Username {username} already exists."))
+        elif email is None:
+            conflicts.append((index, "Email is required."))
+        elif email in taken_emails:
+            conflicts.append((index, f"User with Email {email} already exists."))
+        else:
+            taken_usernames.add(username)
+            taken_emails.add(email)
+            new_users.append((username, first_name, last_name, email))
+
+    cur.executemany("""
+    INSERT INTO Users (Username, FirstName, LastName, Email)
+    VALUES (?, ?, ?, ?)
+    """, new_users)
 
-def update_user(columns: list, values: list) -> None:
-    query: str =  f"UPDATE Users SET {', '.join(columns)} WHERE UserID = ?"
+    created: list[tuple[int, str, str, str, str, int]] = select_in(cur, """
+        SELECT UserID, Username, FirstName, LastName, Email, GroupCount FROM Users WHERE Username IN ({}) ORDER BY UserID
+        """, [user[0] for user in new_users])
+
+    return created, conflicts
+
+def update_user(columns: list, values: list) -> tuple[int, str, str, str, str, int, int] | None:
+    #Returns the updated row or None if there is no such user
+    cur: Cursor = cursor()
+    query: str =  f"""
+    UPDATE Users SET {', '.join(columns + ['Version = Version + 1'])} WHERE UserID = ? AND DeletedAt IS NULL
+    RETURNING UserID, Username, FirstName, LastName, Email, GroupCount, Version
+    """
     cur.execute(query, values)
-    con.commit()
+    rows: list = cur.fetchall()
+    return rows[0] if rows else None
+
+def delete_user(user_id: int) -> tuple[int, str, int, str, int, int, int, int | None] | bool:
+    #False if there is no such user, True if it was deleted with its relations, or the delete job row if it has too many
+    #relations to delete in one write and was hidden instead
+    cur: Cursor = cursor()
+    cur.execute("SELECT GroupCount FROM Users WHERE UserID = ? AND DeletedAt IS NULL", (user_id,))
+    row: tuple | None = cur.fetchone()
+    if row is None:
+        return False
+    if row[0] > DELETE_CHUNK_SIZE:
+        return start_delete_job(cur, "user", user_id, row[0])
 
-def delete_user(user_id: int) -> None:
+    #Relations of the user go with it through ON DELETE CASCADE
     cur.execute("DELETE FROM Users WHERE UserID = ?", (user_id,))
-    con.commit()
+    return True
 
 #Group funcs
-def get_all_groups() -> list[tuple[int, str, str]]:
-    cur.execute("SELECT GroupID, Name, Description FROM UserGroups")
+def get_groups(after_id: int | None, after_name: str | None, limit: int, descending: bool = False,
+               name_prefix: str | None = None, ids: list[int] | None = None, named: bool = False) -> list[tuple[int, str, str, int]] | list[dict]:
+    #Keyset page ordered by GroupID, pass the last GroupID of a page as after_id to get the next one.
+    #With name_prefix the page is ordered by Name from the unique Name index and continues after after_name
+    cur: Cursor = cursor()
+    if named:
+        cur.row_factory = GROUP_ROW
+    order_column, after = ("Name", after_name) if name_prefix else ("GroupID", after_id)
+    conditions: list = ["DeletedAt IS NULL"]
+    values: list = []
+    if after is not None:
+        conditions.append(f"{order_column} < ?" if descending else f"{order_column} > ?")
+        values.append(after)
+    if ids is not None:
+        conditions.append(f"GroupID IN ({placeholders(len(ids))})")
+        values.extend(ids)
+    if name_prefix:
+        conditions.append("Name >= ? AND Name < ?")
+        values.extend(prefix_range(name_prefix))
+
+    values.append(limit)
+    cur.execute(f"""
+                SELECT GroupID, Name, Description, MemberCount
+                FROM UserGroups
+                {where_clause(conditions)}
+                ORDER BY {order_column} {"DESC" if descending else "ASC"}
+                LIMIT ?
+                """, values)
     return cur.fetchall()
 
-def get_group(group_id: int) -> tuple[int, str, str]:
-    cur.execute("SELECT GroupID, Name, Description FROM UserGroups WHERE GroupID = ?", (group_id,))
-    return cur.fetchone()
+def search_groups(text: str, limit: int, named: bool = False) -> list[tuple[int, str, str, int]] | list[dict]:
+    #Best matches first, a hit in the name weighs more than one in the description
+    expression: str | None = match_expression(text)
+    if expression is None:
+        return []
 
-def get_group_via_name(name: str) -> tuple[int, str, str]:
-    cur.execute("SELECT GroupID, Name, Description FROM UserGroups WHERE Name = ?", (name,))
+    cur: Cursor = cursor()
+    if named:
+        cur.row_factory = GROUP_ROW
+    cur.execute("""
+                SELECT UserGroups.GroupID, UserGroups.Name, UserGroups.Description, UserGroups.MemberCount
+                FROM (
+                    SELECT rowid, rank
+                    FROM UserGroupsSearch
+                    WHERE UserGroupsSearch MATCH ?
+                    LIMIT ?
+                    ) AS Hits
+                JOIN UserGroups ON UserGroups.GroupID = Hits.rowid
+                WHERE UserGroups.DeletedAt IS NULL
+                ORDER BY Hits.rank
+                LIMIT ?
+                """, (expression, SEARCH_CANDIDATES, limit))
+    return cur.fetchall()
+
+def get_groups_by_size(limit: int, ascending: bool = False, named: bool = False) -> list[tuple[int, str, str, int]] | list[dict]:
+    #Largest groups first, read in order from the MemberCount index instead of counting relations
+    cur: Cursor = cursor()
+    if named:
+        cur.row_factory = GROUP_ROW
+    order: str = "ASC" if ascending else "DESC"
+    cur.execute(f"""
+                SELECT GroupID, Name, Description, MemberCount
+                FROM UserGroups
+                WHERE DeletedAt IS NULL
+                ORDER BY MemberCount {order}, GroupID {order}
+                LIMIT ?
+                """, (limit,))
+    return cur.fetchall()
+
+def get_group_totals() -> tuple[int, int, int]:
+    #(groups, relations, empty groups), summed from the counts in the MemberCount index alone
+    cur: Cursor = cursor()
+    cur.execute("SELECT COUNT(*), COALESCE(SUM(MemberCount), 0), COALESCE(SUM(MemberCount = 0), 0) FROM UserGroups WHERE DeletedAt IS NULL")
     return cur.fetchone()
 
-def has_group_name(name: str) -> bool:
-    cur.execute("SELECT GroupID FROM UserGroups WHERE Name = ?", (name,))
-    return cur.fetchone() != None
+def get_group_stats(limit: int, ascending: bool = False) -> dict:
+    #The totals and the groups by size, run through read() so both come from the same snapshot and add up
+    groups, relations, empty_groups = get_group_totals()
+    return dict(groups = groups, relations = relations, empty_groups = empty_groups, by_size = get_groups_by_size(limit, ascending, True))
+
+def get_group(group_id: int) -> tuple[int, str, str, int, int]:
+    cur: Cursor = cursor()
+    cur.execute("SELECT GroupID, Name, Description, MemberCount, Version FROM UserGroups WHERE GroupID = ? AND DeletedAt IS NULL", (group_id,))
+    return cur.fetchone()
 
 def has_group_id(group_id: int) -> bool:
-    cur.execute("SELECT GroupID FROM UserGroups WHERE GroupID = ?", (group_id,))
+    cur: Cursor = cursor()
+    cur.execute("SELECT GroupID FROM UserGroups WHERE GroupID = ? AND DeletedAt IS NULL", (group_id,))
     return cur.fetchone() != None
 
-def add_group(name: str, description: str) -> None:
+def add_group(name: str, description: str) -> tuple[int, str, str, int, int]:
+    #Returns the new row, raises sqlite3.IntegrityError if the name is taken
+    cur: Cursor = cursor()
     cur.execute("""
     INSERT INTO UserGroups (Name, Description)
     VALUES (?, ?)
+    RETURNING GroupID, Name, Description, MemberCount, Version
     """, (name, description))
-    con.commit()
+    return cur.fetchall()[0]
+
+def add_groups(groups: list[tuple[str, str]]) -> tuple[list[tuple[int, str, str, int]], list[tuple[int, str]]]:
+    #Inserts all groups without a conflict in one transaction, returns the created rows and (index, reason) per skipped group
+    cur: Cursor = cursor()
+    taken_names: set = {row[0] for row in select_in(cur, "SELECT Name FROM UserGroups WHERE Name IN ({})", [group[0] for group in groups])}
+
+    new_groups: list[tuple[str, str]] = []
+    conflicts: list[tuple[int, str]] = []
+    for index, (name, description) in enumerate(groups):
+        if name in taken_names:
+            conflicts.append((index, f"Group with Name {name} already exists."))
+        else:
+            taken_names.add(name)
+            new_groups.append((name, description))
+
+    cur.executemany("""
+    INSERT INTO UserGroups (Name, Description)
+    VALUES (?, ?)
+    """, new_groups)
+
+    created: list[tuple[int, str, str, int]] = select_in(cur, """
+        SELECT GroupID, Name, Description, MemberCount FROM UserGroups WHERE Name IN ({}) ORDER BY GroupID
+        """, [group[0] for group in new_groups])
 
-def update_group(columns: list, values: list) -> None:
-    query: str =  f"UPDATE UserGroups SET {', '.join(columns)} WHERE GroupID = ?"
+    return created, conflicts
+
+def update_group(columns: list, values: list) -> tuple[int, str, str, int, int] | None:
+    #Returns the updated row or None if there is no such group
+    cur: Cursor = cursor()
+    query: str =  f"""
+    UPDATE UserGroups SET {', '.join(columns + ['Version = Version + 1'])} WHERE GroupID = ? AND DeletedAt IS NULL
+    RETURNING GroupID, Name, Description, MemberCount, Version
+    """
     cur.execute(query, values)
-    con.commit()
+    rows: list = cur.fetchall()
+    return rows[0] if rows else None
+
+def delete_group(group_id: int) -> tuple[int, str, int, str, int, int, int, int | None] | bool:
+    #False if there is no such group, True if it was deleted with its relations, or the delete job row if it has too many
+    #members to delete in one write and was hidden instead
+    cur: Cursor = cursor()
+    cur.execute("SELECT MemberCount FROM UserGroups WHERE GroupID = ? AND DeletedAt IS NULL", (group_id,))
+    row: tuple | None = cur.fetchone()
+    if row is None:
+        return False
+    if row[0] > DELETE_CHUNK_SIZE:
+        return start_delete_job(cur, "group", group_id, row[0])
 
-def delete_group(group_id: int) -> None:
+    #Relations of the group go with it through ON DELETE CASCADE
     cur.execute("DELETE FROM UserGroups WHERE GroupID = ?",  (group_id,))
-    con.commit()
+    return True
 
 #Relation funcs
-def get_all_relations() -> list[tuple[str, str, int, int]]:
-    cur.execute("""
+def get_relations(after: tuple[int, int] | None, limit: int, descending: bool = False,
+                  user_id: int | None = None, group_id: int | None = None, named: bool = False) -> list[tuple[str, str, int, int]] | list[dict]:
+    #Keyset page ordered by (UserID, GroupID), pass the last pair of a page as after to get the next one
+    cur: Cursor = cursor()
+    if named:
+        cur.row_factory = RELATION_ROW
+    conditions: list = []
+    values: list = []
+    if after is not None:
+        conditions.append("(Relations.UserID, Relations.GroupID) < (?, ?)" if descending else "(Relations.UserID, Relations.GroupID) > (?, ?)")
+        values.extend(after)
+    if user_id is not None:
+        conditions.append("Relations.UserID = ?")
+        values.append(user_id)
+    if group_id is not None:
+        conditions.append("Relations.GroupID = ?")
+        values.append(group_id)
+
+    conditions.append("Users.DeletedAt IS NULL AND UserGroups.DeletedAt IS NULL")
+
+    order: str = "DESC" if descending else "ASC"
+    values.append(limit)
+    cur.execute(f"""
                 SELECT Users.Username, UserGroups.Name ,Relations.UserID, Relations.GroupID
                 FROM Relations
                 JOIN Users      ON Relations.UserID = Users.UserID
                 JOIN UserGroups ON Relations.GroupID = UserGroups.GroupID
-                """)
+                {where_clause(conditions)}
+                ORDER BY Relations.UserID {order}, Relations.GroupID {order}
+                LIMIT ?
+                """, values)
     return cur.fetchall()
 
-def get_user_relations(user_id: int) -> list[tuple[str, str, int, int]]:
+def get_user_relations(user_id: int, named: bool = False) -> list[tuple[str, str, int, int]] | list[dict]:
+    cur: Cursor = cursor()
+    if named:
+        cur.row_factory = RELATION_ROW
     cur.execute("""
                 SELECT Users.Username, UserGroups.Name ,Relations.UserID, Relations.GroupID
                 FROM Relations
                 JOIN Users      ON Relations.UserID = Users.UserID
                 JOIN UserGroups ON Relations.GroupID = UserGroups.GroupID
-                WHERE Relations.UserID = ?
+                WHERE Relations.UserID = ? AND Users.DeletedAt IS NULL AND UserGroups.DeletedAt IS NULL
                 """, (user_id,))
     return cur.fetchall()
 
-def get_group_relations(group_id: int) -> list[tuple[str, str, int, int]]:
+def get_group_relations(group_id: int, named: bool = False) -> list[tuple[str, str, int, int]] | list[dict]:
+    cur: Cursor = cursor()
+    if named:
+        cur.row_factory = RELATION_ROW
     cur.execute("""
                 SELECT Users.Username, UserGroups.Name ,Relations.UserID, Relations.GroupID
                 FROM Relations
                 JOIN Users      ON Relations.UserID = Users.UserID
                 JOIN UserGroups ON Relations.GroupID = UserGroups.GroupID
-                WHERE Relations.GroupID = ?
+                WHERE Relations.GroupID = ? AND Users.DeletedAt IS NULL AND UserGroups.DeletedAt IS NULL
                 """, (group_id,))
     return cur.fetchall()
 
-def get_relation(user_id: int, group_id: int) -> tuple[int, int]:
-    cur.execute("""
-                SELECT UserID, GroupID
+def get_group_members(group_id: int, after_id: int | None, limit: int, named: bool = False,
+                      effective: bool = False) -> list[tuple[int, str, str, str, str, int]] | list[dict]:
+    #Full user records of a group's members, keyset paged by UserID along the (GroupID, UserID) index.
+    #Effective members include the members of every group nested below it, found through the closure.
+    #Each group below takes at most limit members after the cursor from its index range, the page is among them,
+    #so a page costs limit rows per nested group instead of every effective member.
+    #A hidden group has no members, the groups below it were detached when it was hidden
+    cur: Cursor = cursor()
+    if named:
+        cur.row_factory = USER_ROW
+    after: int = after_id if after_id is not None else -1
+    if effective:
+        cur.execute(f"""
+                    SELECT Users.UserID, Users.Username, Users.FirstName, Users.LastName, Users.Email, Users.GroupCount
+                    FROM (
+                        SELECT DISTINCT Relations.UserID
+                        FROM GroupClosure
+                        JOIN Relations ON Relations.rowid IN (
+                            SELECT Members.rowid
+                            FROM Relations AS Members
+                            WHERE Members.GroupID = GroupClosure.DescendantID AND Members.UserID > ?
+                              AND Members.UserID NOT IN ({HIDDEN_USERS})
+                            ORDER BY Members.UserID
+                            LIMIT ?
+                            )
+                        WHERE GroupClosure.AncestorID = ? AND GroupClosure.AncestorID NOT IN ({HIDDEN_GROUPS})
+                        ORDER BY Relations.UserID
+                        LIMIT ?
+                        ) AS Page
+                    JOIN Users ON Users.UserID = Page.UserID
+                    ORDER BY Users.UserID
+                    """, (after, limit, group_id, limit))
+        return cur.fetchall()
+
+    cur.execute(f"""
+                SELECT Users.UserID, Users.Username, Users.FirstName, Users.LastName, Users.Email, Users.GroupCount
                 FROM Relations
-                WHERE UserID = ? AND GroupID = ?
-                """, (user_id, group_id))
-    return cur.fetchone()
+                JOIN Users ON Relations.UserID = Users.UserID
+                WHERE Relations.GroupID = ? AND Relations.GroupID NOT IN ({HIDDEN_GROUPS}) AND Relations.UserID > ? AND Users.DeletedAt IS NULL
+                ORDER BY Relations.UserID
+                LIMIT ?
+                """, (group_id, after, limit))
+    return cur.fetchall()
 
-def has_relation(user_id: int, group_id: int) -> bool:
-    cur.execute("SELECT UserID FROM Relations WHERE UserID = ? AND GroupID = ?", (user_id, group_id))
-    return cur.fetchone() != None
+def add_relation(user_id: int, group_id: int) -> tuple[int, int]:
+    #Raises sqlite3.IntegrityError if the relation exists or the user or group does not
+    cur: Cursor = cursor()
+    cur.execute("""
+        INSERT INTO Relations (UserID, GroupID)
+        VALUES (?, ?)
+        RETURNING UserID, GroupID
+        """, (user_id, group_id))
+    return cur.fetchall()[0]
 
-def has_user_relation(user_id: int) -> bool:
-    cur.execute("SELECT UserID FROM Relations WHERE UserID = ?", (user_id,))
-    return cur.fetchone() != None
+def add_relations(relations: list[tuple[int, int]]) -> tuple[list[tuple[int, int]], list[tuple[int, str]]]:
+    #Inserts all relations without a conflict in one transaction, returns the created pairs and (index, reason) per skipped pair
+    cur: Cursor = cursor()
+    known_users: set = {row[0] for row in select_in(cur, "SELECT UserID FROM Users WHERE UserID IN ({}) AND DeletedAt IS NULL", list({relation[0] for relation in relations}))}
+    known_groups: set = {row[0] for row in select_in(cur, "SELECT GroupID FROM UserGroups WHERE GroupID IN ({}) AND DeletedAt IS NULL", list({relation[1] for relation in relations}))}
+    taken_relations: set = set()
+    for chunk in chunked(relations):
+        cur.execute(f"""
+            SELECT UserID, GroupID FROM Relations
+            WHERE (UserID, GroupID) IN (VALUES {", ".join(["(?, ?)"] * len(chunk))})
+            """, [value for relation in chunk for value in relation])
+        taken_relations.update(cur.fetchall())
 
-def has_group_relation(group_id: int) -> bool:
-    cur.execute("SELECT GroupID FROM Relations WHERE GroupID = ?", (group_id,))
-    return cur.fetchone() != None
+    new_relations: list[tuple[int, int]] = []
+    conflicts: list[tuple[int, str]] = []
+    for index, (user_id, group_id) in enumerate(relations):
+        if (user_id, group_id) in taken_relations:
+            conflicts.append((index, f"Relation between User ID {user_id} and Group ID {group_id} already exists"))
+        elif user_id not in known_users:
+            conflicts.append((index, f"User with ID {user_id} not found."))
+        elif group_id not in known_groups:
+            conflicts.append((index, f"Group with ID {group_id} not found."))
+        else:
+            taken_relations.add((user_id, group_id))
+            new_relations.append((user_id, group_id))
 
-def add_relation(user_id: int, group_id: int) -> None:
-    cur.execute("""
+    cur.executemany("""
         INSERT INTO Relations (UserID, GroupID)
         VALUES (?, ?)
+        """, new_relations)
+
+    return new_relations, conflicts
+
+def delete_relation(user_id: int, group_id: int) -> bool:
+    cur: Cursor = cursor()
+    cur.execute(f"""
+        DELETE FROM Relations
+        WHERE UserID = ? AND GroupID = ? AND UserID NOT IN ({HIDDEN_USERS}) AND GroupID NOT IN ({HIDDEN_GROUPS})
         """, (user_id, group_id))
-    con.commit()
+    return cur.rowcount > 0
 
-def delete_relation(user_id: int, group_id: int) -> None:
-    cur.execute("DELETE FROM Relations WHERE UserID = ? AND GroupID = ?", (user_id, group_id))
-    con.commit()
+def delete_user_relations(user_id: int) -> int | tuple[int, str, int, str, int, int, int, int | None]:
+    #Returns the number of deleted relations, none for a hidden user whose relations a delete job deletes,
+    #or the job row if the user is in more groups than DELETE_CHUNK_SIZE and a job was started to delete them
+    cur: Cursor = cursor()
+    cur.execute("SELECT GroupCount FROM Users WHERE UserID = ? AND DeletedAt IS NULL", (user_id,))
+    row: tuple | None = cur.fetchone()
+    if row is None:
+        return 0
+    if row[0] > DELETE_CHUNK_SIZE:
+        return insert_delete_job(cur, "user_relations", user_id, row[0])
 
-def delete_user_relations(user_id: int) -> None:
     cur.execute("DELETE FROM Relations WHERE UserID = ?", (user_id,))
-    con.commit()
+    return cur.rowcount
+
+def delete_group_relations(group_id: int) -> int | tuple[int, str, int, str, int, int, int, int | None]:
+    #Returns the number of deleted relations, none for a hidden group whose relations a delete job deletes,
+    #or the job row if the group has more members than DELETE_CHUNK_SIZE and a job was started to delete them
+    cur: Cursor = cursor()
+    cur.execute("SELECT MemberCount FROM UserGroups WHERE GroupID = ? AND DeletedAt IS NULL", (group_id,))
+    row: tuple | None = cur.fetchone()
+    if row is None:
+        return 0
+    if row[0] > DELETE_CHUNK_SIZE:
+        return insert_delete_job(cur, "group_relations", group_id, row[0])
 
-def delete_group_relations(group_id: int) -> None:
     cur.execute("DELETE FROM Relations WHERE GroupID = ?", (group_id,))
-    con.commit()
\ No newline at end of file
+    return cur.rowcount
+
+def load_relation_ids(consumer: Callable[[list[tuple[int, int]]], None]) -> int:
+    #Streams every (UserID, GroupID) pair to consumer in chunks, returns the last change sequence number
+    #to follow the change log from. Run through read(), so the pairs and the number come from one snapshot
+    cur: Cursor = cursor()
+    version: int = last_change_seq(cur)
+    cur.execute(f"SELECT UserID, GroupID FROM Relations WHERE UserID NOT IN ({HIDDEN_USERS}) AND GroupID NOT IN ({HIDDEN_GROUPS})")
+    while rows := cur.fetchmany(BULK_CHUNK_SIZE):
+        consumer(rows)
+    return version
+
+#Group relation funcs
+def get_user_groups(user_id: int, effective: bool = False, named: bool = False) -> list[tuple[int, str, str, int]] | list[dict]:
+    #Groups the user is a direct member of, or effective ones that also include every group above those
+    cur: Cursor = cursor()
+    if named:
+        cur.row_factory = GROUP_ROW
+    cur.execute(f"""
+                SELECT GroupID, Name, Description, MemberCount
+                FROM UserGroups
+                WHERE GroupID IN (
+                    {"SELECT GroupClosure.AncestorID FROM Relations JOIN GroupClosure ON GroupClosure.DescendantID = Relations.GroupID"
+                     if effective else "SELECT Relations.GroupID FROM Relations"}
+                    WHERE Relations.UserID = ? AND Relations.UserID NOT IN ({HIDDEN_USERS})
+                    ) AND DeletedAt IS NULL
+                ORDER BY GroupID
+                """, (user_id,))
+    return cur.fetchall()
+
+def get_subgroups(group_id: int, nested: bool = False, named: bool = False) -> list[tuple[int, str, str, int]] | list[dict]:
+    #Groups that are direct members of the group, or all groups below it at any depth
+    cur: Cursor = cursor()
+    if named:
+        cur.row_factory = GROUP_ROW
+    cur.execute(f"""
+                SELECT GroupID, Name, Description, MemberCount
+                FROM UserGroups
+                WHERE GroupID IN (
+                    {"SELECT DescendantID FROM GroupClosure WHERE AncestorID = ? AND DescendantID != AncestorID"
+                     if nested else "SELECT ChildID FROM GroupRelations WHERE ParentID = ?"}
+                    )
+                ORDER BY GroupID
+                """, (group_id,))
+    return cur.fetchall()
+
+def get_supergroups(group_id: int, nested: bool = False, named: bool = False) -> list[tuple[int, str, str, int]] | list[dict]:
+    #Groups the group is a direct member of, or all groups above it at any depth
+    cur: Cursor = cursor()
+    if named:
+        cur.row_factory = GROUP_ROW
+    cur.execute(f"""
+                SELECT GroupID, Name, Description, MemberCount
+                FROM UserGroups
+                WHERE GroupID IN (
+                    {"SELECT AncestorID FROM GroupClosure WHERE DescendantID = ? AND AncestorID != DescendantID"
+                     if nested else "SELECT ParentID FROM GroupRelations WHERE ChildID = ?"}
+                    )
+                ORDER BY GroupID
+                """, (group_id,))
+    return cur.fetchall()
+
+def add_group_relation(parent_id: int, child_id: int) -> tuple[int, int]:
+    #Raises sqlite3.IntegrityError if the relation exists, a group does not or the relation would close a cycle
+    cur: Cursor = cursor()
+    cur.execute("""
+        INSERT INTO GroupRelations (ParentID, ChildID)
+        VALUES (?, ?)
+        RETURNING ParentID, ChildID
+        """, (parent_id, child_id))
+    return cur.fetchall()[0]
+
+def delete_group_relation(parent_id: int, child_id: int) -> bool:
+    cur: Cursor = cursor()
+    cur.execute("DELETE FROM GroupRelations WHERE ParentID = ? AND ChildID = ?", (parent_id, child_id))
+    return cur.rowcount > 0
+
+#Delete job funcs
+DELETE_JOB_COLUMNS: str = "JobID, Entity, EntityID, Status, Total, Deleted, Created, Finished"
+
+def delete_job_row(_: Cursor, row: tuple) -> dict:
+    return dict(job_id = row[0], entity = row[1], entity_id = row[2], status = row[3], total = row[4], deleted = row[5],
+                created = row[6], finished = row[7])
+
+def start_delete_job(cur: Cursor, entity: str, entity_id: int, total: int) -> tuple[int, str, int, str, int, int, int, int | None]:
+    #Hides the user or group and returns the new job row. The edges of a group go at once, there are few of them
+    #and the group hierarchy must not reach through a group that is gone.
+    #The groups of a hidden user and the members of a hidden group stop counting it right away, a single update
+    #of the count columns rather than the deletes the job spreads out
+    table, key = DELETE_TARGETS[entity]
+    cur.execute(f"UPDATE {table} SET DeletedAt = strftime('%s', 'now'), Version = Version + 1 WHERE {key} = ?", (entity_id,))
+    if entity == "user":
+        cur.execute("""
+            UPDATE UserGroups SET MemberCount = MemberCount - 1, Version = Version + 1
+            WHERE GroupID IN (SELECT GroupID FROM Relations WHERE UserID = ?)
+            """, (entity_id,))
+    else:
+        cur.execute("""
+            UPDATE Users SET GroupCount = GroupCount - 1, Version = Version + 1
+            WHERE UserID IN (SELECT UserID FROM Relations WHERE GroupID = ?)
+            """, (entity_id,))
+        cur.execute("DELETE FROM GroupRelations WHERE ParentID = ?", (entity_id,))
+        cur.execute("DELETE FROM GroupRelations WHERE ChildID = ?", (entity_id,))
+    return insert_delete_job(cur, entity, entity_id, total)
+
+def insert_delete_job(cur: Cursor, entity: str, entity_id: int, total: int) -> tuple[int, str, int, str, int, int, int, int | None]:
+    #Returns the new job row, the delete job loop of every worker picks it up
+    cur.execute(f"""
+        INSERT INTO DeleteJobs (Entity, EntityID, Total, Created)
+        VALUES (?, ?, ?, strftime('%s', 'now'))
+        RETURNING {DELETE_JOB_COLUMNS}
+        """, (entity, entity_id, total))
+    return cur.fetchall()[0]
+
+def get_delete_job(job_id: int, named: bool = False) -> tuple[int, str, int, str, int, int, int, int | None] | dict | None:
+    cur: Cursor = cursor()
+    if named:
+        cur.row_factory = delete_job_row
+    cur.execute(f"SELECT {DELETE_JOB_COLUMNS} FROM DeleteJobs WHERE JobID = ?", (job_id,))
+    return cur.fetchone()
+
+def get_running_delete_jobs() -> list[int]:
+    #Oldest first, jobs left running by a stopped worker are picked up again by any worker
+    cur: Cursor = cursor()
+    cur.execute("SELECT JobID FROM DeleteJobs WHERE Status = 'running' ORDER BY JobID")
+    return [row[0] for row in cur.fetchall()]
+
+def run_delete_job_step(job_id: int) -> tuple[tuple[int, str, int, str, int, int, int, int | None], list[tuple[int, int]]] | None:
+    #Deletes the next DELETE_CHUNK_SIZE relations of the hidden user or group, and the row itself once none are left.
+    #Returns the job row and the deleted (UserID, GroupID) pairs, or None if the job is not running.
+    #Relations of a hidden row cannot be added, so a chunk coming back short means the last one was deleted.
+    #A job deleting only the relations of a user or group leaves its row alone, relations added while it runs may go too
+    cur: Cursor = cursor()
+    cur.execute("SELECT Entity, EntityID FROM DeleteJobs WHERE JobID = ? AND Status = 'running'", (job_id,))
+    job: tuple | None = cur.fetchone()
+    if job is None:
+        return None
+
+    entity, entity_id = job
+    table, key = DELETE_TARGETS[RELATION_DELETE_TARGETS.get(entity, entity)]
+    cur.execute(f"""
+        DELETE FROM Relations
+        WHERE rowid IN (SELECT rowid FROM Relations WHERE {key} = ? LIMIT ?)
+        RETURNING UserID, GroupID
+        """, (entity_id, DELETE_CHUNK_SIZE))
+    deleted: list[tuple[int, int]] = cur.fetchall()
+
+    finished: bool = len(deleted) < DELETE_CHUNK_SIZE
+    if finished and entity not in RELATION_DELETE_TARGETS:
+        cur.execute(f"DELETE FROM {table} WHERE {key} = ?", (entity_id,))
+    cur.execute(f"""
+        UPDATE DeleteJobs
+        SET Deleted = Deleted + ?, Status = ?, Finished = CASE WHEN ? THEN strftime('%s', 'now') END
+        WHERE JobID = ?
+        RETURNING {DELETE_JOB_COLUMNS}
+        """, (len(deleted), "done" if finished else "running", finished, job_id))
+    return cur.fetchall()[0], deleted
+
+#Batch funcs
+class BatchError(Exception):
+    """Operation number index of a batch failed with error, or found no row to change if error is None.
+    For a foreign key error missing is the ("user" or "group", ID) that did not exist when the operation ran"""
+
+    def __init__(self, index: int, error: sqlite3.Error | None, missing: tuple[str, int] | None = None):
+        super().__init__(f"Batch operation {index} failed: {error}")
+        self.index: int = index
+        self.error: sqlite3.Error | None = error
+        self.missing: tuple[str, int] | None = missing
+
+#Entity -> its existence check, hidden rows count as missing like they do for the foreign key triggers
+BATCH_KEY_CHECKS: dict[str, Callable[[int], bool]] = {"user": has_user_id, "group": has_group_id}
+
+def run_batch(operations: list[Callable[[list], Any]], foreign_keys: Callable[[int], list[tuple[str, int]]] = lambda _: []) -> list:
+    #Runs each operation with the results of the ones before it, so it can use the IDs they created.
+    #All of them share the caller's transaction, the first failure raises BatchError and the writer rolls back the rest.
+    #foreign_keys gives the (entity, ID) pairs operation index refers to, checked before the rollback undoes rows created earlier in the batch
+    results: list = []
+    for index, operation in enumerate(operations):
+        try:
+            result: Any = operation(results)
+        except sqlite3.IntegrityError as error:
+            missing: tuple[str, int] | None = None
+            if "FOREIGN KEY" in str(error):
+                missing = next((key for key in foreign_keys(index) if not BATCH_KEY_CHECKS[key[0]](key[1])), None)
+            raise BatchError(index, error, missing) from error
+        except sqlite3.Error as error:
+            raise BatchError(index, error) from error
+        if result is None or result is False:
+            raise BatchError(index, None)
+        results.append(result)
+    return results
+
+#Change funcs
+def last_change_seq(cur: Cursor) -> int:
+    #The newest sequence number handed out, 0 before the first change
+    cur.execute("SELECT seq FROM sqlite_sequence WHERE name = 'Changes'")
+    row: tuple | None = cur.fetchone()
+    return row[0] if row else 0
+
+def get_last_change_seq() -> int:
+    return last_change_seq(cursor())
+
+def change_row(_: Cursor, row: tuple) -> dict:
+    return dict(seq = row[0], entity = row[1], operation = row[2], user_id = row[3], group_id = row[4],
+                data = json.loads(row[5]) if row[5] is not None else None, created = row[6])
+
+def get_changes(since: int, limit: int) -> tuple[list[dict], int, int]:
+    #Changes after the since sequence number, oldest first, with the oldest sequence number still kept and the last one handed out.
+    #Run through read(), the bounds come from the same snapshot as the rows, so a prune cannot slip in between.
+    #Continue from the last returned change, not from the last sequence number, which may already be past newer changes
+    cur: Cursor = cursor()
+    cur.row_factory = change_row
+    cur.execute("""
+                SELECT Seq, Entity, Operation, UserID, GroupID, Data, Created
+                FROM Changes
+                WHERE Seq > ?
+                ORDER BY Seq
+                LIMIT ?
+                """, (since, limit))
+    changes: list[dict] = cur.fetchall()
+
+    cur = cursor()
+    cur.execute("SELECT MIN(Seq) FROM Changes")
+    oldest: int | None = cur.fetchone()[0]
+    last: int = last_change_seq(cur)
+    return changes, oldest if oldest is not None else last + 1, last
+
+#Version funcs
+def get_table_versions(tables: tuple[str, ...]) -> list[tuple[int, int]]:
+    #(Version, Modified) per table in the given order, both only ever grow
+    cur: Cursor = cursor()
+    cur.execute(f"SELECT Name, Version, Modified FROM TableVersions WHERE Name IN ({placeholders(len(tables))})", tables)
+    versions: dict = {row[0]: (row[1], row[2]) for row in cur.fetchall()}
+    return [versions[table] for table in tables]
+
+#Snapshot funcs
+def list_snapshots() -> list[str]:
+    #Oldest first, the file names sort by their timestamp
+    if not os.path.isdir(SNAPSHOT_DIR):
+        return []
+    names: list[str] = sorted(name for name in os.listdir(SNAPSHOT_DIR) if name.startswith(SNAPSHOT_PREFIX) and name.endswith(SNAPSHOT_SUFFIX))
+    return [os.path.join(SNAPSHOT_DIR, name) for name in names]
+
+def latest_snapshot() -> str | None:
+    snapshots: list[str] = list_snapshots()
+    return snapshots[-1] if snapshots else None
+
+def snapshot() -> str:
+    #Copies the database in a single backup step, in WAL mode that read transaction never blocks writers
+    os.makedirs(SNAPSHOT_DIR, exist_ok = True)
+    now: int = time.time_ns()
+    path: str = os.path.join(SNAPSHOT_DIR, f"{SNAPSHOT_PREFIX}{time.strftime('%Y%m%dT%H%M%S', time.gmtime(now // 10**9))}-{now % 10**9:09d}{SNAPSHOT_SUFFIX}")
+    partial_path: str = path + ".partial"
+
+    target: Connection = sqlite3.connect(partial_path)
+    try:
+        cursor().connection.backup(target)
+        target.execute("PRAGMA journal_mode = DELETE")
+    finally:
+        target.close()
+    os.replace(partial_path, path)
+
+    for old_path in list_snapshots()[:-SNAPSHOT_KEEP]:
+        os.remove(old_path)
+    return path
+
+def restore_latest_snapshot() -> str | None:
+    #Warm start: creates a missing database from the newest snapshot, an existing database is left untouched.
+    #The copy is restored next to it and linked into place, the link fails if another worker created the database first
+    path: str | None = latest_snapshot()
+    if path is None or os.path.exists(DB_PATH):
+        return None
+
+    handle, partial_path = tempfile.mkstemp(".partial", os.path.basename(DB_PATH) + ".", os.path.dirname(os.path.abspath(DB_PATH)))
+    os.close(handle)
+    try:
+        source: Connection = sqlite3.connect(f"file:{path}?mode=ro", uri = True)
+        target: Connection = sqlite3.connect(partial_path)
+        try:
+            source.backup(target)
+            target.execute("PRAGMA journal_mode = WAL")
+        finally:
+            source.close()
+            target.close()
+        os.link(partial_path, DB_PATH)
+    except FileExistsError:
+        return None
+    finally:
+        os.remove(partial_path)
+    return path
@@ -1,16 +1,116 @@
-from fastapi import FastAPI, Body, HTTPException
-from pydantic import BaseModel, Field
-
+from collections.abc import AsyncIterator, Callable, Iterable
+from datetime import datetime, timezone
+from email.utils import formatdate
+from fastapi import FastAPI, Body, HTTPException, Query, Request, Response
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from fastapi.routing import APIRoute
+from pydantic import BaseModel, Field, ValidationError
+from typing import Any, Literal
+
+import asyncio
+import json
+import logging
+import os
 import sqlite3
+import time
 import db
+import admission
+import changefeed
+import membership
+import metrics
+from admission import Limiter
+from compression import CompressionMiddleware
+from cache import LRUCache
+from changefeed import ChangeNotifier
+from membership import MembershipIndex
 
 APP_NAME: str = "User & Groups API"
 APP_DESCRIPTION: str = "User & Groups API allows you to manage users, groups and their association."
 APP_VERSION: str = "1.0.0"
 
+#Failures of the background loops are logged with their traceback, the loops themselves keep running
+logger: logging.Logger = logging.getLogger("userdb")
+
+PAGE_LIMIT_DEFAULT: int = 100
+PAGE_LIMIT_MAX: int = 1000
+
+EXPORT_CHUNK_SIZE: int = 1000
+NDJSON_MEDIA_TYPE: str = "application/x-ndjson"
+NDJSON_RESPONSES: dict = {200: {"content": {NDJSON_MEDIA_TYPE: {}}, "description": "One JSON object per line"}}
+
+BULK_LIMIT_MAX: int = 50000
+#A batch holds the writer for all of its operations, so it is kept far smaller than a bulk insert
+BATCH_LIMIT_MAX: int = 1000
+
+SEARCH_LIMIT_DEFAULT: int = 20
+SEARCH_LIMIT_MAX: int = 100
+
+#Read-through caches for single-entity lookups, entries written by another worker process are only refreshed after the TTL
+CACHE_ENTRIES: int = int(os.environ.get("USERDB_CACHE_ENTRIES", "10000"))
+CACHE_TTL: float = float(os.environ.get("USERDB_CACHE_TTL", "5.0"))
+
+user_cache: LRUCache = LRUCache("users", CACHE_ENTRIES, CACHE_TTL)
+group_cache: LRUCache = LRUCache("groups", CACHE_ENTRIES, CACHE_TTL)
+user_relations_cache: LRUCache = LRUCache("user_relations", CACHE_ENTRIES, CACHE_TTL)
+
+#Membership index, loaded on startup and kept in sync by this worker's writes.
+#Every refresh interval the changes of other workers are read from the change log and applied to the index
+#and the caches, 0 turns that off for a single worker. The index is only rebuilt if it fell behind the kept log
+MEMBERSHIP_REFRESH_INTERVAL: float = float(os.environ.get("USERDB_MEMBERSHIP_REFRESH_INTERVAL", "1.0"))
+MEMBERSHIP_LIMIT_MAX: int = 100000
+
+membership_index: MembershipIndex = MembershipIndex()
+
+#Change feed, subscribers are woken by this worker's writes and poll for the writes of other workers
+CHANGE_POLL_INTERVAL: float = float(os.environ.get("USERDB_CHANGE_POLL_INTERVAL", "1.0"))
+CHANGE_KEEPALIVE_INTERVAL: float = 15.0
+CHANGE_LIMIT_DEFAULT: int = 1000
+CHANGE_LIMIT_MAX: int = 10000
+
+change_notifier: ChangeNotifier = ChangeNotifier()
+db.commit_listeners.append(change_notifier.notify)
+
+#Delete jobs, every worker runs them one chunk per write. A worker is woken by its own deletes
+#and polls for the jobs other workers started
+DELETE_POLL_INTERVAL: float = float(os.environ.get("USERDB_DELETE_POLL_INTERVAL", "1.0"))
+
+delete_job_notifier: ChangeNotifier = ChangeNotifier()
+
+#Admission control, each class of routes gets its own concurrency limit and wait queue, so a burst of scans
+#cannot starve point reads or writes. Scans get one DB thread less than there are, point reads always find one free
+ADMISSION_QUEUE_SIZE: int = int(os.environ.get("USERDB_ADMISSION_QUEUE_SIZE", "100"))
+ADMISSION_TIMEOUT: float = float(os.environ.get("USERDB_ADMISSION_TIMEOUT", "5.0"))
+ADMISSION_RETRY_AFTER: float = float(os.environ.get("USERDB_ADMISSION_RETRY_AFTER", "1.0"))
+
+point_limiter: Limiter = Limiter(
+    "point", int(os.environ.get("USERDB_POINT_CONCURRENCY", "256")), ADMISSION_QUEUE_SIZE, ADMISSION_TIMEOUT, ADMISSION_RETRY_AFTER
+)
+scan_limiter: Limiter = Limiter(
+    "scan", int(os.environ.get("USERDB_SCAN_CONCURRENCY", str(max(1, db.DB_THREADS - 1)))), ADMISSION_QUEUE_SIZE, ADMISSION_TIMEOUT, ADMISSION_RETRY_AFTER
+)
+write_limiter: Limiter = Limiter(
+    "write", int(os.environ.get("USERDB_WRITE_CONCURRENCY", str(db.WRITE_BATCH_SIZE))), ADMISSION_QUEUE_SIZE, ADMISSION_TIMEOUT, ADMISSION_RETRY_AFTER
+)
+LIMITERS: tuple[Limiter, ...] = (point_limiter, scan_limiter, write_limiter)
+
+#GET routes reading one row or one small set of rows, every other GET route is a scan
+POINT_READ_ROUTES: set[str] = {"/users/{user_id}", "/groups/{group_id}", "/relations/user/{user_id}", "/membership/{user_id}/{group_id}", "/jobs/{job_id}"}
+#Long-lived streams and service endpoints that must answer while the service is overloaded
+UNLIMITED_ROUTES: set[str] = {"/changes/stream", "/admin/admission", "/admin/cache", "/metrics"}
+
+#Response compression for clients sending Accept-Encoding, zstd is only offered with the zstandard package installed.
+#gzip level 4 was picked with bench.py --compression, level 9 saves a few percent more bytes for many times the CPU
+COMPRESSION_MIN_SIZE: int = int(os.environ.get("USERDB_COMPRESSION_MIN_SIZE", "1024"))
+GZIP_LEVEL: int = int(os.environ.get("USERDB_GZIP_LEVEL", "4"))
+ZSTD_LEVEL: int = int(os.environ.get("USERDB_ZSTD_LEVEL", "3"))
+
 TAG_USERS: str = "Users"
 TAG_GROUPS: str = "Groups"
 TAG_RELATIONS: str = "Users and Groups Relations"
+TAG_BATCH: str = "Batch"
+TAG_CHANGES: str = "Changes"
+TAG_JOBS: str = "Jobs"
+TAG_ADMIN: str = "Admin"
 
 TAGS_METADATA = [
     dict(
@@ -24,6 +124,22 @@ TAGS_METADATA = [
     dict(
         name = TAG_RELATIONS,
         description = "Operations with Relations between Users and Groups"
+    ),
+    dict(
+        name = TAG_BATCH,
+        description = "Several operations on Users, Groups and Relations in one transaction"
+    ),
+    dict(
+        name = TAG_CHANGES,
+        description = "Feed of every change to Users, Groups and Relations, for clients keeping a local copy in sync"
+    ),
+    dict(
+        name = TAG_JOBS,
+        description = "Progress of users and groups with too many relations to delete at once, which are deleted in the background"
+    ),
+    dict(
+        name = TAG_ADMIN,
+        description = "Service maintenance, such as database snapshots, cache statistics and metrics"
     )
 ]
 app = FastAPI(
@@ -32,14 +148,150 @@ app = FastAPI(
             version = APP_VERSION,
             openapi_tags = TAGS_METADATA
             )
+#Added first so it runs inside the metrics middleware, the request latency then includes compressing the body
+app.add_middleware(CompressionMiddleware, minimum_size = COMPRESSION_MIN_SIZE, levels = dict(gzip = GZIP_LEVEL, zstd = ZSTD_LEVEL))
+app.add_middleware(metrics.MetricsMiddleware)
+
+CACHES: tuple[LRUCache, ...] = (user_cache, group_cache, user_relations_cache)
+
+for metric_name, stat, kind, metric_description in (
+    ("userdb_cache_hits_total",         "hits",         "counter",  "Lookup cache hits"),
+    ("userdb_cache_misses_total",       "misses",       "counter",  "Lookup cache misses, including expired entries"),
+    ("userdb_cache_evictions_total",    "evictions",    "counter",  "Lookup cache entries evicted to stay within the size limit"),
+    ("userdb_cache_entries",            "size",         "gauge",    "Entries currently held by each lookup cache")
+):
+    metrics.register(metrics.Collector(
+        metric_name, metric_description, ("cache",), kind,
+        lambda stat = stat: {(cache.name,): cache.stats()[stat] for cache in CACHES}
+    ))
+
+metrics.register(metrics.Collector(
+    "userdb_membership_relations", "Relations held by the in-memory membership index", (), "gauge",
+    lambda: {(): membership_index.stats()["relations"]}
+))
+for metric_name, stat, kind, metric_description in (
+    ("userdb_admission_active",         "active",       "gauge",    "Requests being served per admission class"),
+    ("userdb_admission_waiting",        "waiting",      "gauge",    "Requests waiting for a slot per admission class"),
+    ("userdb_admission_rejected_total", "rejected",     "counter",  "Requests rejected with 503 per admission class")
+):
+    metrics.register(metrics.Collector(
+        metric_name, metric_description, ("class",), kind,
+        lambda stat = stat: {(limiter.name,): limiter.stats()[stat] for limiter in LIMITERS}
+    ))
+
+metrics.register(metrics.Collector(
+    "userdb_write_queue_length", "Writes queued for the writer thread", (), "gauge",
+    lambda: {(): db.write_queue_length()}
+))
+
+async def snapshot_loop():
+    #Every worker runs this loop, a worker skips its turn if another one has taken a snapshot recently
+    while True:
+        await asyncio.sleep(db.SNAPSHOT_INTERVAL)
+        try:
+            latest: str | None = await db.run(db.latest_snapshot)
+            if latest is not None and time.time() - os.path.getmtime(latest) < db.SNAPSHOT_INTERVAL / 2:
+                continue
+            await db.run(db.snapshot)
+        except Exception:
+            logger.exception("Database snapshot failed")
+
+async def delete_job_loop():
+    #Every worker runs this loop, workers picking up the same job share its chunks, each chunk is a write of its own
+    while True:
+        try:
+            for job_id in await db.read(db.get_running_delete_jobs):
+                while (step := await db.write(db.run_delete_job_step, job_id)) is not None:
+                    job, deleted = step
+                    #Only jobs deleting the relations of a user or group still left in place change the index here
+                    for user_id, group_id in deleted:
+                        membership_index.remove(user_id, group_id)
+                        user_relations_cache.invalidate(user_id)
+                    invalidate_counts({user_id for user_id, _ in deleted}, {group_id for _, group_id in deleted})
+                    if job[3] != "running":
+                        break
+        except Exception:
+            logger.exception("Delete job failed")
+        await delete_job_notifier.wait(DELETE_POLL_INTERVAL)
+
+def invalidate_counts(user_ids: Iterable[int], group_ids: Iterable[int]):
+    #The cached users and groups carry their membership counts, which every relation change moves
+    for user_id in user_ids:
+        user_cache.invalidate(user_id)
+    for group_id in group_ids:
+        group_cache.invalidate(group_id)
+
+def apply_change(change: dict):
+    #Applying a change this worker already applied itself is harmless, the index holds sets and the caches only drop entries
+    user_id: int | None = change["user_id"]
+    group_id: int | None = change["group_id"]
+    if change["entity"] == "relation":
+        if change["operation"] == "delete":
+            membership_index.remove(user_id, group_id)
+        else:
+            membership_index.add(user_id, group_id)
+        user_relations_cache.invalidate(user_id)
+        invalidate_counts((user_id,), (group_id,))
+    elif change["entity"] == "user":
+        if change["operation"] == "delete":
+            #A user hidden for a delete job keeps its relations for a while, they are no longer memberships
+            invalidate_counts((), membership_index.groups_of(user_id))
+            membership_index.remove_user(user_id)
+        user_cache.invalidate(user_id)
+        user_relations_cache.invalidate(user_id)
+    elif change["entity"] == "group":
+        if change["operation"] == "delete":
+            invalidate_counts(membership_index.users_of(group_id), ())
+            membership_index.remove_group(group_id)
+        group_cache.invalidate(group_id)
+        user_relations_cache.invalidate_tag(group_id)
+
+async def sync_changes():
+    """Applies the changes logged since the index was last synced, rebuilding it if the log no longer reaches back that far"""
+
+    global membership_index
+    while True:
+        changes, oldest, _ = await db.read(db.get_changes, membership_index.version, CHANGE_LIMIT_MAX)
+        if membership_index.version < oldest - 1:
+            membership_index = await db.read(membership.build_index)
+            for cache in CACHES:
+                cache.clear()
+            return
+
+        for change in changes:
+            apply_change(change)
+        if changes:
+            membership_index.version = changes[-1]["seq"]
+        if len(changes) < CHANGE_LIMIT_MAX:
+            return
+
+async def membership_refresh_loop():
+    while True:
+        await asyncio.sleep(MEMBERSHIP_REFRESH_INTERVAL)
+        try:
+            await sync_changes()
+        except Exception:
+            logger.exception("Membership index refresh failed")
 
 @app.on_event("startup")
 async def startup_event():
+    global membership_index
     try:
-        db.init_db()
+        await db.run(db.restore_latest_snapshot)
+        await db.run(db.init_db)
+        membership_index = await db.read(membership.build_index)
     except sqlite3.Error as error:
         raise HTTPException(status_code = 500, detail = f"Database initialization failed: {error}")
 
+    if MEMBERSHIP_REFRESH_INTERVAL > 0:
+        app.state.membership_task = asyncio.create_task(membership_refresh_loop())
+
+    if db.SNAPSHOT_INTERVAL > 0:
+        app.state.snapshot_task = asyncio.create_task(snapshot_loop())
+
+    #Always started, jobs left running by a stopped worker are continued
+    app.state.delete_job_task = asyncio.create_task(delete_job_loop())
+
 class User(BaseModel):
     username:   str         = Field(...,  example = "JDoe")
     first_name: str | None  = Field(None, example = "John")
@@ -54,7 +306,8 @@ class UserUpdate(BaseModel):
     email:      str | None  = Field(None, example = "JohnnyDoe@gmail.com")
 
 class UserDB(User):
-    user_id: int = Field(..., example = "10")
+    user_id:        int = Field(..., example = "10")
+    group_count:    int = Field(0,   example = "3", description = "Groups the user is a member of")
 
 class Group(BaseModel):
     name:        str        = Field(...,  example = "SysAdmin")
@@ -66,316 +319,762 @@ class GroupUpdate(BaseModel):
     description: str | None = Field(None, example = "Management and maintenance of system infrastructure. Full administrative rights.")
 
 class GroupDB(Group):
-    group_id: int = Field(..., example = "7")
+    group_id:       int = Field(..., example = "7")
+    member_count:   int = Field(0,   example = "25", description = "Users that are members of the group")
 
 class Relation(BaseModel):
     user_id:  int = Field(..., example = "10")
     group_id: int = Field(..., example = "7")
 
+class GroupRelation(BaseModel):
+    parent_id:  int = Field(..., example = "7", description = "Group the child group is a member of")
+    child_id:   int = Field(..., example = "12")
+
 class RelationDetailedDB(BaseModel):
     username:   str = Field(..., example = "JDoe")
     group_name: str = Field(..., example = "SysAdmin")
     user_id:    int = Field(..., example = "10")
     group_id:   int = Field(..., example = "7")
 
-@app.get("/users/", tags = [TAG_USERS], response_model = list[UserDB])
-async def get_all_users():
-    """Returns a list of all users and their information from the database"""
+class SnapshotInfo(BaseModel):
+    path:           str         = Field(..., example = "snapshots/userdb-20240101T120000-000000000.sqlite3")
+    created:        datetime    = Field(..., example = "2024-01-01T12:00:00Z")
+    age_seconds:    float       = Field(..., example = "42.5")
+    size_bytes:     int         = Field(..., example = "1048576")
+
+class Membership(BaseModel):
+    user_id:    int     = Field(..., example = "10")
+    group_id:   int     = Field(..., example = "7")
+    member:     bool    = Field(..., example = "true")
+
+class MembershipQueryResult(BaseModel):
+    count:      int         = Field(..., example = "2")
+    user_ids:   list[int]   = Field(..., example = [10, 12])
+
+class GroupStats(BaseModel):
+    groups:         int             = Field(..., example = "120")
+    relations:      int             = Field(..., example = "4012")
+    empty_groups:   int             = Field(..., example = "3")
+    by_size:        list[GroupDB]   = Field(..., description = "Groups ordered by member count")
+
+class AdmissionStats(BaseModel):
+    name:           str     = Field(..., example = "scan")
+    concurrency:    int     = Field(..., example = "3")
+    queue_size:     int     = Field(..., example = "100")
+    active:         int     = Field(..., example = "3")
+    waiting:        int     = Field(..., example = "12")
+    rejected:       int     = Field(..., example = "240")
+
+class CacheStats(BaseModel):
+    name:           str     = Field(..., example = "users")
+    size:           int     = Field(..., example = "812")
+    maxsize:        int     = Field(..., example = "10000")
+    ttl:            float   = Field(..., example = "5.0")
+    hits:           int     = Field(..., example = "120345")
+    misses:         int     = Field(..., example = "2210")
+    evictions:      int     = Field(..., example = "0")
+    expirations:    int     = Field(..., example = "1398")
+
+class Change(BaseModel):
+    seq:        int             = Field(..., example = "1042")
+    entity:     str             = Field(..., example = "user", description = "user, group, relation or group_relation")
+    operation:  str             = Field(..., example = "update", description = "insert, update or delete")
+    user_id:    int | None      = Field(None, example = "10")
+    group_id:   int | None      = Field(None, example = "7")
+    data:       dict | None     = Field(None, description = "The user or group after the change as the API returns it, null for deletes and relations. "
+                                                            "The parent_id and child_id of a group relation")
+    created:    int             = Field(..., example = "1760000000", description = "Unix time of the change")
+
+class DeleteJob(BaseModel):
+    job_id:     int         = Field(..., example = "3")
+    entity:     str         = Field(..., example = "group", description = "user or group, user_relations or group_relations if only its relations are deleted")
+    entity_id:  int         = Field(..., example = "7")
+    status:     str         = Field(..., example = "running", description = "running or done")
+    total:      int         = Field(..., example = "2500000", description = "Relations the user or group had when it was deleted")
+    deleted:    int         = Field(..., example = "1200000", description = "Relations deleted so far")
+    created:    int         = Field(..., example = "1760000000", description = "Unix time the user or group was deleted and hidden")
+    finished:   int | None  = Field(None, example = "1760000042", description = "Unix time the last relation and, unless only relations are deleted, the row itself were deleted")
+
+class ChangePage(BaseModel):
+    changes:    list[Change]
+    last_seq:   int = Field(..., example = "1042", description = "Pass as since to continue after these changes")
+
+class BulkConflict(BaseModel):
+    index:  int = Field(..., example = "3")
+    detail: str = Field(..., example = "User with Username JDoe already exists.")
+
+class UsersBulkResult(BaseModel):
+    created:   list[UserDB]
+    conflicts: list[BulkConflict]
+
+class GroupsBulkResult(BaseModel):
+    created:   list[GroupDB]
+    conflicts: list[BulkConflict]
+
+class RelationsBulkResult(BaseModel):
+    created:   list[Relation]
+    conflicts: list[BulkConflict]
+
+class UserKey(BaseModel):
+    user_id: int = Field(..., example = "10")
+
+class GroupKey(BaseModel):
+    group_id: int = Field(..., example = "7")
+
+class BatchOperation(BaseModel):
+    op:     Literal[
+                "add_user", "update_user", "delete_user", "add_group", "update_group", "delete_group",
+                "add_relation", "delete_relation", "add_group_relation", "delete_group_relation"
+            ]       = Field(..., example = "add_relation")
+    data:   dict    = Field(..., example = {"user_id": "$0", "group_id": "$1"},
+                            description = "Body of the matching single request, an ID field can be $N for the ID created by operation N of this batch")
+
+class BatchResult(BaseModel):
+    op:     str         = Field(..., example = "add_relation")
+    result: dict | None = Field(None, example = {"user_id": 10, "group_id": 7}, description = "What the matching single request returns, null for deletes")
+
+def raise_user_conflict(error: sqlite3.IntegrityError, username: str | None, email: str | None):
+    """Maps a unique index violation or a missing email on Users to a 400 response, other integrity errors are re-raised"""
+
+    if "NOT NULL constraint failed: Users.Email" in str(error):
+        raise HTTPException(status_code = 400, detail = "Email is required.")
+    if "UNIQUE" not in str(error):
+        raise error
+    if "Users.Email" in str(error):
+        raise HTTPException(status_code = 400, detail = f"User with Email {email} already exists.")
+    raise HTTPException(status_code = 400, detail = f"User with Username {username} already exists.")
+
+def raise_group_conflict(error: sqlite3.IntegrityError, name: str | None):
+    """Maps a unique index violation on UserGroups to a 400 response, other integrity errors are re-raised"""
+
+    if "UNIQUE" not in str(error):
+        raise error
+    raise HTTPException(status_code = 400, detail = f"Group with Name {name} already exists.")
+
+async def raise_relation_conflict(error: sqlite3.IntegrityError, user_id: int, group_id: int):
+    """Maps a failed relation insert to a 400 for a duplicate or a 404 for a missing user or group.
+    Only this error path pays for the extra lookup telling the two foreign keys apart"""
+
+    if "UNIQUE" in str(error):
+        raise HTTPException(status_code = 400, detail = f"Relation between User ID {user_id} and Group ID {group_id} already exists")
+    if "FOREIGN KEY" not in str(error):
+        raise error
+    if not await db.read(db.has_user_id, user_id):
+        raise HTTPException(status_code = 404, detail = f"User with ID {user_id} not found.")
+    raise HTTPException(status_code = 404, detail = f"Group with ID {group_id} not found.")
+
+async def raise_group_relation_conflict(error: sqlite3.IntegrityError, parent_id: int, child_id: int):
+    """Maps a failed group relation insert to a 400 for a duplicate or a cycle or a 404 for a missing group"""
+
+    if "UNIQUE" in str(error):
+        raise HTTPException(status_code = 400, detail = f"Group with Group ID {child_id} is already a member of Group ID {parent_id}")
+    if "cycle" in str(error):
+        raise HTTPException(status_code = 400, detail = f"Adding Group ID {child_id} to Group ID {parent_id} would make a group a member of itself")
+    if "FOREIGN KEY" not in str(error):
+        raise error
+    if not await db.read(db.has_group_id, parent_id):
+        raise HTTPException(status_code = 404, detail = f"Group with ID {parent_id} not found.")
+    raise HTTPException(status_code = 404, detail = f"Group with ID {child_id} not found.")
+
+def user_update_columns(user_update: UserUpdate) -> tuple[list, list]:
+    #SET clauses and their values for update_user, the UserID last. Raises a 400 if nothing is updated
+    columns: list = []
+    values: list = []
+    if user_update.username is not None:
+        columns.append("Username = ?")
+        values.append(user_update.username)
+    if user_update.first_name is not None:
+        columns.append("FirstName = ?")
+        values.append(user_update.first_name)
+    if user_update.last_name is not None:
+        columns.append("LastName = ?")
+        values.append(user_update.last_name)
+    if user_update.email is not None:
+        columns.append("Email = ?")
+        values.append(user_update.email)
+
+    if len(values) == 0:
+        raise HTTPException(status_code = 400, detail = "No update data was provided.")
+
+    values.append(user_update.user_id)
+    return columns, values
+
+def group_update_columns(group_update: GroupUpdate) -> tuple[list, list]:
+    #SET clauses and their values for update_group, the GroupID last. Raises a 400 if nothing is updated
+    columns: list = []
+    values: list = []
+    if group_update.name is not None:
+        columns.append("Name = ?")
+        values.append(group_update.name)
+    if group_update.description is not None:
+        columns.append("Description = ?")
+        values.append(group_update.description)
+
+    if len(values) == 0:
+        raise HTTPException(status_code = 400, detail = "No update data was provided.")
+
+    values.append(group_update.group_id)
+    return columns, values
+
+async def table_validators(*tables: str) -> dict:
+    """Returns ETag and Last-Modified headers for a response built from the given tables.
+    Read before the data itself, so a write in between can only make the ETag older than the body, never newer"""
+
+    versions: list[tuple[int, int]] = await db.read(db.get_table_versions, tables)
+    return {
+        "ETag":             'W/"' + "-".join(str(version) for version, _ in versions) + '"',
+        "Last-Modified":    formatdate(max(modified for _, modified in versions), usegmt = True)
+    }
 
-    db_users: list[tuple[int, str, str, str, str]] = db.get_all_users()
+def row_etag(row_id: int, version: int) -> str:
+    return f'W/"{row_id}-{version}"'
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """Weak comparison against If-None-Match, as used for conditional GET"""
+
+    if_none_match: str | None = request.headers.get("If-None-Match")
+    if if_none_match is None:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return etag.removeprefix("W/") in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+
+class EncodedJSONResponse(Response):
+    """Response for a body that is already encoded JSON"""
+
+    media_type = "application/json"
+
+def encoded_rows(rows: list[dict] | dict, response: Response | None = None) -> EncodedJSONResponse:
+    """Encodes named rows from db.py in one call of the C JSON encoder, skipping model construction and validation.
+    Routes keep their response_model, so the OpenAPI schema stays the same. Headers set on response are carried over"""
+
+    body: bytes = json.dumps(rows, ensure_ascii = False, separators = (",", ":")).encode()
+    return EncodedJSONResponse(body, headers = response.headers if response is not None else None)
+
+def delete_job_response(job: tuple) -> EncodedJSONResponse:
+    """202 for a user or group that was hidden and left to a delete job, Location points to the job's progress"""
+
+    delete_job_notifier.notify()
+    job_response: EncodedJSONResponse = encoded_rows(db.delete_job_row(None, job))
+    job_response.status_code = 202
+    job_response.headers["Location"] = f"/jobs/{job[0]}"
+    return job_response
+
+def check_page_cursor(prefix: str | None, after_id: int | None, after_key: str | None, prefix_name: str, key_name: str, id_name: str):
+    """Raises a 400 for a cursor not matching the page order, which a prefix filter switches from the ID to the prefixed column"""
+
+    if prefix and after_id is not None:
+        raise HTTPException(status_code = 400, detail = f"Pages with {prefix_name} are ordered by it, continue them with {key_name}.")
+    if not prefix and after_key is not None:
+        raise HTTPException(status_code = 400, detail = f"{key_name} only continues pages with {prefix_name}, use after_id to continue pages ordered by {id_name}.")
+
+def set_next_link(request: Request, response: Response, page_size: int, limit: int, **cursor):
+    """Adds a Link header pointing to the next page, unless the page came back short and is the last one"""
+
+    if page_size == limit:
+        response.headers["Link"] = f'<{request.url.include_query_params(**cursor)}>; rel="next"'
+
+@app.get("/users/", tags = [TAG_USERS], response_model = list[UserDB])
+async def get_all_users(
+        request:            Request,
+        response:           Response,
+        after_id:           int | None  = Query(None, description = "Return users after this UserID"),
+        after_username:     str | None  = Query(None, description = "Return users after this Username, pages with username_prefix only"),
+        limit:              int         = Query(PAGE_LIMIT_DEFAULT, ge = 1, le = PAGE_LIMIT_MAX),
+        descending:         bool        = Query(False, description = "Order by UserID, or Username with username_prefix, from last to first"),
+        username_prefix:    str | None  = Query(None, min_length = 1, description = "Only users whose Username starts with this, ordered by Username"),
+        email_domain:       str | None  = Query(None, min_length = 1, description = "Only users with an email at this domain"),
+        ids:                list[int] | None = Query(None, max_length = PAGE_LIMIT_MAX, description = "Only users with these UserIDs, repeat the parameter"),
+        usernames:          list[str] | None = Query(None, max_length = PAGE_LIMIT_MAX, description = "Only users with these Usernames, repeat the parameter"),
+        emails:             list[str] | None = Query(None, max_length = PAGE_LIMIT_MAX, description = "Only users with these Emails, repeat the parameter")
+        ):
+    """Returns a page of users and their information from the database, ordered by UserID, or by Username with username_prefix.
+    ids, usernames and emails fetch many specific users in one request, a user matching any of them is returned
+    and unknown ones are left out. Raise limit to get them all on one page.
+    If there may be more users, the Link header holds the URL of the next page"""
+
+    check_page_cursor(username_prefix, after_id, after_username, "username_prefix", "after_username", "UserID")
+    validators: dict = await table_validators("Users")
+    if etag_matches(request, validators["ETag"]):
+        return Response(status_code = 304, headers = validators)
+    response.headers.update(validators)
+
+    db_users: list[dict] = await db.read(db.get_users, after_id, after_username, limit, descending, username_prefix, email_domain,
+                                         ids, usernames, emails, True)
     if not db_users:
         raise HTTPException(status_code = 404, detail = "No users found.")
 
-    users_list: list[UserDB] = []
-    for user_tuple in db_users:
-        user = UserDB(
-            user_id     = user_tuple[0],
-            username    = user_tuple[1],
-            first_name  = user_tuple[2],
-            last_name   = user_tuple[3],
-            email       = user_tuple[4]
-        )
-        users_list.append(user)
+    if username_prefix:
+        set_next_link(request, response, len(db_users), limit, after_username = db_users[-1]["username"])
+    else:
+        set_next_link(request, response, len(db_users), limit, after_id = db_users[-1]["user_id"])
+    return encoded_rows(db_users, response)
+
+def ndjson(objects: list[dict]) -> bytes:
+    return "".join(json.dumps(obj, ensure_ascii = False, separators = (",", ":")) + "\n" for obj in objects).encode()
+
+async def stream_users(username_prefix: str | None, email_domain: str | None) -> AsyncIterator[bytes]:
+    after_id: int | None = None
+    after_username: str | None = None
+    while True:
+        db_users: list[dict] = await db.read(db.get_users, after_id, after_username, EXPORT_CHUNK_SIZE, False, username_prefix, email_domain,
+                                             None, None, None, True)
+        if not db_users:
+            return
+
+        yield ndjson(db_users)
+
+        if len(db_users) < EXPORT_CHUNK_SIZE:
+            return
+        after_id = db_users[-1]["user_id"]
+        after_username = db_users[-1]["username"]
+
+@app.get("/users/export", tags = [TAG_USERS], response_class = StreamingResponse, responses = NDJSON_RESPONSES)
+async def export_users(
+        username_prefix:    str | None  = Query(None, min_length = 1),
+        email_domain:       str | None  = Query(None, min_length = 1, description = "Only users with an email at this domain")
+        ):
+    """Streams all users as newline-delimited JSON, ordered by UserID, or by Username with username_prefix.
+    Rows are read in chunks so memory stays flat"""
+
+    return StreamingResponse(stream_users(username_prefix, email_domain), media_type = NDJSON_MEDIA_TYPE)
+
+@app.get("/users/search", tags = [TAG_USERS], response_model = list[UserDB])
+async def search_users(
+        q:      str = Query(..., min_length = 2, max_length = 200, description = "Words to match against the start of words in username, names and email"),
+        limit:  int = Query(SEARCH_LIMIT_DEFAULT, ge = 1, le = SEARCH_LIMIT_MAX)
+        ):
+    """Returns the users best matching a type-ahead search, ranked by relevance"""
+
+    db_users: list[dict] = await db.read(db.search_users, q, limit, True)
+    if not db_users:
+        raise HTTPException(status_code = 404, detail = "No users found.")
 
-    return users_list
+    return encoded_rows(db_users)
 
 @app.get("/users/{user_id}", tags = [TAG_USERS], response_model = UserDB)
-async def get_user(user_id: int):
+async def get_user(user_id: int, request: Request, response: Response):
     """Returns a specific user with a given UserID and their information from the database"""
 
-    db_user: tuple[int, str, str, str, str] = db.get_user(user_id)
+    cached_user: tuple[UserDB, str] | None = user_cache.get(user_id)
+    if cached_user is None:
+        token: int = user_cache.token()
+        db_user: tuple[int, str, str, str, str, int, int] = await db.read(db.get_user, user_id)
 
-    if not db_user:
-        raise HTTPException(status_code = 404, detail = f"User with User ID {user_id} not found.")
+        if not db_user:
+            raise HTTPException(status_code = 404, detail = f"User with User ID {user_id} not found.")
 
-    user = UserDB(
-        user_id     = db_user[0],
-        username    = db_user[1],
-        first_name  = db_user[2],
-        last_name   = db_user[3],
-        email       = db_user[4]
-    )
+        user = UserDB(
+            user_id     = db_user[0],
+            username    = db_user[1],
+            first_name  = db_user[2],
+            last_name   = db_user[3],
+            email       = db_user[4],
+            group_count = db_user[5]
+        )
+
+        cached_user = (user, row_etag(db_user[0], db_user[6]))
+        user_cache.set(user_id, cached_user, token)
 
+    user, etag = cached_user
+    if etag_matches(request, etag):
+        return Response(status_code = 304, headers = {"ETag": etag})
+
+    response.headers["ETag"] = etag
     return user
 @app.post("/users/", tags = [TAG_USERS], response_model = UserDB)
 async def add_user(user: User = Body(...)):
     """Adds a new user to the database. If successful, will return the new data, including an auto-generated UserID"""
 
-    if db.has_username(user.username):
-        raise HTTPException(status_code = 400, detail = f"User with Username {user.username} already exists.")
-    if db.has_email(user.email):
-        raise HTTPException(status_code = 400, detail = f"User with Email {user.email} already exists.")
-
-    db.add_user(user.username, user.first_name, user.last_name, user.email)
-
-    db_new_user: tuple[int, str, str, str, str] = db.get_user_via_name(user.username)
-    if not db_new_user:
-        raise HTTPException(status_code=404, detail=f"Failed to create new user")
+    try:
+        db_new_user: tuple[int, str, str, str, str, int, int] = await db.write(db.add_user, user.username, user.first_name, user.last_name, user.email)
+    except sqlite3.IntegrityError as error:
+        raise_user_conflict(error, user.username, user.email)
 
     new_user = UserDB(
         user_id     = db_new_user[0],
         username    = db_new_user[1],
         first_name  = db_new_user[2],
         last_name   = db_new_user[3],
-        email       = db_new_user[4]
+        email       = db_new_user[4],
+        group_count = db_new_user[5]
     )
 
     return new_user
 
-@app.patch("/users/{user_id}", tags = [TAG_USERS], response_model = UserDB)
-async def update_user(user_update: UserUpdate):
-    """Updates an existing user in the database. If successful, will return the new updated data"""
+@app.post("/users/bulk", tags = [TAG_USERS], response_model = UsersBulkResult)
+async def add_users(users: list[User] = Body(..., max_length = BULK_LIMIT_MAX)):
+    """Adds many users in one transaction. Users that clash with an existing or earlier user in the list are skipped
+    and reported in conflicts by their index, all others are created and returned with their new UserIDs"""
 
-    if not db.has_user_id(user_update.user_id):
-        raise HTTPException(status_code = 404, detail = f"User with User ID {user_update.user_id} not found.")
+    db_new_users, db_conflicts = await db.write(db.add_users, [(user.username, user.first_name, user.last_name, user.email) for user in users])
 
-    columns: list = []
-    values: list = []
-    if user_update.username is not None:
-        columns.append("Username = ?")
-        values.append(user_update.username)
-    if user_update.first_name is not None:
-        columns.append("FirstName = ?")
-        values.append(user_update.first_name)
-    if user_update.last_name is not None:
-        columns.append("LastName = ?")
-        values.append(user_update.last_name)
-    if user_update.email is not None:
-        columns.append("Email = ?")
-        values.append(user_update.email)
+    return UsersBulkResult(
+        created     = [
+            UserDB(user_id = user_tuple[0], username = user_tuple[1], first_name = user_tuple[2], last_name = user_tuple[3], email = user_tuple[4],
+                   group_count = user_tuple[5])
+            for user_tuple in db_new_users
+        ],
+        conflicts   = [BulkConflict(index = index, detail = detail) for index, detail in db_conflicts]
+    )
 
-    if len(values) == 0:
-        raise HTTPException(status_code = 400, detail = "No update data was provided.")
+@app.patch("/users/{user_id}", tags = [TAG_USERS], response_model = UserDB)
+async def update_user(user_update: UserUpdate):
+    """Updates an existing user in the database. If successful, will return the new updated data"""
 
-    values.append(user_update.user_id)
-    db.update_user(columns, values)
+    columns, values = user_update_columns(user_update)
+    try:
+        db_updated_user: tuple[int, str, str, str, str, int, int] | None = await db.write(db.update_user, columns, values)
+    except sqlite3.IntegrityError as error:
+        raise_user_conflict(error, user_update.username, user_update.email)
 
-    db_updated_user: tuple[int, str, str, str, str] = db.get_user(user_update.user_id)
     if not db_updated_user:
-        raise HTTPException(status_code=404, detail=f"Failed to update the user with User ID {user_update.user_id}")
+        raise HTTPException(status_code = 404, detail = f"User with User ID {user_update.user_id} not found.")
+
+    user_cache.invalidate(user_update.user_id)
+    user_relations_cache.invalidate(user_update.user_id)
 
     updated_user = UserDB(
         user_id     = db_updated_user[0],
         username    = db_updated_user[1],
         first_name  = db_updated_user[2],
         last_name   = db_updated_user[3],
-        email       = db_updated_user[4]
+        email       = db_updated_user[4],
+        group_count = db_updated_user[5]
     )
 
     return updated_user
 
-@app.delete("/users/{user_id}", tags = [TAG_USERS], response_model = set)
+@app.delete("/users/{user_id}", tags = [TAG_USERS], response_model = set,
+            responses = {202: {"model": DeleteJob, "description": "The user was hidden, a delete job removes its relations"}})
 async def delete_user(user_id: int):
-    """Deletes a specific user with a given UserID from the database"""
+    """Deletes a specific user with a given UserID from the database.
+    A user in more groups than fit one delete chunk is hidden at once and deleted in the background, the 202 response holds the job"""
 
-    if not db.has_user_id(user_id):
+    db_deleted: tuple | bool = await db.write(db.delete_user, user_id)
+    if not db_deleted:
         raise HTTPException(status_code = 404, detail = f"User with User ID {user_id} not found.")
 
-    if db.has_user_relation(user_id):
-        db.delete_user_relations(user_id)
-
-    db.delete_user(user_id)
+    invalidate_counts((), membership_index.groups_of(user_id))
+    membership_index.remove_user(user_id)
+    user_cache.invalidate(user_id)
+    user_relations_cache.invalidate(user_id)
+    if db_deleted is not True:
+        return delete_job_response(db_deleted)
     return {f"User with User ID {user_id} successfully deleted."}
 
 @app.get("/groups/", tags = [TAG_GROUPS], response_model = list[GroupDB])
-async def get_all_groups():
-    """Returns a list of all groups and their information from the database"""
+async def get_all_groups(
+        request:        Request,
+        response:       Response,
+        after_id:       int | None  = Query(None, description = "Return groups after this GroupID"),
+        after_name:     str | None  = Query(None, description = "Return groups after this Name, pages with name_prefix only"),
+        limit:          int         = Query(PAGE_LIMIT_DEFAULT, ge = 1, le = PAGE_LIMIT_MAX),
+        descending:     bool        = Query(False, description = "Order by GroupID, or Name with name_prefix, from last to first"),
+        name_prefix:    str | None  = Query(None, min_length = 1, description = "Only groups whose Name starts with this, ordered by Name"),
+        ids:            list[int] | None = Query(None, max_length = PAGE_LIMIT_MAX, description = "Only groups with these GroupIDs, repeat the parameter")
+        ):
+    """Returns a page of groups and their information from the database, ordered by GroupID, or by Name with name_prefix.
+    ids fetches many specific groups in one request, unknown ones are left out. Raise limit to get them all on one page.
+    If there may be more groups, the Link header holds the URL of the next page"""
+
+    check_page_cursor(name_prefix, after_id, after_name, "name_prefix", "after_name", "GroupID")
+    validators: dict = await table_validators("UserGroups")
+    if etag_matches(request, validators["ETag"]):
+        return Response(status_code = 304, headers = validators)
+    response.headers.update(validators)
+
+    db_groups: list[dict] = await db.read(db.get_groups, after_id, after_name, limit, descending, name_prefix, ids, True)
+    if not db_groups:
+        raise HTTPException(status_code = 404, detail = "No groups found.")
 
-    db_groups: list[tuple[int, str, str]] = db.get_all_groups()
+    if name_prefix:
+        set_next_link(request, response, len(db_groups), limit, after_name = db_groups[-1]["name"])
+    else:
+        set_next_link(request, response, len(db_groups), limit, after_id = db_groups[-1]["group_id"])
+    return encoded_rows(db_groups, response)
+
+async def stream_groups(name_prefix: str | None) -> AsyncIterator[bytes]:
+    after_id: int | None = None
+    after_name: str | None = None
+    while True:
+        db_groups: list[dict] = await db.read(db.get_groups, after_id, after_name, EXPORT_CHUNK_SIZE, False, name_prefix, None, True)
+        if not db_groups:
+            return
+
+        yield ndjson(db_groups)
+
+        if len(db_groups) < EXPORT_CHUNK_SIZE:
+            return
+        after_id = db_groups[-1]["group_id"]
+        after_name = db_groups[-1]["name"]
+
+@app.get("/groups/export", tags = [TAG_GROUPS], response_class = StreamingResponse, responses = NDJSON_RESPONSES)
+async def export_groups(name_prefix: str | None = Query(None, min_length = 1)):
+    """Streams all groups as newline-delimited JSON, ordered by GroupID, or by Name with name_prefix.
+    Rows are read in chunks so memory stays flat"""
+
+    return StreamingResponse(stream_groups(name_prefix), media_type = NDJSON_MEDIA_TYPE)
+
+@app.get("/groups/search", tags = [TAG_GROUPS], response_model = list[GroupDB])
+async def search_groups(
+        q:      str = Query(..., min_length = 2, max_length = 200, description = "Words to match against the start of words in group name and description"),
+        limit:  int = Query(SEARCH_LIMIT_DEFAULT, ge = 1, le = SEARCH_LIMIT_MAX)
+        ):
+    """Returns the groups best matching a type-ahead search, ranked by relevance"""
+
+    db_groups: list[dict] = await db.read(db.search_groups, q, limit, True)
     if not db_groups:
         raise HTTPException(status_code = 404, detail = "No groups found.")
 
-    groups_list: list[GroupDB] = []
-    for group_tuple in db_groups:
-        group = GroupDB(
-            group_id    = group_tuple[0],
-            name        = group_tuple[1],
-            description = group_tuple[2]
-        )
-        groups_list.append(group)
+    return encoded_rows(db_groups)
 
-    return groups_list
+@app.get("/groups/stats", tags = [TAG_GROUPS], response_model = GroupStats)
+async def get_group_stats(
+        request:    Request,
+        response:   Response,
+        limit:      int     = Query(PAGE_LIMIT_DEFAULT, ge = 1, le = PAGE_LIMIT_MAX),
+        ascending:  bool    = Query(False, description = "Smallest groups first instead of the largest")
+        ):
+    """Returns the number of groups and relations and the largest groups by member count.
+    The counts are kept up to date on every relation change, so nothing is counted here"""
+
+    validators: dict = await table_validators("UserGroups")
+    if etag_matches(request, validators["ETag"]):
+        return Response(status_code = 304, headers = validators)
+    response.headers.update(validators)
+
+    db_stats: dict = await db.read(db.get_group_stats, limit, ascending)
+    return encoded_rows(db_stats, response)
 
 @app.get("/groups/{group_id}", tags = [TAG_GROUPS], response_model = GroupDB)
-async def get_group(group_id: int):
+async def get_group(group_id: int, request: Request, response: Response):
     """Returns a specific group with a given GroupID and its information from the database"""
 
-    db_group: tuple[int, str, str] = db.get_group(group_id)
-    if not db_group:
-        raise HTTPException(status_code = 404, detail = f"Group with Group ID {group_id} not found.")
+    cached_group: tuple[GroupDB, str] | None = group_cache.get(group_id)
+    if cached_group is None:
+        token: int = group_cache.token()
+        db_group: tuple[int, str, str, int, int] = await db.read(db.get_group, group_id)
+        if not db_group:
+            raise HTTPException(status_code = 404, detail = f"Group with Group ID {group_id} not found.")
 
-    group = GroupDB(
-        group_id    = db_group[0],
-        name        = db_group[1],
-        description = db_group[2]
-    )
+        group = GroupDB(
+            group_id     = db_group[0],
+            name         = db_group[1],
+            description  = db_group[2],
+            member_count = db_group[3]
+        )
+
+        cached_group = (group, row_etag(db_group[0], db_group[4]))
+        group_cache.set(group_id, cached_group, token)
+
+    group, etag = cached_group
+    if etag_matches(request, etag):
+        return Response(status_code = 304, headers = {"ETag": etag})
 
+    response.headers["ETag"] = etag
     return group
 
 @app.post("/groups/", tags = [TAG_GROUPS], response_model = GroupDB)
 async def add_group(group: Group = Body(...)):
     """Adds a new group to the database. If successful, will return the new data, including an auto-generated GroupID"""
 
-    if db.has_group_name(group.name):
-        raise HTTPException(status_code = 400, detail = f"Group with Name {group.name} already exists.")
-
-    db.add_group(group.name, group.description)
-
-    db_new_group: tuple[int, str, str] = db.get_group_via_name(group.name)
-    if not db_new_group:
-        raise HTTPException(status_code = 404, detail = f"Failed to create new user")
+    try:
+        db_new_group: tuple[int, str, str, int, int] = await db.write(db.add_group, group.name, group.description)
+    except sqlite3.IntegrityError as error:
+        raise_group_conflict(error, group.name)
 
     new_group = GroupDB(
-        group_id    = db_new_group[0],
-        name        = db_new_group[1],
-        description = db_new_group[2]
+        group_id     = db_new_group[0],
+        name         = db_new_group[1],
+        description  = db_new_group[2],
+        member_count = db_new_group[3]
     )
 
     return new_group
 
-@app.patch("/groups/{group_id}", tags = [TAG_GROUPS], response_model = GroupDB)
-async def update_group(group_update: GroupUpdate):
-    """Updates an existing group in the database. If successful, will return the new updated data"""
+@app.post("/groups/bulk", tags = [TAG_GROUPS], response_model = GroupsBulkResult)
+async def add_groups(groups: list[Group] = Body(..., max_length = BULK_LIMIT_MAX)):
+    """Adds many groups in one transaction. Groups that clash with an existing or earlier group in the list are skipped
+    and reported in conflicts by their index, all others are created and returned with their new GroupIDs"""
 
-    if not db.has_group_id(group_update.group_id):
-        raise HTTPException(status_code = 404, detail = f"Group with ID {group_update.group_id} not found.")
+    db_new_groups, db_conflicts = await db.write(db.add_groups, [(group.name, group.description) for group in groups])
 
-    columns: list = []
-    values: list = []
-    if group_update.name is not None:
-        columns.append("Name = ?")
-        values.append(group_update.name)
-    if group_update.description is not None:
-        columns.append("Description = ?")
-        values.append(group_update.description)
+    return GroupsBulkResult(
+        created     = [
+            GroupDB(group_id = group_tuple[0], name = group_tuple[1], description = group_tuple[2], member_count = group_tuple[3])
+            for group_tuple in db_new_groups
+        ],
+        conflicts   = [BulkConflict(index = index, detail = detail) for index, detail in db_conflicts]
+    )
 
-    if len(values) == 0:
-        raise HTTPException(status_code = 400, detail = "No update data was provided.")
+@app.patch("/groups/{group_id}", tags = [TAG_GROUPS], response_model = GroupDB)
+async def update_group(group_update: GroupUpdate):
+    """Updates an existing group in the database. If successful, will return the new updated data"""
 
-    values.append(group_update.group_id)
-    db.update_group(columns, values)
+    columns, values = group_update_columns(group_update)
+    try:
+        db_updated_group: tuple[int, str, str, int, int] | None = await db.write(db.update_group, columns, values)
+    except sqlite3.IntegrityError as error:
+        raise_group_conflict(error, group_update.name)
 
-    db_updated_group: tuple[int, str, str] = db.get_group(group_update.group_id)
     if not db_updated_group:
-        raise HTTPException(status_code=404, detail=f"Failed to update new user")
+        raise HTTPException(status_code = 404, detail = f"Group with ID {group_update.group_id} not found.")
+
+    group_cache.invalidate(group_update.group_id)
+    user_relations_cache.invalidate_tag(group_update.group_id)
 
     updated_group = GroupDB(
-        group_id    = db_updated_group[0],
-        name        = db_updated_group[1],
-        description = db_updated_group[2],
+        group_id     = db_updated_group[0],
+        name         = db_updated_group[1],
+        description  = db_updated_group[2],
+        member_count = db_updated_group[3]
     )
 
     return updated_group
 
 
-@app.delete("/groups/{group_id}", tags = [TAG_GROUPS], response_model = set)
+@app.delete("/groups/{group_id}", tags = [TAG_GROUPS], response_model = set,
+            responses = {202: {"model": DeleteJob, "description": "The group was hidden, a delete job removes its relations"}})
 async def delete_group(group_id: int):
-    """Deletes a specific user with a given UserID from the database"""
+    """Deletes a specific user with a given UserID from the database.
+    A group with more members than fit one delete chunk is hidden at once and deleted in the background, the 202 response holds the job"""
 
-    if not db.has_group_id(group_id):
+    db_deleted: tuple | bool = await db.write(db.delete_group, group_id)
+    if not db_deleted:
         raise HTTPException(status_code = 404, detail = f"Group with ID {group_id} not found.")
 
-    if db.has_group_relation(group_id):
-        db.delete_group_relations(group_id)
-
-    db.delete_group(group_id)
+    invalidate_counts(membership_index.users_of(group_id), ())
+    membership_index.remove_group(group_id)
+    group_cache.invalidate(group_id)
+    user_relations_cache.invalidate_tag(group_id)
+    if db_deleted is not True:
+        return delete_job_response(db_deleted)
     return {f"Group with Group ID {group_id} successfully deleted."}
 
 @app.get("/relations/", tags = [TAG_RELATIONS], response_model = list[RelationDetailedDB])
-async def get_all_relations():
-    db_relations: list[tuple[str, str, int, int]] = db.get_all_relations()
+async def get_all_relations(
+        request:        Request,
+        response:       Response,
+        after_user_id:  int | None  = Query(None, description = "Return relations after this (UserID, GroupID) pair"),
+        after_group_id: int | None  = Query(None, description = "Return relations after this (UserID, GroupID) pair"),
+        limit:          int         = Query(PAGE_LIMIT_DEFAULT, ge = 1, le = PAGE_LIMIT_MAX),
+        descending:     bool        = Query(False, description = "Order by (UserID, GroupID) from newest to oldest"),
+        user_id:        int | None  = Query(None, description = "Only relations of this user"),
+        group_id:       int | None  = Query(None, description = "Only relations of this group")
+        ):
+    """Returns a page of relations ordered by UserID and GroupID.
+    If there may be more relations, the Link header holds the URL of the next page"""
+
+    if (after_user_id is None) != (after_group_id is None):
+        raise HTTPException(status_code = 400, detail = "after_user_id and after_group_id must be given together.")
+
+    validators: dict = await table_validators("Relations", "Users", "UserGroups")
+    if etag_matches(request, validators["ETag"]):
+        return Response(status_code = 304, headers = validators)
+    response.headers.update(validators)
+
+    after: tuple[int, int] | None = (after_user_id, after_group_id) if after_user_id is not None else None
+    db_relations: list[dict] = await db.read(db.get_relations, after, limit, descending, user_id, group_id, True)
 
     if not db_relations:
         raise HTTPException(status_code = 404, detail = "No relations found.")
 
-    relations_list: list[RelationDetailedDB] = []
-    for relation_tuple in db_relations:
-        relation = RelationDetailedDB(
-            username    = relation_tuple[0],
-            group_name  = relation_tuple[1],
-            user_id     = relation_tuple[2],
-            group_id    = relation_tuple[3]
-        )
-        relations_list.append(relation)
+    set_next_link(request, response, len(db_relations), limit,
+                  after_user_id = db_relations[-1]["user_id"], after_group_id = db_relations[-1]["group_id"])
+    return encoded_rows(db_relations, response)
+
+async def stream_relations(user_id: int | None, group_id: int | None) -> AsyncIterator[bytes]:
+    after: tuple[int, int] | None = None
+    while True:
+        db_relations: list[dict] = await db.read(db.get_relations, after, EXPORT_CHUNK_SIZE, False, user_id, group_id, True)
+        if not db_relations:
+            return
+
+        yield ndjson(db_relations)
+
+        if len(db_relations) < EXPORT_CHUNK_SIZE:
+            return
+        after = (db_relations[-1]["user_id"], db_relations[-1]["group_id"])
+
+@app.get("/relations/export", tags = [TAG_RELATIONS], response_class = StreamingResponse, responses = NDJSON_RESPONSES)
+async def export_relations(
+        user_id:    int | None = Query(None, description = "Only relations of this user"),
+        group_id:   int | None = Query(None, description = "Only relations of this group")
+        ):
+    """Streams all relations as newline-delimited JSON, ordered by UserID and GroupID. Rows are read in chunks so memory stays flat"""
 
-    return relations_list
+    return StreamingResponse(stream_relations(user_id, group_id), media_type = NDJSON_MEDIA_TYPE)
 
 @app.get("/relations/user/{user_id}", tags = [TAG_RELATIONS], response_model = list[RelationDetailedDB])
 async def get_user_relations(user_id: int):
-    db_relations: list[tuple[str, str, int, int]] = db.get_user_relations(user_id)
+    #The cache holds the encoded body, a hit is answered without touching JSON at all
+    cached_body: bytes | None = user_relations_cache.get(user_id)
+    if cached_body is not None:
+        return EncodedJSONResponse(cached_body)
+
+    token: int = user_relations_cache.token()
+    db_relations: list[dict] = await db.read(db.get_user_relations, user_id, True)
 
     if not db_relations:
         raise HTTPException(status_code = 404, detail = f"No relations found for user with User ID {user_id}.")
 
-    relations_list: list[RelationDetailedDB] = []
-    for relation_tuple in db_relations:
-        relation = RelationDetailedDB(
-            username    = relation_tuple[0],
-            group_name  = relation_tuple[1],
-            user_id     = relation_tuple[2],
-            group_id    = relation_tuple[3]
-        )
-        relations_list.append(relation)
+    relations_response: EncodedJSONResponse = encoded_rows(db_relations)
 
-    return relations_list
+    #Tagged with the group IDs, so renaming or deleting a group drops the lists that show its name
+    user_relations_cache.set(user_id, relations_response.body, token, tags = [relation["group_id"] for relation in db_relations])
+    return relations_response
 
 @app.get("/relations/group/{group_id}", tags = [TAG_RELATIONS], response_model = list[RelationDetailedDB])
-async def get_user_relations(group_id: int):
-    db_relations: list[tuple[str, str, int, int]] = db.get_group_relations(group_id)
+async def get_user_relations(group_id: int, request: Request, response: Response):
+    validators: dict = await table_validators("Relations", "Users", "UserGroups")
+    if etag_matches(request, validators["ETag"]):
+        return Response(status_code = 304, headers = validators)
+    response.headers.update(validators)
+
+    db_relations: list[dict] = await db.read(db.get_group_relations, group_id, True)
 
     if not db_relations:
         raise HTTPException(status_code = 404, detail = f"No relations found for group with Group ID {group_id}.")
 
-    relations_list: list[RelationDetailedDB] = []
-    for relation_tuple in db_relations:
-        relation = RelationDetailedDB(
-            username    = relation_tuple[0],
-            group_name  = relation_tuple[1],
-            user_id     = relation_tuple[2],
-            group_id    = relation_tuple[3]
-        )
-        relations_list.append(relation)
+    return encoded_rows(db_relations, response)
+
+@app.get("/relations/group/{group_id}/users", tags = [TAG_RELATIONS], response_model = list[UserDB])
+async def get_group_members(
+        group_id:   int,
+        request:    Request,
+        response:   Response,
+        after_id:   int | None  = Query(None, description = "Return members after this UserID"),
+        limit:      int         = Query(PAGE_LIMIT_DEFAULT, ge = 1, le = PAGE_LIMIT_MAX),
+        effective:  bool        = Query(False, description = "Include the members of all groups nested in this group")
+        ):
+    """Returns a page of the full user records of a group's members, ordered by UserID, in one joined query.
+    If there may be more members, the Link header holds the URL of the next page"""
+
+    validators: dict = await table_validators("Relations", "Users", "GroupRelations")
+    if etag_matches(request, validators["ETag"]):
+        return Response(status_code = 304, headers = validators)
+    response.headers.update(validators)
+
+    db_users: list[dict] = await db.read(db.get_group_members, group_id, after_id, limit, True, effective)
+    if not db_users:
+        raise HTTPException(status_code = 404, detail = f"No users found for group with Group ID {group_id}.")
 
-    return relations_list
+    set_next_link(request, response, len(db_users), limit, after_id = db_users[-1]["user_id"])
+    return encoded_rows(db_users, response)
 
 @app.post("/relations/", tags = [TAG_RELATIONS], response_model = Relation)
 async def add_relation(relation: Relation = Body(...)):
     """Adds a new user and group relation to the database. If successful, will return the new data"""
 
-    if db.has_relation(relation.user_id, relation.group_id):
-        raise HTTPException(status_code = 400, detail = f"Relation between User ID {relation.user_id} and Group ID {relation.group_id} already exists")
-
-    if not db.has_user_id(relation.user_id):
-        raise HTTPException(status_code = 404, detail = f"User with ID {relation.user_id} not found.")
-
-    if not db.has_group_id(relation.group_id):
-        raise HTTPException(status_code = 404, detail = f"Group with ID {relation.group_id} not found.")
-
-    db.add_relation(relation.user_id, relation.group_id)
+    try:
+        db_new_relation: tuple[int, int] = await db.write(db.add_relation, relation.user_id, relation.group_id)
+    except sqlite3.IntegrityError as error:
+        await raise_relation_conflict(error, relation.user_id, relation.group_id)
 
-    db_new_relation: tuple[int, int] = db.get_relation(relation.user_id, relation.group_id)
-    if not db_new_relation:
-        raise HTTPException(status_code=404, detail=f"Failed to create new relation")
+    membership_index.add(relation.user_id, relation.group_id)
+    user_relations_cache.invalidate(relation.user_id)
+    invalidate_counts((relation.user_id,), (relation.group_id,))
 
     new_relation = Relation(
         user_id  = db_new_relation[0],
@@ -383,32 +1082,485 @@ async def add_relation(relation: Relation = Body(...)):
     )
 
     return new_relation
+
+@app.post("/relations/bulk", tags = [TAG_RELATIONS], response_model = RelationsBulkResult)
+async def add_relations(relations: list[Relation] = Body(..., max_length = BULK_LIMIT_MAX)):
+    """Adds many relations in one transaction. Relations that already exist or point to a missing user or group are skipped
+    and reported in conflicts by their index, all others are created"""
+
+    db_new_relations, db_conflicts = await db.write(db.add_relations, [(relation.user_id, relation.group_id) for relation in relations])
+    for user_id, group_id in db_new_relations:
+        membership_index.add(user_id, group_id)
+        user_relations_cache.invalidate(user_id)
+        invalidate_counts((user_id,), (group_id,))
+
+    return RelationsBulkResult(
+        created     = [Relation(user_id = user_id, group_id = group_id) for user_id, group_id in db_new_relations],
+        conflicts   = [BulkConflict(index = index, detail = detail) for index, detail in db_conflicts]
+    )
+
 @app.delete("/relations/", tags = [TAG_RELATIONS], response_model = set)
 async def delete_relation(relation: Relation = Body(...)):
     """Deletes a specific relation with a given UserID and GroupID from the database"""
 
-    if not db.has_relation(relation.user_id, relation.group_id):
+    if not await db.write(db.delete_relation, relation.user_id, relation.group_id):
         raise HTTPException(status_code = 404, detail = "Relation between User and Group not found")
 
-    db.delete_relation(relation.user_id, relation.group_id)
+    membership_index.remove(relation.user_id, relation.group_id)
+    user_relations_cache.invalidate(relation.user_id)
+    invalidate_counts((relation.user_id,), (relation.group_id,))
     return {f"Relation with User ID {relation.user_id} and Group ID {relation.group_id} successfully deleted."}
 
-@app.delete("/relations/user/{user_id}", tags = [TAG_RELATIONS], response_model = set)
+@app.delete("/relations/user/{user_id}", tags = [TAG_RELATIONS], response_model = set,
+            responses = {202: {"model": DeleteJob, "description": "A delete job removes the relations in the background"}})
 async def delete_user_relations(user_id: int):
-    """Deletes all relations with a given UserID from the database"""
+    """Deletes all relations with a given UserID from the database.
+    Relations of a user in more groups than fit one delete chunk are deleted in the background, the 202 response holds the job"""
 
-    if not db.has_user_relation(user_id):
+    db_deleted: int | tuple = await db.write(db.delete_user_relations, user_id)
+    if not db_deleted:
         raise HTTPException(status_code = 404, detail = f"No relations found for User ID {user_id}.")
+    if isinstance(db_deleted, tuple):
+        return delete_job_response(db_deleted)
 
-    db.delete_user_relations(user_id)
+    invalidate_counts((), membership_index.groups_of(user_id))
+    membership_index.remove_user(user_id)
+    user_relations_cache.invalidate(user_id)
     return {f"All relations with User ID {user_id} successfully deleted."}
 
-@app.delete("/relations/group/{group_id}", tags = [TAG_RELATIONS], response_model = set)
+@app.delete("/relations/group/{group_id}", tags = [TAG_RELATIONS], response_model = set,
+            responses = {202: {"model": DeleteJob, "description": "A delete job removes the relations in the background"}})
 async def delete_group_relations(group_id: int):
-    """Deletes all relations with a given GroupIP from the database"""
+    """Deletes all relations with a given GroupIP from the database.
+    Relations of a group with more members than fit one delete chunk are deleted in the background, the 202 response holds the job"""
 
-    if not db.has_group_relation(group_id):
+    db_deleted: int | tuple = await db.write(db.delete_group_relations, group_id)
+    if not db_deleted:
         raise HTTPException(status_code = 404, detail = f"No relations found for Group ID {group_id}.")
+    if isinstance(db_deleted, tuple):
+        return delete_job_response(db_deleted)
+
+    invalidate_counts(membership_index.users_of(group_id), ())
+    membership_index.remove_group(group_id)
+    user_relations_cache.invalidate_tag(group_id)
+    return {f"All relations with Group ID {group_id} successfully deleted."}
+
+@app.get("/relations/user/{user_id}/groups", tags = [TAG_RELATIONS], response_model = list[GroupDB])
+async def get_user_groups(
+        user_id:    int,
+        request:    Request,
+        response:   Response,
+        effective:  bool = Query(False, description = "Include all groups the user's groups are nested in")
+        ):
+    """Returns the groups a user is a member of, ordered by GroupID. Effective groups are looked up
+    in the precomputed group hierarchy, not by walking it"""
+
+    validators: dict = await table_validators("Relations", "UserGroups", "GroupRelations")
+    if etag_matches(request, validators["ETag"]):
+        return Response(status_code = 304, headers = validators)
+    response.headers.update(validators)
+
+    db_groups: list[dict] = await db.read(db.get_user_groups, user_id, effective, True)
+    if not db_groups:
+        raise HTTPException(status_code = 404, detail = f"No groups found for user with User ID {user_id}.")
+
+    return encoded_rows(db_groups, response)
+
+@app.get("/relations/group/{group_id}/subgroups", tags = [TAG_RELATIONS], response_model = list[GroupDB])
+async def get_subgroups(
+        group_id:   int,
+        request:    Request,
+        response:   Response,
+        nested:     bool = Query(False, description = "Include groups nested at any depth, not only direct members")
+        ):
+    """Returns the groups that are members of a group, ordered by GroupID"""
+
+    validators: dict = await table_validators("UserGroups", "GroupRelations")
+    if etag_matches(request, validators["ETag"]):
+        return Response(status_code = 304, headers = validators)
+    response.headers.update(validators)
+
+    db_groups: list[dict] = await db.read(db.get_subgroups, group_id, nested, True)
+    if not db_groups:
+        raise HTTPException(status_code = 404, detail = f"No subgroups found for group with Group ID {group_id}.")
+
+    return encoded_rows(db_groups, response)
+
+@app.get("/relations/group/{group_id}/supergroups", tags = [TAG_RELATIONS], response_model = list[GroupDB])
+async def get_supergroups(
+        group_id:   int,
+        request:    Request,
+        response:   Response,
+        nested:     bool = Query(False, description = "Include groups above at any depth, not only the direct parents")
+        ):
+    """Returns the groups a group is a member of, ordered by GroupID"""
+
+    validators: dict = await table_validators("UserGroups", "GroupRelations")
+    if etag_matches(request, validators["ETag"]):
+        return Response(status_code = 304, headers = validators)
+    response.headers.update(validators)
+
+    db_groups: list[dict] = await db.read(db.get_supergroups, group_id, nested, True)
+    if not db_groups:
+        raise HTTPException(status_code = 404, detail = f"No supergroups found for group with Group ID {group_id}.")
+
+    return encoded_rows(db_groups, response)
+
+@app.post("/relations/groups/", tags = [TAG_RELATIONS], response_model = GroupRelation)
+async def add_group_relation(group_relation: GroupRelation = Body(...)):
+    """Makes a group a member of another group, its members then count as effective members of the parent
+    and of every group above it. A relation that would make a group a member of itself is refused"""
+
+    try:
+        db_new_group_relation: tuple[int, int] = await db.write(db.add_group_relation, group_relation.parent_id, group_relation.child_id)
+    except sqlite3.IntegrityError as error:
+        await raise_group_relation_conflict(error, group_relation.parent_id, group_relation.child_id)
+
+    new_group_relation = GroupRelation(
+        parent_id = db_new_group_relation[0],
+        child_id  = db_new_group_relation[1]
+    )
+
+    return new_group_relation
+
+@app.delete("/relations/groups/", tags = [TAG_RELATIONS], response_model = set)
+async def delete_group_relation(group_relation: GroupRelation = Body(...)):
+    """Removes a group from another group"""
+
+    if not await db.write(db.delete_group_relation, group_relation.parent_id, group_relation.child_id):
+        raise HTTPException(status_code = 404, detail = "Relation between the groups not found")
+
+    return {f"Relation with Parent ID {group_relation.parent_id} and Child ID {group_relation.child_id} successfully deleted."}
+
+@app.get("/membership/users", tags = [TAG_RELATIONS], response_model = MembershipQueryResult)
+async def query_membership(
+        all_of:     list[int]   = Query([], description = "Users must be in every one of these groups"),
+        any_of:     list[int]   = Query([], description = "Users must be in at least one of these groups"),
+        none_of:    list[int]   = Query([], description = "Users must not be in any of these groups"),
+        limit:      int         = Query(PAGE_LIMIT_MAX, ge = 1, le = MEMBERSHIP_LIMIT_MAX)
+        ):
+    """Returns users by set algebra over group memberships, e.g. users in A and B but not C.
+    Answered from the in-memory membership index, count is the full result size, user_ids the lowest UserIDs up to limit"""
+
+    if not all_of and not any_of:
+        raise HTTPException(status_code = 400, detail = "At least one of all_of and any_of is required.")
+
+    user_ids: set[int] = membership_index.query(all_of, any_of, none_of)
+    return MembershipQueryResult(count = len(user_ids), user_ids = membership.smallest(user_ids, limit))
+
+@app.get("/membership/{user_id}/{group_id}", tags = [TAG_RELATIONS], response_model = Membership)
+async def get_membership(user_id: int, group_id: int):
+    """Returns whether a user is in a group, answered from the in-memory membership index"""
+
+    return Membership(user_id = user_id, group_id = group_id, member = membership_index.has(user_id, group_id))
+
+def snapshot_info(path: str) -> SnapshotInfo:
+    modified: float = os.path.getmtime(path)
+    return SnapshotInfo(
+        path        = path,
+        created     = datetime.fromtimestamp(modified, timezone.utc),
+        age_seconds = time.time() - modified,
+        size_bytes  = os.path.getsize(path)
+    )
+
+#Batch operation -> (body model, db call on the writer thread, result as the single request returns it)
+BATCH_OPERATIONS: dict[str, tuple[type[BaseModel], Callable[[Any], Any], Callable[[Any], dict | None]]] = {
+    "add_user": (
+        User, lambda user: db.add_user(user.username, user.first_name, user.last_name, user.email), lambda row: user_row_result(row)
+    ),
+    "update_user": (
+        UserUpdate, lambda user_update: db.update_user(*user_update_columns(user_update)), lambda row: user_row_result(row)
+    ),
+    "delete_user": (
+        UserKey, lambda key: db.delete_user(key.user_id), lambda _: None
+    ),
+    "add_group": (
+        Group, lambda group: db.add_group(group.name, group.description), lambda row: group_row_result(row)
+    ),
+    "update_group": (
+        GroupUpdate, lambda group_update: db.update_group(*group_update_columns(group_update)), lambda row: group_row_result(row)
+    ),
+    "delete_group": (
+        GroupKey, lambda key: db.delete_group(key.group_id), lambda _: None
+    ),
+    "add_relation": (
+        Relation, lambda relation: db.add_relation(relation.user_id, relation.group_id), lambda row: dict(user_id = row[0], group_id = row[1])
+    ),
+    "delete_relation": (
+        Relation, lambda relation: db.delete_relation(relation.user_id, relation.group_id), lambda _: None
+    ),
+    "add_group_relation": (
+        GroupRelation, lambda group_relation: db.add_group_relation(group_relation.parent_id, group_relation.child_id),
+        lambda row: dict(parent_id = row[0], child_id = row[1])
+    ),
+    "delete_group_relation": (
+        GroupRelation, lambda group_relation: db.delete_group_relation(group_relation.parent_id, group_relation.child_id), lambda _: None
+    )
+}
+#ID field -> the operation creating IDs it can refer to with $N
+BATCH_REFERENCES: dict[str, str] = {"user_id": "add_user", "group_id": "add_group", "parent_id": "add_group", "child_id": "add_group"}
+#Operation -> its foreign key fields and their entities, in the order a missing one is reported
+BATCH_FOREIGN_KEYS: dict[str, tuple[tuple[str, str], ...]] = {
+    "add_relation": (("user_id", "user"), ("group_id", "group")),
+    "add_group_relation": (("parent_id", "group"), ("child_id", "group"))
+}
+
+def user_row_result(row: tuple) -> dict:
+    return UserDB(user_id = row[0], username = row[1], first_name = row[2], last_name = row[3], email = row[4], group_count = row[5]).model_dump()
+
+def group_row_result(row: tuple) -> dict:
+    return GroupDB(group_id = row[0], name = row[1], description = row[2], member_count = row[3]).model_dump()
+
+def parse_batch_operation(index: int, operation: BatchOperation, operations: list[BatchOperation]) -> tuple[BaseModel, dict[str, int]]:
+    #Validates the body of one operation, returns it and its references as ID field -> index of the operation creating the ID
+    data: dict = dict(operation.data)
+    references: dict[str, int] = {}
+    for field, creator in BATCH_REFERENCES.items():
+        value: Any = data.get(field)
+        if not isinstance(value, str) or not value.startswith("$"):
+            continue
+        source: str = value[1:]
+        if not source.isdigit() or int(source) >= index or operations[int(source)].op != creator:
+            raise HTTPException(status_code = 400, detail = f"Operation {index}: {field} {value} must refer to an earlier {creator} operation.")
+        references[field] = int(source)
+        data[field] = 0
+
+    model: type[BaseModel] = BATCH_OPERATIONS[operation.op][0]
+    try:
+        body: BaseModel = model(**data)
+    except ValidationError as error:
+        raise HTTPException(status_code = 422, detail = [
+            dict(detail, loc = ["body", index, "data", *detail["loc"]]) for detail in error.errors(include_url = False, include_context = False)
+        ])
+
+    #Rejected here rather than on the writer, where it would abort the batch as a 400 anyway
+    try:
+        if operation.op == "update_user":
+            user_update_columns(body)
+        elif operation.op == "update_group":
+            group_update_columns(body)
+    except HTTPException as error:
+        raise HTTPException(status_code = error.status_code, detail = f"Operation {index}: {error.detail}")
+    return body, references
+
+def batch_step(call: Callable[[Any], Any], body: BaseModel, references: dict[str, int], bodies: list[BaseModel]) -> Callable[[list], Any]:
+    def step(results: list) -> Any:
+        #Rows created earlier in the batch hold their ID first
+        resolved: BaseModel = body.model_copy(update = {field: results[source][0] for field, source in references.items()})
+        bodies.append(resolved)
+        return call(resolved)
+    return step
+
+def batch_foreign_keys(operations: list[BatchOperation], bodies: list[BaseModel]) -> Callable[[int], list[tuple[str, int]]]:
+    #Read on the writer thread when an operation fails, its body has been resolved by then
+    def foreign_keys(index: int) -> list[tuple[str, int]]:
+        return [(entity, getattr(bodies[index], field)) for field, entity in BATCH_FOREIGN_KEYS.get(operations[index].op, ())]
+    return foreign_keys
+
+async def raise_batch_error(error: db.BatchError, op: str, body: BaseModel):
+    """Maps the failed operation of a rolled back batch like its single request would, with the operation's index in front"""
+
+    try:
+        if error.error is None:
+            raise HTTPException(status_code = 404, detail = f"Nothing found matching {body.model_dump()}.")
+        if error.missing is not None:
+            entity, entity_id = error.missing
+            raise HTTPException(status_code = 404, detail = f"{entity.title()} with ID {entity_id} not found.")
+        if not isinstance(error.error, sqlite3.IntegrityError):
+            raise error.error
+        if op in ("add_user", "update_user"):
+            raise_user_conflict(error.error, body.username, body.email)
+        elif op in ("add_group", "update_group"):
+            raise_group_conflict(error.error, body.name)
+        elif op == "add_relation":
+            await raise_relation_conflict(error.error, body.user_id, body.group_id)
+        elif op == "add_group_relation":
+            await raise_group_relation_conflict(error.error, body.parent_id, body.child_id)
+        raise HTTPException(status_code = 400, detail = str(error.error))
+    except sqlite3.IntegrityError as integrity_error:
+        detail: str = str(integrity_error)
+        status_code: int = 400
+    except HTTPException as http_error:
+        detail = http_error.detail
+        status_code = http_error.status_code
+    raise HTTPException(status_code = status_code, detail = f"Operation {error.index} ({op}) failed, no operation was applied: {detail}")
+
+def apply_batch_effects(op: str, body: BaseModel):
+    #The membership index and cache updates the single requests make, once the batch has been committed
+    if op == "update_user":
+        user_cache.invalidate(body.user_id)
+        user_relations_cache.invalidate(body.user_id)
+    elif op == "delete_user":
+        #A user too large to delete at once was left to a delete job, woken here instead of at its next poll
+        delete_job_notifier.notify()
+        invalidate_counts((), membership_index.groups_of(body.user_id))
+        membership_index.remove_user(body.user_id)
+        user_cache.invalidate(body.user_id)
+        user_relations_cache.invalidate(body.user_id)
+    elif op == "update_group":
+        group_cache.invalidate(body.group_id)
+        user_relations_cache.invalidate_tag(body.group_id)
+    elif op == "delete_group":
+        delete_job_notifier.notify()
+        invalidate_counts(membership_index.users_of(body.group_id), ())
+        membership_index.remove_group(body.group_id)
+        group_cache.invalidate(body.group_id)
+        user_relations_cache.invalidate_tag(body.group_id)
+    elif op == "add_relation":
+        membership_index.add(body.user_id, body.group_id)
+        user_relations_cache.invalidate(body.user_id)
+        invalidate_counts((body.user_id,), (body.group_id,))
+    elif op == "delete_relation":
+        membership_index.remove(body.user_id, body.group_id)
+        user_relations_cache.invalidate(body.user_id)
+        invalidate_counts((body.user_id,), (body.group_id,))
+
+@app.post("/batch", tags = [TAG_BATCH], response_model = list[BatchResult])
+async def run_batch(operations: list[BatchOperation] = Body(..., min_length = 1, max_length = BATCH_LIMIT_MAX)):
+    """Runs the operations in order in one transaction and returns the result of each.
+    An operation can use the ID a user or group created earlier in the batch got, e.g. {"user_id": "$0"} for the one created by operation 0.
+    If any operation fails, none of them is applied and the error names the failing operation"""
+
+    steps: list[Callable[[list], Any]] = []
+    bodies: list[BaseModel] = []
+    for index, operation in enumerate(operations):
+        body, references = parse_batch_operation(index, operation, operations)
+        steps.append(batch_step(BATCH_OPERATIONS[operation.op][1], body, references, bodies))
+
+    try:
+        results: list = await db.write(db.run_batch, steps, batch_foreign_keys(operations, bodies))
+    except db.BatchError as error:
+        await raise_batch_error(error, operations[error.index].op, bodies[error.index])
+
+    for operation, body in zip(operations, bodies):
+        apply_batch_effects(operation.op, body)
+
+    return [
+        BatchResult(op = operation.op, result = BATCH_OPERATIONS[operation.op][2](result))
+        for operation, result in zip(operations, results)
+    ]
+
+@app.get("/jobs/{job_id}", tags = [TAG_JOBS], response_model = DeleteJob)
+async def get_delete_job(job_id: int):
+    """Returns the progress of deleting a large user or group or only its relations,
+    the job is done once the relations and, for a deleted user or group, the row itself are deleted"""
+
+    db_job: dict | None = await db.read(db.get_delete_job, job_id, True)
+    if db_job is None:
+        raise HTTPException(status_code = 404, detail = f"Job with Job ID {job_id} not found.")
+
+    return encoded_rows(db_job)
+
+async def read_changes(since: int, limit: int) -> tuple[list[dict], int]:
+    """Returns the changes after since and the sequence number to continue from.
+    Raises 410 if changes after since have already been pruned, the client then has to read everything again"""
+
+    changes, oldest, _ = await db.read(db.get_changes, since, limit)
+    if since < oldest - 1:
+        raise HTTPException(status_code = 410, detail = f"Changes after {since} are no longer kept, the oldest kept change is {oldest}.")
+    return changes, changes[-1]["seq"] if changes else since
+
+@app.get("/changes/", tags = [TAG_CHANGES], response_model = ChangePage)
+async def get_changes(
+        since:  int = Query(0, ge = 0, description = "Return changes after this sequence number"),
+        limit:  int = Query(CHANGE_LIMIT_DEFAULT, ge = 1, le = CHANGE_LIMIT_MAX)
+        ):
+    """Returns the changes made after a sequence number, oldest first. Continue from last_seq until no changes come back.
+    A 410 response means the change log no longer reaches back that far and the client has to read everything again"""
+
+    changes, last_seq = await read_changes(since, limit)
+    return encoded_rows(dict(changes = changes, last_seq = last_seq))
+
+async def stream_changes(since: int) -> AsyncIterator[str]:
+    last_sent: float = time.monotonic()
+    while True:
+        try:
+            changes, since = await read_changes(since, CHANGE_LIMIT_MAX)
+        except HTTPException as error:
+            #Fell behind the kept log, the client has to read everything again and then resubscribe
+            yield changefeed.sse_event("reset", dict(detail = error.detail))
+            return
+
+        for change in changes:
+            yield changefeed.sse_event("change", change, change["seq"])
+        if changes:
+            last_sent = time.monotonic()
+        if len(changes) == CHANGE_LIMIT_MAX:
+            continue
+
+        if time.monotonic() - last_sent >= CHANGE_KEEPALIVE_INTERVAL:
+            yield changefeed.SSE_KEEPALIVE
+            last_sent = time.monotonic()
+        await change_notifier.wait(CHANGE_POLL_INTERVAL)
+
+@app.get("/changes/stream", tags = [TAG_CHANGES], response_class = StreamingResponse,
+         responses = {200: {"content": {"text/event-stream": {}}, "description": "Server-Sent Events, one change event per change"}})
+async def subscribe_changes(
+        request:    Request,
+        since:      int | None = Query(None, ge = 0, description = "Send changes after this sequence number, defaults to changes from now on")
+        ):
+    """Streams every change as a Server-Sent Event with the sequence number as its id, so a reconnecting client resumes
+    through Last-Event-ID. A reset event means the client fell behind the kept log and has to read everything again"""
+
+    last_event_id: str | None = request.headers.get("Last-Event-ID")
+    if last_event_id is not None and last_event_id.isdigit():
+        since = int(last_event_id)
+    if since is None:
+        since = await db.read(db.get_last_change_seq)
+
+    #Checked before the stream starts, so a client too far behind gets a plain 410
+    await read_changes(since, 1)
+    return StreamingResponse(stream_changes(since), media_type = "text/event-stream", headers = {"Cache-Control": "no-cache"})
+
+@app.get("/admin/snapshot", tags = [TAG_ADMIN], response_model = SnapshotInfo)
+async def get_snapshot():
+    """Returns the newest database snapshot and its age"""
+
+    path: str | None = await db.run(db.latest_snapshot)
+    if path is None:
+        raise HTTPException(status_code = 404, detail = "No snapshot found.")
+
+    return snapshot_info(path)
+
+@app.post("/admin/snapshot", tags = [TAG_ADMIN], response_model = SnapshotInfo)
+async def add_snapshot():
+    """Writes a consistent snapshot of the database now. The service restores the newest snapshot on startup if its database is empty"""
+
+    try:
+        path: str = await db.run(db.snapshot)
+    except (sqlite3.Error, OSError) as error:
+        raise HTTPException(status_code = 500, detail = f"Snapshot failed: {error}")
+
+    return snapshot_info(path)
+
+@app.get("/admin/cache", tags = [TAG_ADMIN], response_model = list[CacheStats])
+async def get_cache_stats():
+    """Returns size and hit, miss and eviction counters of the lookup caches in this worker"""
+
+    return [CacheStats(**cache.stats()) for cache in CACHES]
+
+@app.get("/admin/admission", tags = [TAG_ADMIN], response_model = list[AdmissionStats])
+async def get_admission_stats():
+    """Returns the concurrency limit, the requests being served and waiting and the rejections of each admission class in this worker"""
+
+    return [AdmissionStats(**limiter.stats()) for limiter in LIMITERS]
+
+@app.get("/metrics", tags = [TAG_ADMIN], response_class = PlainTextResponse)
+async def get_metrics():
+    """Returns request, database and cache metrics of this worker in the Prometheus text format"""
+
+    return PlainTextResponse(metrics.render(), media_type = metrics.CONTENT_TYPE)
+
+def route_limiter(route: APIRoute) -> Limiter | None:
+    if route.path in UNLIMITED_ROUTES:
+        return None
+    if route.methods - {"GET", "HEAD"}:
+        return write_limiter
+    if route.path in POINT_READ_ROUTES:
+        return point_limiter
+    return scan_limiter
 
-    db.delete_group_relations(group_id)
-    return {f"All relations with Group ID {group_id} successfully deleted."}
\ No newline at end of file
+#Wrapped after routing, so a rejected request is still labelled with its route in the metrics
+for route in app.routes:
+    if isinstance(route, APIRoute) and (limiter := route_limiter(route)) is not None:
+        route.app = admission.limit(route.app, limiter)
@@ -0,0 +1,88 @@
+import heapq
+from collections.abc import Iterable
+
+import db
+
+class MembershipIndex:
+    """In-memory copy of the Relations table as integer-set posting lists per group and per user.
+
+    Built from one consistent read of the table and then kept in sync by the write handlers,
+    membership checks and set algebra across groups never touch SQL."""
+
+    def __init__(self):
+        self.group_users: dict[int, set[int]] = {}
+        self.user_groups: dict[int, set[int]] = {}
+        self.version: int = 0
+
+    def load(self, relations: Iterable[tuple[int, int]]) -> None:
+        for user_id, group_id in relations:
+            self.add(user_id, group_id)
+
+    def add(self, user_id: int, group_id: int) -> None:
+        self.group_users.setdefault(group_id, set()).add(user_id)
+        self.user_groups.setdefault(user_id, set()).add(group_id)
+
+    def remove(self, user_id: int, group_id: int) -> None:
+        users: set[int] | None = self.group_users.get(group_id)
+        if users is not None:
+            users.discard(user_id)
+            if not users:
+                del self.group_users[group_id]
+
+        groups: set[int] | None = self.user_groups.get(user_id)
+        if groups is not None:
+            groups.discard(group_id)
+            if not groups:
+                del self.user_groups[user_id]
+
+    def remove_user(self, user_id: int) -> None:
+        for group_id in list(self.user_groups.get(user_id, ())):
+            self.remove(user_id, group_id)
+
+    def remove_group(self, group_id: int) -> None:
+        for user_id in list(self.group_users.get(group_id, ())):
+            self.remove(user_id, group_id)
+
+    def has(self, user_id: int, group_id: int) -> bool:
+        return user_id in self.group_users.get(group_id, ())
+
+    def groups_of(self, user_id: int) -> set[int]:
+        return self.user_groups.get(user_id, set())
+
+    def users_of(self, group_id: int) -> set[int]:
+        return self.group_users.get(group_id, set())
+
+    def query(self, all_of: list[int], any_of: list[int], none_of: list[int]) -> set[int]:
+        #Users in every group of all_of and in at least one group of any_of, minus members of any group in none_of
+        result: set[int] | None = None
+        if all_of:
+            #Intersecting from the smallest posting list keeps every step as small as the final result allows
+            postings: list[set[int]] = sorted((self.users_of(group_id) for group_id in all_of), key = len)
+            result = postings[0].intersection(*postings[1:])
+        if any_of:
+            union: set[int] = set().union(*(self.users_of(group_id) for group_id in any_of))
+            result = union if result is None else result & union
+        if result is None:
+            return set()
+
+        result.difference_update(*(self.users_of(group_id) for group_id in none_of))
+        return result
+
+    def stats(self) -> dict:
+        return dict(
+            version     = self.version,
+            groups      = len(self.group_users),
+            users       = len(self.user_groups),
+            relations   = sum(len(users) for users in self.group_users.values())
+        )
+
+def build_index() -> MembershipIndex:
+    #Blocking, run it through db.read so the whole index comes from one snapshot
+    index: MembershipIndex = MembershipIndex()
+    index.version = db.load_relation_ids(index.load)
+    return index
+
+def smallest(ids: set[int], limit: int) -> list[int]:
+    if len(ids) <= limit:
+        return sorted(ids)
+    return heapq.nsmallest(limit, ids)
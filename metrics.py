@@ -0,0 +1,196 @@
+import bisect
+import threading
+import time
+from collections.abc import Callable
+from contextvars import ContextVar
+from typing import Any
+
+#Metrics in the Prometheus text exposition format, kept per worker process.
+#Observed from the event loop and from the DB threads, so every metric guards its samples with a lock
+CONTENT_TYPE: str = "text/plain; version=0.0.4; charset=utf-8"
+LATENCY_BUCKETS: tuple[float, ...] = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def format_labels(names: tuple[str, ...], values: tuple) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{escape(str(value))}"' for name, value in zip(names, values)) + "}"
+
+class Metric:
+    kind: str = "untyped"
+
+    def __init__(self, name: str, description: str, labels: tuple[str, ...] = ()):
+        self.name: str = name
+        self.description: str = description
+        self.labels: tuple[str, ...] = labels
+        self.lock: threading.Lock = threading.Lock()
+        self.samples: dict[tuple, Any] = {}
+
+    def header(self) -> list[str]:
+        return [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"]
+
+    def render(self) -> list[str]:
+        with self.lock:
+            samples: list[tuple[tuple, Any]] = sorted(self.samples.items())
+        return self.header() + [f"{self.name}{format_labels(self.labels, values)} {value}" for values, value in samples]
+
+class Counter(Metric):
+    kind: str = "counter"
+
+    def inc(self, labels: tuple = (), amount: float = 1) -> None:
+        with self.lock:
+            self.samples[labels] = self.samples.get(labels, 0) + amount
+
+class Gauge(Metric):
+    kind: str = "gauge"
+
+    def inc(self, labels: tuple = (), amount: float = 1) -> None:
+        with self.lock:
+            self.samples[labels] = self.samples.get(labels, 0) + amount
+
+    def dec(self, labels: tuple = (), amount: float = 1) -> None:
+        self.inc(labels, -amount)
+
+class Histogram(Metric):
+    kind: str = "histogram"
+
+    def __init__(self, name: str, description: str, labels: tuple[str, ...] = (), buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, description, labels)
+        self.buckets: tuple[float, ...] = buckets
+
+    def observe(self, labels: tuple, value: float) -> None:
+        #Per label set: a count per bucket (not cumulative, summed up on render), the sum and the total count
+        index: int = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            sample: list | None = self.samples.get(labels)
+            if sample is None:
+                sample = self.samples[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            sample[0][index] += 1
+            sample[1] += value
+            sample[2] += 1
+
+    def render(self) -> list[str]:
+        with self.lock:
+            samples: list[tuple[tuple, list]] = sorted((values, [list(sample[0]), sample[1], sample[2]]) for values, sample in self.samples.items())
+
+        lines: list[str] = self.header()
+        for values, (counts, total, count) in samples:
+            cumulative: int = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le: str = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{self.name}_bucket{format_labels(self.labels + ('le',), values + (le,))} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(self.labels, values)} {total}")
+            lines.append(f"{self.name}_count{format_labels(self.labels, values)} {count}")
+        return lines
+
+class Collector(Metric):
+    """Metric read from elsewhere on every scrape, such as cache statistics the cache already keeps"""
+
+    def __init__(self, name: str, description: str, labels: tuple[str, ...], kind: str, collect: Callable[[], dict[tuple, float]]):
+        super().__init__(name, description, labels)
+        self.kind = kind
+        self.collect: Callable[[], dict[tuple, float]] = collect
+
+    def render(self) -> list[str]:
+        self.samples = self.collect()
+        return super().render()
+
+http_requests: Counter = Counter("userdb_http_requests_total", "HTTP requests by route and status code", ("method", "route", "status"))
+http_in_flight: Gauge = Gauge("userdb_http_requests_in_flight", "HTTP requests currently being served")
+http_duration: Histogram = Histogram("userdb_http_request_duration_seconds", "HTTP request latency until the last body byte was sent", ("method", "route"))
+http_db_seconds: Counter = Counter(
+    "userdb_http_request_db_seconds_total",
+    "Seconds requests spent awaiting the database, including the wait for a free DB thread or the next write batch",
+    ("method", "route")
+)
+
+db_calls: Counter = Counter("userdb_db_calls_total", "Calls of each db.py function", ("function",))
+db_errors: Counter = Counter("userdb_db_errors_total", "Calls of each db.py function that raised", ("function",))
+db_seconds: Counter = Counter("userdb_db_seconds_total", "Seconds spent running each db.py function on a DB thread", ("function",))
+db_rows: Counter = Counter("userdb_db_rows_total", "Rows returned or affected by each db.py function", ("function",))
+
+REGISTRY: list[Metric] = [http_requests, http_in_flight, http_duration, http_db_seconds, db_calls, db_errors, db_seconds, db_rows]
+
+#Database seconds of the request being served, set by the middleware and added to by db.read(), db.run() and db.write()
+_request_db_seconds: ContextVar[list[float] | None] = ContextVar("request_db_seconds", default = None)
+
+def result_rows(result: Any) -> int:
+    #A list counts its rows, a single row counts one, an int or bool is a row count from a write,
+    #bulk inserts return (created rows, conflicts). Anything else, such as a built index, counts none
+    if isinstance(result, (bool, int)):
+        return int(result)
+    if isinstance(result, list):
+        return len(result)
+    if isinstance(result, tuple):
+        return len(result[0]) if result and isinstance(result[0], list) else 1
+    return 0
+
+def timed(func: Callable, *args: Any) -> Any:
+    #Runs func where it is called, on a DB thread, so queueing for the thread is not counted
+    name: str = getattr(func, "__name__", "unnamed")
+    started: float = time.perf_counter()
+    try:
+        result: Any = func(*args)
+    except BaseException:
+        db_errors.inc((name,))
+        raise
+    finally:
+        db_calls.inc((name,))
+        db_seconds.inc((name,), time.perf_counter() - started)
+    db_rows.inc((name,), result_rows(result))
+    return result
+
+def add_request_db_seconds(seconds: float) -> None:
+    spent: list[float] | None = _request_db_seconds.get()
+    if spent is not None:
+        spent[0] += seconds
+
+def register(metric: Metric) -> Metric:
+    REGISTRY.append(metric)
+    return metric
+
+def render() -> str:
+    lines: list[str] = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+class MetricsMiddleware:
+    """Plain ASGI middleware, so streamed responses are timed to their last chunk and the request
+    runs in the same context the database time is collected in"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status: list[int] = [500]
+
+        async def send_status(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        spent: list[float] = [0.0]
+        token = _request_db_seconds.set(spent)
+        http_in_flight.inc()
+        started: float = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            elapsed: float = time.perf_counter() - started
+            http_in_flight.dec()
+            _request_db_seconds.reset(token)
+
+            #Label by route template, unmatched paths share one label so scans cannot blow up the series count
+            route = scope.get("route")
+            route_path: str = getattr(route, "path", "unmatched")
+            http_requests.inc((scope["method"], route_path, status[0]))
+            http_duration.observe((scope["method"], route_path), elapsed)
+            http_db_seconds.inc((scope["method"], route_path), spent[0])
@@ -0,0 +1,30 @@
+import os
+import sys
+import tempfile
+
+#The storage settings are read when db is imported, so they point to a scratch directory before anything imports it
+DATA_DIR: str = tempfile.mkdtemp(prefix = "userdb-tests-")
+os.environ["USERDB_PATH"] = os.path.join(DATA_DIR, "userdb.sqlite3")
+os.environ["USERDB_SNAPSHOT_DIR"] = os.path.join(DATA_DIR, "snapshots")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sqlite3
+
+import pytest
+from fastapi.testclient import TestClient
+
+import db
+import main
+
+@pytest.fixture(scope = "session")
+def client():
+    #One app for the whole run, startup creates the schema. Tests use names of their own instead of a fresh database
+    with TestClient(main.app) as test_client:
+        yield test_client
+
+@pytest.fixture
+def connection():
+    #A connection of the test's own for checking what was committed, outside the app's readers and writer
+    con: sqlite3.Connection = db.connect()
+    yield con
+    con.close()
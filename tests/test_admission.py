@@ -0,0 +1,41 @@
+import asyncio
+
+import main
+from admission import Limiter
+
+def test_limiter_queues_hands_over_and_rejects():
+    async def run():
+        limiter: Limiter = Limiter("test", 1, 1, 0.05, 1.0)
+        assert await limiter.acquire()
+
+        waiting: asyncio.Task = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+        #The queue is full, the next request is rejected at once instead of waiting
+        assert not await limiter.acquire()
+
+        limiter.release()
+        assert await waiting and limiter.active == 1
+
+        #Nothing releases the slot in time, the waiter gives up after the timeout
+        assert not await limiter.acquire()
+        limiter.release()
+        assert limiter.stats() == dict(name = "test", concurrency = 1, queue_size = 1, active = 0, waiting = 0, rejected = 2)
+
+    asyncio.run(run())
+
+def test_full_class_is_shed_with_503_while_others_are_served(client, monkeypatch):
+    user_id: int = client.post("/users/", json = dict(username = "admission-user", email = "admission-user@example.com")).json()["user_id"]
+    rejected: int = main.point_limiter.rejected
+    monkeypatch.setattr(main.point_limiter, "concurrency", 1)
+    monkeypatch.setattr(main.point_limiter, "queue_size", 0)
+    monkeypatch.setattr(main.point_limiter, "active", 1)
+
+    response = client.get(f"/users/{user_id}")
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+    assert response.json()["detail"] == "Too many point requests, try again later."
+
+    #Scans have limits of their own
+    assert client.get("/users/?limit=1").status_code == 200
+    stats: dict = {limiter["name"]: limiter for limiter in client.get("/admin/admission").json()}
+    assert stats["point"]["rejected"] == rejected + 1
@@ -0,0 +1,63 @@
+def test_batch_applies_every_operation(client):
+    response = client.post("/batch", json = [
+        dict(op = "add_user", data = dict(username = "batch-ok", email = "batch-ok@example.com")),
+        dict(op = "add_group", data = dict(name = "batch-ok")),
+        dict(op = "add_relation", data = dict(user_id = "$0", group_id = "$1"))
+    ])
+    assert response.status_code == 200
+    user_id: int = response.json()[0]["result"]["user_id"]
+    group_id: int = response.json()[1]["result"]["group_id"]
+    assert response.json()[2]["result"] == dict(user_id = user_id, group_id = group_id)
+    assert client.get(f"/membership/{user_id}/{group_id}").json()["member"]
+    assert client.get(f"/groups/{group_id}").json()["member_count"] == 1
+
+def test_failed_batch_applies_nothing(client, connection):
+    group_id: int = client.post("/groups/", json = dict(name = "batch-existing")).json()["group_id"]
+    response = client.post("/batch", json = [
+        dict(op = "add_user", data = dict(username = "batch-rolled-back", email = "batch-rolled-back@example.com")),
+        dict(op = "add_relation", data = dict(user_id = "$0", group_id = group_id)),
+        dict(op = "update_group", data = dict(group_id = group_id, name = "batch-renamed")),
+        dict(op = "add_relation", data = dict(user_id = "$0", group_id = group_id))
+    ])
+    assert response.status_code == 400
+    assert response.json()["detail"].startswith("Operation 3 (add_relation) failed, no operation was applied")
+
+    assert connection.execute("SELECT 1 FROM Users WHERE Username = 'batch-rolled-back'").fetchone() is None
+    assert client.get(f"/groups/{group_id}").json() == dict(name = "batch-existing", description = None, group_id = group_id, member_count = 0)
+
+def test_missing_group_is_blamed_not_the_user_created_before_it(client, connection):
+    response = client.post("/batch", json = [
+        dict(op = "add_user", data = dict(username = "batch-blame", email = "batch-blame@example.com")),
+        dict(op = "add_relation", data = dict(user_id = "$0", group_id = 10**9))
+    ])
+    assert response.status_code == 404
+    assert response.json()["detail"].endswith(f"Group with ID {10**9} not found.")
+    assert connection.execute("SELECT 1 FROM Users WHERE Username = 'batch-blame'").fetchone() is None
+
+def test_missing_user_is_blamed_not_the_group_created_before_it(client):
+    response = client.post("/batch", json = [
+        dict(op = "add_group", data = dict(name = "batch-blame")),
+        dict(op = "add_relation", data = dict(user_id = 10**9, group_id = "$0"))
+    ])
+    assert response.status_code == 404
+    assert response.json()["detail"].endswith(f"User with ID {10**9} not found.")
+
+def test_missing_child_is_blamed_not_the_parent_created_before_it(client, connection):
+    response = client.post("/batch", json = [
+        dict(op = "add_group", data = dict(name = "batch-parent")),
+        dict(op = "add_group_relation", data = dict(parent_id = "$0", child_id = 10**9))
+    ])
+    assert response.status_code == 404
+    assert response.json()["detail"].endswith(f"Group with ID {10**9} not found.")
+    assert connection.execute("SELECT 1 FROM UserGroups WHERE Name = 'batch-parent'").fetchone() is None
+
+def test_missing_email_is_a_bad_request_like_in_bulk(client):
+    response = client.post("/users/", json = dict(username = "no-email"))
+    assert response.status_code == 400 and response.json()["detail"] == "Email is required."
+
+    response = client.post("/users/bulk", json = [dict(username = "no-email")])
+    assert response.json()["conflicts"] == [dict(index = 0, detail = "Email is required.")]
+
+    response = client.post("/batch", json = [dict(op = "add_user", data = dict(username = "no-email"))])
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Operation 0 (add_user) failed, no operation was applied: Email is required."
@@ -0,0 +1,50 @@
+import db
+import main
+from cache import LRUCache
+
+def test_result_read_before_an_invalidation_is_not_cached():
+    cache: LRUCache = LRUCache("test", 10, 60)
+    token: int = cache.token()
+    cache.invalidate(1)
+    cache.set(1, "stale", token)
+    assert cache.get(1) is None
+
+    cache.set(1, "fresh", cache.token())
+    assert cache.get(1) == "fresh"
+
+def test_least_recently_used_entry_is_evicted_and_expired_ones_dropped():
+    cache: LRUCache = LRUCache("test", 2, 60)
+    for key in (1, 2):
+        cache.set(key, key, cache.token())
+    cache.get(1)
+    cache.set(3, 3, cache.token())
+    assert (cache.get(1), cache.get(2), cache.get(3)) == (1, None, 3)
+
+    expired: LRUCache = LRUCache("test", 2, -1)
+    expired.set(1, 1, expired.token())
+    assert expired.get(1) is None and expired.stats()["expirations"] == 1
+
+def test_tag_invalidation_drops_every_tagged_entry():
+    cache: LRUCache = LRUCache("test", 10, 60)
+    cache.set(1, "a", cache.token(), tags = (7,))
+    cache.set(2, "b", cache.token(), tags = (7, 8))
+    cache.set(3, "c", cache.token(), tags = (8,))
+    cache.invalidate_tag(7)
+    assert (cache.get(1), cache.get(2), cache.get(3)) == (None, None, "c")
+
+def test_user_read_racing_a_write_is_not_cached(client, monkeypatch):
+    user_id: int = client.post("/users/", json = dict(username = "cache-race", email = "cache-race@example.com")).json()["user_id"]
+    read = db.read
+
+    async def read_then_write(func, *args):
+        #A write to the user lands while its read is in flight, the read's result is already out of date
+        row = await read(func, *args)
+        if func is db.get_user:
+            await db.write(db.update_user, ["FirstName = ?"], ["Changed", user_id])
+            main.user_cache.invalidate(user_id)
+        return row
+
+    monkeypatch.setattr(db, "read", read_then_write)
+    assert client.get(f"/users/{user_id}").json()["first_name"] is None
+    monkeypatch.setattr(db, "read", read)
+    assert client.get(f"/users/{user_id}").json()["first_name"] == "Changed"
@@ -0,0 +1,32 @@
+import main
+
+def member(client, user_id: int, group_id: int) -> bool:
+    return client.get(f"/membership/{user_id}/{group_id}").json()["member"]
+
+def test_index_follows_changes_another_worker_made(client, connection):
+    #Rows written past this app's writer, as another worker would, reach its index only through the change log
+    user_id: int = client.post("/users/", json = dict(username = "sync-user", email = "sync-user@example.com")).json()["user_id"]
+    group_ids: list[int] = [client.post("/groups/", json = dict(name = f"sync-{index}")).json()["group_id"] for index in range(2)]
+
+    since: int = connection.execute("SELECT MAX(Seq) FROM Changes").fetchone()[0]
+    connection.executemany("INSERT INTO Relations (UserID, GroupID) VALUES (?, ?)", [(user_id, group_id) for group_id in group_ids])
+    connection.commit()
+    client.portal.call(main.sync_changes)
+    assert member(client, user_id, group_ids[0]) and member(client, user_id, group_ids[1])
+    assert client.get(f"/users/{user_id}").json()["group_count"] == 2
+
+    connection.execute("DELETE FROM Relations WHERE UserID = ? AND GroupID = ?", (user_id, group_ids[0]))
+    connection.commit()
+    client.portal.call(main.sync_changes)
+    assert not member(client, user_id, group_ids[0]) and member(client, user_id, group_ids[1])
+
+    #A hidden user leaves every group at once, its relations are left to its delete job
+    connection.execute("UPDATE Users SET DeletedAt = strftime('%s', 'now') WHERE UserID = ?", (user_id,))
+    connection.commit()
+    client.portal.call(main.sync_changes)
+    assert not member(client, user_id, group_ids[1])
+
+    changes: list[dict] = client.get(f"/changes/?since={since}").json()["changes"]
+    assert [(change["entity"], change["operation"]) for change in changes] == [
+        ("relation", "insert"), ("relation", "insert"), ("relation", "delete"), ("user", "delete")
+    ]
@@ -0,0 +1,42 @@
+from compression import negotiate
+
+def test_negotiate_picks_the_highest_weight_and_honours_refusals():
+    assert negotiate("gzip;q=0.5, zstd", ["zstd", "gzip"]) == "zstd"
+    assert negotiate("gzip, zstd;q=0.1", ["zstd", "gzip"]) == "gzip"
+    assert negotiate("gzip, zstd", ["zstd", "gzip"]) == "zstd"
+    assert negotiate("*", ["gzip"]) == "gzip"
+    assert negotiate("gzip;q=0", ["gzip"]) is None
+    assert negotiate("br", ["zstd", "gzip"]) is None
+    assert negotiate("", ["gzip"]) is None
+
+def test_large_responses_are_compressed_when_accepted(client):
+    for index in range(30):
+        client.post("/users/", json = dict(username = f"compress-{index:02d}", first_name = "Compressed", last_name = "Response",
+                                           email = f"compress-{index:02d}@example.com"))
+    url: str = "/users/?username_prefix=compress-&limit=100"
+
+    plain = client.get(url, headers = {"Accept-Encoding": "identity"})
+    assert "Content-Encoding" not in plain.headers and "Accept-Encoding" in plain.headers["Vary"]
+    assert len(plain.content) >= 1024
+
+    compressed = client.get(url, headers = {"Accept-Encoding": "gzip"})
+    assert compressed.headers["Content-Encoding"] == "gzip"
+    assert int(compressed.headers["Content-Length"]) < len(plain.content)
+    assert compressed.json() == plain.json()
+
+    assert "Content-Encoding" not in client.get(url, headers = {"Accept-Encoding": "gzip;q=0"}).headers
+
+def test_streamed_export_is_compressed(client):
+    for index in range(30):
+        client.post("/users/", json = dict(username = f"compress-export-{index:02d}", email = f"compress-export-{index:02d}@example.com"))
+    url: str = "/users/export?username_prefix=compress-export-"
+
+    plain = client.get(url, headers = {"Accept-Encoding": "identity"})
+    compressed = client.get(url, headers = {"Accept-Encoding": "gzip"})
+    assert compressed.headers["Content-Encoding"] == "gzip" and "Content-Length" not in compressed.headers
+    assert compressed.content == plain.content and len(plain.text.splitlines()) == 30
+
+def test_small_responses_are_sent_as_they_are(client):
+    user_id: int = client.post("/users/", json = dict(username = "compress-small", email = "compress-small@example.com")).json()["user_id"]
+    response = client.get(f"/users/{user_id}", headers = {"Accept-Encoding": "gzip"})
+    assert "Content-Encoding" not in response.headers and response.json()["username"] == "compress-small"
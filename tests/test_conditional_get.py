@@ -0,0 +1,27 @@
+def test_user_etag_follows_the_row_version(client):
+    user_id: int = client.post("/users/", json = dict(username = "etag-user", email = "etag-user@example.com")).json()["user_id"]
+    etag: str = client.get(f"/users/{user_id}").headers["ETag"]
+
+    response = client.get(f"/users/{user_id}", headers = {"If-None-Match": etag})
+    assert response.status_code == 304 and response.headers["ETag"] == etag and response.content == b""
+    #Weak comparison, a strong tag of the same value matches too
+    assert client.get(f"/users/{user_id}", headers = {"If-None-Match": etag.removeprefix("W/")}).status_code == 304
+
+    assert client.patch(f"/users/{user_id}", json = dict(user_id = user_id, first_name = "Changed")).status_code == 200
+    response = client.get(f"/users/{user_id}", headers = {"If-None-Match": etag})
+    assert response.status_code == 200 and response.headers["ETag"] != etag
+    assert response.json()["first_name"] == "Changed"
+
+def test_list_validators_change_with_any_write_to_the_table(client):
+    assert client.post("/groups/", json = dict(name = "etag-group")).status_code == 200
+    response = client.get("/groups/?limit=10")
+    etag: str = response.headers["ETag"]
+    last_modified: str = response.headers["Last-Modified"]
+
+    response = client.get("/groups/?limit=10", headers = {"If-None-Match": f'W/"other", {etag}'})
+    assert response.status_code == 304
+    assert (response.headers["ETag"], response.headers["Last-Modified"]) == (etag, last_modified)
+
+    assert client.post("/groups/", json = dict(name = "etag-other-group")).status_code == 200
+    response = client.get("/groups/?limit=10", headers = {"If-None-Match": etag})
+    assert response.status_code == 200 and response.headers["ETag"] != etag
@@ -0,0 +1,134 @@
+import logging
+import time
+
+import pytest
+
+import db
+import main
+
+@pytest.fixture(autouse = True)
+def small_chunks(monkeypatch):
+    #Three relations take a job of two steps, the last one short
+    monkeypatch.setattr(db, "DELETE_CHUNK_SIZE", 2)
+
+def add_users(client, prefix: str, count: int) -> list[int]:
+    return [
+        client.post("/users/", json = dict(username = f"{prefix}-{index}", email = f"{prefix}-{index}@example.com")).json()["user_id"]
+        for index in range(count)
+    ]
+
+def add_groups(client, prefix: str, count: int) -> list[int]:
+    return [client.post("/groups/", json = dict(name = f"{prefix}-{index}")).json()["group_id"] for index in range(count)]
+
+def relate(client, user_ids: list[int], group_ids: list[int]):
+    for user_id in user_ids:
+        for group_id in group_ids:
+            assert client.post("/relations/", json = dict(user_id = user_id, group_id = group_id)).status_code == 200
+
+def wait_for_job(client, job_id: int) -> dict:
+    #The app's own delete job loop runs the job, woken by the delete request
+    deadline: float = time.monotonic() + 5
+    while (job := client.get(f"/jobs/{job_id}").json())["status"] != "done":
+        assert time.monotonic() < deadline, job
+        time.sleep(0.02)
+    return job
+
+def test_hidden_user_leaves_reads_and_counts_at_once(client, connection):
+    user_id, other_id = add_users(client, "job-user", 2)
+    group_ids: list[int] = add_groups(client, "job-user", 3)
+    relate(client, [user_id, other_id], group_ids)
+
+    response = client.delete(f"/users/{user_id}")
+    assert response.status_code == 202
+    assert response.headers["Location"] == f"/jobs/{response.json()['job_id']}"
+    assert response.json()["entity"] == "user" and response.json()["total"] == 3
+
+    assert client.get(f"/users/{user_id}").status_code == 404
+    for group_id in group_ids:
+        assert client.get(f"/groups/{group_id}").json()["member_count"] == 1
+        assert [user["user_id"] for user in client.get(f"/relations/group/{group_id}/users").json()] == [other_id]
+
+    job: dict = wait_for_job(client, response.json()["job_id"])
+    assert job["deleted"] == 3 and job["finished"] is not None
+    assert connection.execute("SELECT 1 FROM Users WHERE UserID = ?", (user_id,)).fetchone() is None
+    assert connection.execute("SELECT 1 FROM Relations WHERE UserID = ?", (user_id,)).fetchone() is None
+
+def test_hidden_group_leaves_reads_and_counts_at_once(client, connection):
+    user_ids: list[int] = add_users(client, "job-group", 3)
+    group_id, other_id = add_groups(client, "job-group", 2)
+    relate(client, user_ids, [group_id, other_id])
+
+    response = client.delete(f"/groups/{group_id}")
+    assert response.status_code == 202
+    assert response.json()["entity"] == "group" and response.json()["total"] == 3
+
+    assert client.get(f"/groups/{group_id}").status_code == 404
+    for user_id in user_ids:
+        assert client.get(f"/users/{user_id}").json()["group_count"] == 1
+        assert [group["group_id"] for group in client.get(f"/relations/user/{user_id}").json()] == [other_id]
+
+    wait_for_job(client, response.json()["job_id"])
+    assert connection.execute("SELECT 1 FROM UserGroups WHERE GroupID = ?", (group_id,)).fetchone() is None
+
+def test_steps_delete_chunks_then_the_row(client, monkeypatch):
+    user_id: int = add_users(client, "job-steps", 1)[0]
+    relate(client, [user_id], add_groups(client, "job-steps", 3))
+
+    #What each step deleted and whether the user row was still there when the step committed
+    steps: list[tuple[str, int, bool]] = []
+    run_delete_job_step = db.run_delete_job_step
+
+    def recorded_step(job_id: int):
+        step: tuple | None = run_delete_job_step(job_id)
+        if step is not None:
+            row: tuple | None = db.cursor().execute("SELECT 1 FROM Users WHERE UserID = ?", (user_id,)).fetchone()
+            steps.append((step[0][3], len(step[1]), row is not None))
+        return step
+
+    monkeypatch.setattr(db, "run_delete_job_step", recorded_step)
+    wait_for_job(client, client.delete(f"/users/{user_id}").json()["job_id"])
+    assert steps == [("running", 2, True), ("done", 1, False)]
+
+@pytest.mark.parametrize("entity", ["user", "group"])
+def test_relation_jobs_leave_the_row(client, connection, entity: str):
+    user_ids: list[int] = add_users(client, f"job-{entity}-relations", 3)
+    group_ids: list[int] = add_groups(client, f"job-{entity}-relations", 3)
+    relate(client, user_ids, group_ids)
+    entity_id: int = user_ids[0] if entity == "user" else group_ids[0]
+
+    response = client.delete(f"/relations/{entity}/{entity_id}")
+    assert response.status_code == 202
+    assert response.json()["entity"] == f"{entity}_relations"
+
+    job: dict = wait_for_job(client, response.json()["job_id"])
+    assert job["deleted"] == 3
+    if entity == "user":
+        assert client.get(f"/users/{entity_id}").json()["group_count"] == 0
+        assert all(client.get(f"/groups/{group_id}").json()["member_count"] == 2 for group_id in group_ids)
+    else:
+        assert client.get(f"/groups/{entity_id}").json()["member_count"] == 0
+        assert all(client.get(f"/users/{user_id}").json()["group_count"] == 2 for user_id in user_ids)
+    key: str = "UserID" if entity == "user" else "GroupID"
+    assert connection.execute(f"SELECT 1 FROM Relations WHERE {key} = ?", (entity_id,)).fetchone() is None
+
+def test_failing_step_is_logged_and_the_loop_goes_on(client, monkeypatch, caplog):
+    user_id: int = add_users(client, "job-failing", 1)[0]
+    relate(client, [user_id], add_groups(client, "job-failing", 3))
+
+    failures: list[int] = []
+    run_delete_job_step = db.run_delete_job_step
+
+    def failing_once(job_id: int):
+        if not failures:
+            failures.append(job_id)
+            raise RuntimeError("delete step failed")
+        return run_delete_job_step(job_id)
+
+    monkeypatch.setattr(db, "run_delete_job_step", failing_once)
+    monkeypatch.setattr(main, "DELETE_POLL_INTERVAL", 0.05)
+    with caplog.at_level(logging.ERROR, logger = "userdb"):
+        job: dict = wait_for_job(client, client.delete(f"/users/{user_id}").json()["job_id"])
+
+    assert failures == [job["job_id"]] and job["deleted"] == 3
+    assert [record.getMessage() for record in caplog.records if record.name == "userdb"] == ["Delete job failed"]
+    assert not main.app.state.delete_job_task.done()
@@ -0,0 +1,61 @@
+import random
+import sqlite3
+
+import pytest
+
+def path_counts(groups: set[int], edges: set[tuple[int, int]]) -> dict[tuple[int, int], int]:
+    #Brute force: the number of distinct paths from every group to every group below it, a group reaching itself once
+    children: dict[int, list[int]] = {group: [] for group in groups}
+    for parent, child in edges:
+        children[parent].append(child)
+
+    def paths(ancestor: int, descendant: int) -> int:
+        if ancestor == descendant:
+            return 1
+        return sum(paths(child, descendant) for child in children[ancestor])
+
+    counts: dict[tuple[int, int], int] = {}
+    for ancestor in groups:
+        for descendant in groups:
+            if count := paths(ancestor, descendant):
+                counts[(ancestor, descendant)] = count
+    return counts
+
+def closure_rows(connection: sqlite3.Connection, groups: set[int]) -> dict[tuple[int, int], int]:
+    rows: list = connection.execute("SELECT AncestorID, DescendantID, Paths FROM GroupClosure").fetchall()
+    return {(ancestor, descendant): paths for ancestor, descendant, paths in rows if ancestor in groups or descendant in groups}
+
+@pytest.mark.parametrize("seed", [1, 2, 3])
+def test_closure_matches_brute_force_path_count(client, connection, seed: int):
+    rng: random.Random = random.Random(seed)
+    groups: set[int] = set()
+    edges: set[tuple[int, int]] = set()
+    for index in range(10):
+        response = client.post("/groups/", json = dict(name = f"closure-{seed}-{index}"))
+        assert response.status_code == 200
+        groups.add(response.json()["group_id"])
+
+    for step in range(150):
+        action: float = rng.random()
+        if action < 0.6:
+            parent, child = rng.choice(sorted(groups)), rng.choice(sorted(groups))
+            response = client.post("/relations/groups/", json = dict(parent_id = parent, child_id = child))
+            #Refused exactly when the edge exists already or the parent is the child or below it
+            refused: bool = (parent, child) in edges or (child, parent) in path_counts(groups, edges)
+            assert response.status_code == (400 if refused else 200), response.json()
+            if not refused:
+                edges.add((parent, child))
+        elif action < 0.9 and edges:
+            parent, child = rng.choice(sorted(edges))
+            response = client.request("DELETE", "/relations/groups/", json = dict(parent_id = parent, child_id = child))
+            assert response.status_code == 200
+            edges.remove((parent, child))
+        else:
+            group: int = rng.choice(sorted(groups))
+            assert client.delete(f"/groups/{group}").status_code == 200
+            groups.remove(group)
+            edges = {edge for edge in edges if group not in edge}
+            response = client.post("/groups/", json = dict(name = f"closure-{seed}-step-{step}"))
+            groups.add(response.json()["group_id"])
+
+        assert closure_rows(connection, groups) == path_counts(groups, edges), f"step {step}"
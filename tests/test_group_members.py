@@ -0,0 +1,55 @@
+import random
+
+def effective_members(group: int, edges: set[tuple[int, int]], members: dict[int, set[int]]) -> list[int]:
+    #Brute force: the union of the group's own members and those of every group below it
+    below: set[int] = {group}
+    while grown := {child for parent, child in edges if parent in below} - below:
+        below |= grown
+    return sorted(set().union(*(members[descendant] for descendant in below)))
+
+def page_all(client, group: int, limit: int) -> list[int]:
+    user_ids: list[int] = []
+    after: str = ""
+    while True:
+        response = client.get(f"/relations/group/{group}/users?effective=true&limit={limit}{after}")
+        if response.status_code == 404:
+            return user_ids
+        assert response.status_code == 200
+        page: list[int] = [user["user_id"] for user in response.json()]
+        assert len(page) <= limit and page[0] > (user_ids[-1] if user_ids else -1)
+        user_ids += page
+        if len(page) < limit:
+            return user_ids
+        after = f"&after_id={page[-1]}"
+
+def test_effective_members_pages_match_brute_force_union(client, connection):
+    rng: random.Random = random.Random(7)
+    groups: list[int] = [client.post("/groups/", json = dict(name = f"members-{index}")).json()["group_id"] for index in range(6)]
+    users: list[int] = [
+        client.post("/users/", json = dict(username = f"members-{index}", email = f"members-{index}@example.com")).json()["user_id"]
+        for index in range(30)
+    ]
+
+    #A diamond below the first group and a chain beside it, so members reach the top through more than one path
+    edges: set[tuple[int, int]] = {(groups[0], groups[1]), (groups[0], groups[2]), (groups[1], groups[3]), (groups[2], groups[3]),
+                                   (groups[3], groups[4]), (groups[5], groups[4])}
+    for parent, child in sorted(edges):
+        assert client.post("/relations/groups/", json = dict(parent_id = parent, child_id = child)).status_code == 200
+
+    members: dict[int, set[int]] = {group: set() for group in groups}
+    for user in users:
+        for group in rng.sample(groups, rng.randint(0, 3)):
+            assert client.post("/relations/", json = dict(user_id = user, group_id = group)).status_code == 200
+            members[group].add(user)
+
+    #A user hidden before its delete job reached its relations is no longer anyone's member
+    hidden: int = next(user for user in users if user in members[groups[4]])
+    connection.execute("UPDATE Users SET DeletedAt = strftime('%s', 'now') WHERE UserID = ?", (hidden,))
+    connection.commit()
+    for group in groups:
+        members[group].discard(hidden)
+
+    for group in groups:
+        expected: list[int] = effective_members(group, edges, members)
+        for limit in (1, 3, 7, 100):
+            assert page_all(client, group, limit) == expected, f"group {group} limit {limit}"
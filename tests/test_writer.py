@@ -0,0 +1,50 @@
+import sqlite3
+import threading
+from concurrent.futures import Future
+
+import pytest
+
+import db
+
+def submit(func, *args) -> Future:
+    #Queues a write the way db.write does, without an event loop to await it on
+    db.start_writer()
+    future: Future = Future()
+    db._write_queue.put((func, args, future))
+    return future
+
+def add_user_then_fail(username: str):
+    db.add_user(username, None, None, f"{username}@example.com")
+    raise ValueError("write failed after its insert")
+
+def test_failing_write_only_undoes_itself(client, connection):
+    #The gate holds the writer in one batch while the others queue up, so all of them are committed together in the next one
+    started: threading.Event = threading.Event()
+    gate: threading.Event = threading.Event()
+    blocker: Future = submit(lambda: started.set() or gate.wait(5))
+    assert started.wait(5)
+
+    first: Future = submit(db.add_user, "savepoint-a", None, None, "savepoint-a@example.com")
+    duplicate: Future = submit(db.add_user, "savepoint-a", None, None, "savepoint-other@example.com")
+    failing: Future = submit(add_user_then_fail, "savepoint-c")
+    last: Future = submit(db.add_user, "savepoint-b", None, None, "savepoint-b@example.com")
+    gate.set()
+
+    assert blocker.result(5)
+    assert first.result(5)[1] == "savepoint-a"
+    with pytest.raises(sqlite3.IntegrityError):
+        duplicate.result(5)
+    with pytest.raises(ValueError):
+        failing.result(5)
+    assert last.result(5)[1] == "savepoint-b"
+
+    rows: list = connection.execute("SELECT Username, Email FROM Users WHERE Username LIKE 'savepoint-%' ORDER BY Username").fetchall()
+    assert rows == [("savepoint-a", "savepoint-a@example.com"), ("savepoint-b", "savepoint-b@example.com")]
+
+def test_write_after_a_failed_write_is_committed(client, connection):
+    #A failed write must not leave the writer's transaction open or its lock held
+    with pytest.raises(sqlite3.IntegrityError):
+        submit(db.add_relation, 10**9, 10**9).result(5)
+
+    row: tuple = submit(db.add_group, "savepoint-group", None).result(5)
+    assert connection.execute("SELECT Name FROM UserGroups WHERE GroupID = ?", (row[0],)).fetchone() == ("savepoint-group",)